@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+"""
+Benchmark the phases of ``setup.py clean`` on a synthetic source tree.
+
+The tree is generated from a fixed random seed so that runs are
+comparable between releases.  It contains a source package with
+``__pycache__`` directories at every level, a virtual environment,
+build and distribution directories, and the usual clutter (version
+control data, tox environments, node modules) that discovery should
+not descend into.
+
+Each phase -- gathering command attributes, discovering targets,
+measuring disk usage, and removing targets -- is timed separately
+for each of the available code paths and the results are written as
+a JSON document.
+
+"""
+from distutils import dir_util
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import setupext_janitor
+from setupext_janitor import (
+    cache, discovery, filesystem, janitor, removal, usage)
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+PAYLOAD = b'# generated by benchmarks.py\n'
+
+
+def _write(path, rng, size=None):
+    with open(path, 'wb') as f:
+        if size is None:
+            f.write(PAYLOAD * rng.randint(1, 16))
+        else:
+            f.write(b'\0' * size)
+
+
+def _make_tree(base, files, rng, depth, fanout=4, pycache=True,
+               suffix='.py'):
+    """Create a nested tree of roughly `files` files under `base`."""
+    dirs, level = [base], [base]
+    for _ in range(depth):
+        level = [os.path.join(d, 'd{0}'.format(i))
+                 for d in level for i in range(rng.randint(1, fanout))]
+        dirs.extend(level)
+    per_file = 2 if pycache else 1
+    per_dir = max(1, files // (len(dirs) * per_file))
+
+    created = 0
+    for dir_name in dirs:
+        os.makedirs(os.path.join(dir_name, '__pycache__')
+                    if pycache else dir_name)
+        for n in range(per_dir):
+            _write(os.path.join(dir_name, 'm{0}{1}'.format(n, suffix)), rng)
+            if pycache:
+                _write(os.path.join(dir_name, '__pycache__',
+                                    'm{0}.cpython-38.pyc'.format(n)), rng)
+            created += per_file
+        if created >= files:
+            break
+    return created
+
+
+def make_project(root, files, seed=0, dist_size=1 << 20):
+    """
+    Generate a synthetic project under `root`.
+
+    :param str root: directory to generate the project in
+    :param int files: approximate number of files to generate
+    :param int seed: seed for the random number generator
+    :param int dist_size: size of each distribution archive
+    :returns: the number of files that were generated
+
+    """
+    rng = random.Random(seed)
+    created = 0
+
+    created += _make_tree(os.path.join(root, 'src', 'pkg'),
+                          files * 20 // 100, rng, depth=6)
+    os.makedirs(os.path.join(root, 'pkg.egg-info'))
+    _write(os.path.join(root, 'pkg.egg-info', 'PKG-INFO'), rng)
+
+    env = os.path.join(root, 'env')
+    site_packages = os.path.join(env, 'lib', 'python3.8', 'site-packages')
+    os.makedirs(os.path.join(env, 'bin'))
+    _write(os.path.join(env, 'pyvenv.cfg'), rng)
+    for n in range(40):
+        created += _make_tree(
+            os.path.join(site_packages, 'dep{0}'.format(n)),
+            files * 40 // 100 // 40, rng, depth=4)
+
+    created += _make_tree(os.path.join(root, 'build', 'lib', 'pkg'),
+                          files * 10 // 100, rng, depth=6, pycache=False)
+    created += _make_tree(os.path.join(root, 'build', 'temp.linux'),
+                          files * 10 // 100, rng, depth=6, pycache=False,
+                          suffix='.o')
+    os.makedirs(os.path.join(root, 'dist'))
+    for n in range(5):
+        _write(os.path.join(root, 'dist', 'pkg-{0}.tar.gz'.format(n)),
+               rng, size=dist_size)
+        created += 1
+
+    created += _make_tree(os.path.join(root, '.git', 'objects'),
+                          files * 10 // 100, rng, depth=2, fanout=16,
+                          pycache=False, suffix='')
+    created += _make_tree(os.path.join(root, '.tox', 'py38', 'lib'),
+                          files * 5 // 100, rng, depth=4)
+    _write(os.path.join(root, '.tox', 'py38', 'pyvenv.cfg'), rng)
+    created += _make_tree(os.path.join(root, 'node_modules'),
+                          files * 5 // 100, rng, depth=5, pycache=False,
+                          suffix='.js')
+    return created
+
+
+def make_memory_project(fs, root, files, seed=0):
+    """
+    Generate a synthetic project in a memory file system.
+
+    :param fs: the :class:`~setupext_janitor.filesystem.MemoryFilesystem`
+    :param str root: directory to generate the project in
+    :param int files: approximate number of files to generate
+    :param int seed: seed for the random number generator
+    :returns: the number of files that were generated
+
+    The tree has the same shape as the one :func:`make_project`
+    creates on disk without the distribution archives.
+
+    """
+    rng = random.Random(seed)
+    created = 0
+    for name, share, pycache in (('src', 6, True), ('build', 2, False),
+                                 ('env', 2, True)):
+        dirs, level = [os.path.join(root, name)], [os.path.join(root, name)]
+        for _ in range(4):
+            level = [os.path.join(d, 'd{0}'.format(i))
+                     for d in level for i in range(rng.randint(1, 4))]
+            dirs.extend(level)
+        per_dir = max(1, files * share // (10 * len(dirs) * 2))
+        for dir_name in dirs:
+            fs.add_directory(dir_name)
+            for n in range(per_dir):
+                fs.add_file(os.path.join(dir_name, 'm{0}.py'.format(n)),
+                            size=rng.randint(64, 4096))
+                if pycache:
+                    fs.add_file(os.path.join(
+                        dir_name, '__pycache__',
+                        'm{0}.cpython-38.pyc'.format(n)),
+                        size=rng.randint(64, 4096))
+            created += per_dir * (2 if pycache else 1)
+    return created
+
+
+def legacy_pycache_walk(root):
+    """The unpruned :func:`os.walk` that ``--pycache`` used to use."""
+    found = set()
+    for dir_path, dirs, _ in os.walk(root):
+        if '__pycache__' in dirs:
+            found.add(os.path.join(dir_path, '__pycache__'))
+    return found
+
+
+def pycache_rules():
+    return [discovery.Rule('pycache', lambda name: name == '__pycache__',
+                           dirs_only=True)]
+
+
+def all_rules(root):
+    return pycache_rules() + [
+        discovery.Rule('eggs', discovery.compile_patterns(['*.egg-info']),
+                       directory=root),
+        discovery.Rule('eggs',
+                       discovery.compile_patterns(['*.egg', '*.eggs']),
+                       directory=root),
+    ]
+
+
+def removal_targets(root):
+    targets = [os.path.join(root, name)
+               for name in ('build', 'dist', 'env', 'pkg.egg-info')]
+    targets.extend(target.path for target in discovery.discover(
+        root, pycache_rules(), skip=targets))
+    return targets
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    saved = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(saved)
+
+
+class Benchmark(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.results = []
+        self.base_dir = options.directory or tempfile.mkdtemp()
+        self.root = os.path.join(self.base_dir, 'project')
+
+    def log(self, message):
+        if not self.options.quiet:
+            sys.stderr.write(message + '\n')
+
+    def record(self, phase, variant, seconds, **counts):
+        result = {'phase': phase, 'variant': variant, 'seconds': seconds}
+        result.update(counts)
+        self.results.append(result)
+        self.log('{0:<10} {1:<28} {2:8.3f}s {3}'.format(
+            phase, variant, seconds, ' '.join(
+                '{0}={1}'.format(k, v) for k, v in sorted(counts.items()))))
+
+    def generate(self):
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        start = timer()
+        files = make_project(self.root, self.options.files,
+                             seed=self.options.seed,
+                             dist_size=self.options.dist_size)
+        self.log('generated {0} files in {1:.3f}s'.format(
+            files, timer() - start))
+        return files
+
+    def time(self, func, setup=None):
+        """Return the fastest time and the result of calling `func`.
+
+        If `setup` is specified, then it is called before each run
+        and its result is passed to `func`.
+
+        """
+        best, result = None, None
+        for _ in range(self.options.repeat):
+            args = () if setup is None else (setup(),)
+            start = timer()
+            result = func(*args)
+            elapsed = timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def bench_gathering(self):
+        from setuptools import dist
+
+        project = os.path.join(self.base_dir, 'gather')
+        if not os.path.isdir(project):
+            os.makedirs(project)
+        with open(os.path.join(project, 'setup.py'), 'w') as f:
+            f.write('import setuptools\nsetuptools.setup()\n')
+
+        def gather():
+            distribution = dist.Distribution(
+                {'name': 'bench', 'script_name': 'setup.py',
+                 'packages': []})
+            build = janitor._gather_attributes(
+                distribution, lambda cmd_name: cmd_name.startswith('build'),
+                'build_base', 'build_clib', 'build_dir', 'build_lib',
+                'build_temp')
+            dist_dirs = janitor._gather_attributes(
+                distribution, lambda cmd_name: 'dist' in cmd_name,
+                'dist_dir')
+            return distribution, build | dist_dirs
+
+        cache_file = os.path.join(project, 'cache.json')
+
+        def cached():
+            distribution = dist.Distribution(
+                {'name': 'bench', 'script_name': 'setup.py',
+                 'packages': []})
+            attribute_cache = cache.AttributeCache(
+                cache_file, cache.fingerprint(distribution))
+            return (attribute_cache.get('build') or set()) | (
+                attribute_cache.get('dist') or set())
+
+        with working_directory(project):
+            seconds, (distribution, dir_names) = self.time(gather)
+            self.record('gathering', 'finalize-commands', seconds,
+                        directories=len(dir_names))
+            attribute_cache = cache.AttributeCache(
+                cache_file, cache.fingerprint(dist.Distribution(
+                    {'name': 'bench', 'script_name': 'setup.py',
+                     'packages': []})))
+            attribute_cache.set('build', dir_names)
+            attribute_cache.save()
+            seconds, dir_names = self.time(cached)
+            self.record('gathering', 'cached', seconds,
+                        directories=len(dir_names))
+
+    def bench_discovery(self):
+        variants = [
+            ('os.walk', lambda: legacy_pycache_walk(self.root)),
+            ('discover-pycache', lambda: list(discovery.discover(
+                self.root, pycache_rules()))),
+            ('discover-pycache-no-prune', lambda: list(discovery.discover(
+                self.root, pycache_rules(), prune=()))),
+            ('discover-all', lambda: list(discovery.discover(
+                self.root, all_rules(self.root)))),
+        ]
+        for variant, func in variants:
+            seconds, found = self.time(func)
+            self.record('discovery', variant, seconds, targets=len(found))
+
+    def bench_usage(self):
+        targets = removal_targets(self.root)
+        for jobs in sorted(set([1, self.options.jobs])):
+            seconds, measured = self.time(
+                lambda: usage.measure(targets, jobs))
+            self.record('usage', 'measure-jobs-{0}'.format(jobs), seconds,
+                        bytes=sum(u.bytes for u in measured.values()),
+                        inodes=sum(u.inodes for u in measured.values()))
+
+    def bench_removal(self):
+        trash_dir = os.path.join(self.base_dir, 'trash')
+
+        def setup():
+            self.generate()
+            return removal_targets(self.root)
+
+        def remove_tree(targets):
+            for target in targets:
+                dir_util.remove_tree(target, verbose=0)
+
+        fs = os
+        if self.options.latency:
+            fs = filesystem.LatencyFilesystem(self.options.latency)
+
+        def remover(name, jobs):
+            def remove(targets):
+                instance = removal.REMOVERS[name](jobs=jobs, fs=fs)
+                for target in targets:
+                    instance.purge(target)
+            return remove
+
+        def trash(targets):
+            remover = removal.Trash(trash_dir, removal.TreeRemover())
+            for target in targets:
+                remover.remove(target)
+
+        variants = []
+        if not self.options.latency:
+            variants.append(('remove_tree', remove_tree))
+        for name in sorted(removal.REMOVERS):
+            if name == 'fd' and self.options.latency:
+                continue  # descriptor removal bypasses the latency shim
+            for jobs in sorted(set([1, self.options.jobs])):
+                variants.append(('{0}-jobs-{1}'.format(name, jobs),
+                                 remover(name, jobs)))
+        variants.append(('trash-rename', trash))
+        for variant, func in variants:
+            seconds, _ = self.time(func, setup=setup)
+            self.record('removal', variant, seconds)
+            removal.empty_trash(trash_dir, jobs=self.options.jobs)
+
+    def bench_memory(self):
+        root = os.path.join(os.sep, 'project')
+
+        def generate():
+            fs = filesystem.MemoryFilesystem()
+            make_memory_project(fs, root, self.options.files,
+                                seed=self.options.seed)
+            if self.options.latency:
+                return fs, filesystem.LatencyFilesystem(
+                    self.options.latency, fs=fs)
+            return fs, fs
+
+        start = timer()
+        fs, _ = generate()
+        self.log('generated {0} entries in memory in {1:.3f}s'.format(
+            fs.count(), timer() - start))
+
+        def discover(fs):
+            return list(discovery.discover(root, pycache_rules(), fs=fs))
+
+        seconds, found = self.time(lambda filesystems: discover(
+            filesystems[1]), setup=generate)
+        self.record('memory', 'discover-pycache', seconds,
+                    targets=len(found))
+
+        def remover(name, jobs):
+            def remove(filesystems):
+                memory, fs = filesystems
+                instance = removal.REMOVERS[name](jobs=jobs, fs=fs)
+                for target in [os.path.join(root, 'build'),
+                               os.path.join(root, 'env')]:
+                    instance.purge(target)
+                for target in discover(fs):
+                    instance.purge(target.path)
+                return memory.operations
+            return remove
+
+        for name in sorted(removal.REMOVERS):
+            if name == 'fd':
+                continue  # descriptor removal only works on disk
+            for jobs in sorted(set([1, self.options.jobs])):
+                seconds, operations = self.time(remover(name, jobs),
+                                                setup=generate)
+                self.record('memory', '{0}-jobs-{1}'.format(name, jobs),
+                            seconds, operations=sum(operations.values()))
+
+    def run(self):
+        phases = self.options.phases
+        if 'gathering' in phases:
+            self.bench_gathering()
+        if set(phases) & set(['discovery', 'usage']):
+            files = self.generate()
+            if 'discovery' in phases:
+                self.bench_discovery()
+            if 'usage' in phases:
+                self.bench_usage()
+        else:
+            files = None
+        if 'removal' in phases:
+            self.bench_removal()
+        if 'memory' in phases:
+            self.bench_memory()
+        if not self.options.directory:
+            shutil.rmtree(self.base_dir)
+
+        return {
+            'janitor_version': setupext_janitor.version,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'parameters': {
+                'files': self.options.files,
+                'generated_files': files,
+                'seed': self.options.seed,
+                'jobs': self.options.jobs,
+                'latency': self.options.latency,
+                'repeat': self.options.repeat,
+            },
+            'results': self.results,
+        }
+
+
+PHASES = ('gathering', 'discovery', 'usage', 'removal', 'memory')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=100000,
+                        help='approximate number of files to generate '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: %(default)s)')
+    parser.add_argument('--dist-size', type=int, default=1 << 20,
+                        help='size of each distribution archive in bytes '
+                             '(default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=removal.default_jobs(),
+                        help='number of threads for the parallel code paths '
+                             '(default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of latency to add to each file '
+                             'system operation during removal and in the '
+                             'memory phase to simulate a network file '
+                             'system (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times to run each variant, the '
+                             'fastest time is reported (default: '
+                             '%(default)s)')
+    parser.add_argument('--phase', dest='phases', action='append',
+                        choices=PHASES,
+                        help='phase to run, may be repeated (default: all)')
+    parser.add_argument('--directory',
+                        help='directory to generate the tree in, it is '
+                             'left in place afterwards '
+                             '(default: a temporary directory)')
+    parser.add_argument('--output', help='file to write the JSON results to '
+                                         '(default: standard output)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not report progress on standard error')
+    options = parser.parse_args(args)
+    options.phases = options.phases or list(PHASES)
+
+    document = Benchmark(options).run()
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    else:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
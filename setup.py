@@ -28,9 +28,15 @@ setuptools.setup(
         'Development Status :: 5 - Production/Stable',
     ],
     entry_points={
+        'console_scripts': [
+            'janitor = setupext_janitor.cli:main',
+        ],
         'distutils.commands': [
             'clean = setupext_janitor.janitor:CleanCommand',
         ],
+        'setuptools.finalize_distribution_options': [
+            'janitor_journal = setupext_janitor.journal:install',
+        ],
     },
     cmdclass={
         'clean': setupext_janitor.janitor.CleanCommand,
@@ -1,2 +1,9 @@
 version_info = (1, 1, 2)
 version = '.'.join(str(v) for v in version_info)
+
+from setupext_janitor.api import execute, plan  # noqa: E402
+from setupext_janitor.engine import (  # noqa: E402
+    Cleaner, OptionError, ProgressHook)
+
+__all__ = ['Cleaner', 'OptionError', 'ProgressHook', 'execute', 'plan',
+           'version', 'version_info']
@@ -0,0 +1,68 @@
+"""
+Clean projects from other programs.
+
+These functions clean a project in the calling process without
+distutils and without changing the current directory, so a program
+can clean many projects without starting a process for each one.  The
+project's ``[clean]``, ``[build]``, ``[egg_info]``, and *dist* command
+settings are read from its *setup.cfg* and *pyproject.toml* like the
+*janitor* program does.
+
+"""
+import os
+
+from setupext_janitor import config, engine, stats
+
+
+def plan(root=os.curdir, **options):
+    """
+    List what would be removed from a project.
+
+    :param str root: the project directory
+    :param options: options that take precedence over the project's
+        settings.  The names are the attributes of
+        :class:`~setupext_janitor.engine.Cleaner` and `all`.
+    :returns: a lazy iterator of
+        :class:`~setupext_janitor.discovery.Target` instances
+    :raises setupext_janitor.engine.OptionError: if an option is invalid
+
+    The options are validated immediately but the project is only
+    searched as the iterator is advanced.
+
+    """
+    cleaner, resolver = _create_cleaner(root, options)
+    return cleaner.plan(resolver)
+
+
+def execute(root=os.curdir, progress=None, **options):
+    """
+    Clean a project.
+
+    :param str root: the project directory
+    :param progress: a :class:`~setupext_janitor.engine.ProgressHook`
+        that is told about each target as it is found and removed
+    :param options: options that take precedence over the project's
+        settings as described in :func:`plan`
+    :returns: the timings and counters of each phase as a
+        :class:`dict` in the format that ``--stats`` writes
+    :raises setupext_janitor.engine.OptionError: if an option is invalid
+
+    """
+    cleaner, resolver = _create_cleaner(root, options)
+    run_stats = stats.Stats(cleaner.stats_hook)
+    cleaner.execute(resolver, run_stats=run_stats, progress=progress)
+    return run_stats.as_dict()
+
+
+def _create_cleaner(root, options):
+    extra = dict((name, options.pop(name))
+                 for name in ('dry_run', 'fs', 'stats_hook')
+                 if name in options)
+    for name in options:
+        if name not in engine.OPTIONS and name != 'all':
+            raise TypeError('unexpected option {0}'.format(name))
+    settings = config.read_config(root)
+    cleaner = engine.Cleaner(root=root, **dict(
+        config.clean_options(settings, options), **extra))
+    cleaner.finalize()
+    return cleaner, config.DirectoryResolver(settings)
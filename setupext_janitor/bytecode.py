@@ -0,0 +1,144 @@
+import os
+import struct
+
+from setupext_janitor import discovery
+try:
+    from importlib import util as importlib_util
+except ImportError:  # pragma: no cover -- Python 2
+    importlib_util = None
+
+
+SOURCE_SUFFIXES = ('.py', '.pyw')
+BYTECODE_SUFFIXES = ('.pyc', '.pyo')
+
+
+def find_stale(dir_path, entries):
+    """
+    Find bytecode in a directory that no longer matches its source.
+
+    :param str dir_path: the directory to inspect
+    :param entries: the entries in `dir_path` as returned from
+        :func:`setupext_janitor.discovery.list_directory`
+    :returns: an iterator of :class:`~setupext_janitor.discovery.Target`
+        instances
+
+    This is a :func:`~setupext_janitor.discovery.discover` inspector.
+    The source modules in `dir_path` are indexed by module name and
+    then the legacy side-by-side *.pyc* and *.pyo* files in `dir_path`
+    as well as the cached files in its *__pycache__* directory are
+    checked against the index.  Bytecode is stale if its source no
+    longer exists or if the timestamp, size, or hash recorded in its
+    header does not match the source.  Bytecode for sources that have
+    not changed is left alone.
+
+    If every file in *__pycache__* is stale, then the directory itself
+    is selected.
+
+    """
+    sources = {}
+    has_cache = False
+    for name, is_dir in entries:
+        if is_dir:
+            has_cache = has_cache or name == '__pycache__'
+        elif name.endswith(SOURCE_SUFFIXES):
+            sources[name.rsplit('.', 1)[0]] = os.path.join(dir_path, name)
+
+    for name, is_dir in entries:
+        if not is_dir and name.endswith(BYTECODE_SUFFIXES):
+            path = os.path.join(dir_path, name)
+            if is_stale(path, sources.get(name[:-4])):
+                yield discovery.Target('bytecode', path)
+
+    if has_cache:
+        cache_dir = os.path.join(dir_path, '__pycache__')
+        try:
+            cache_entries = discovery.list_directory(cache_dir)
+        except OSError:
+            return
+        stale, fresh = [], False
+        for name, is_dir in cache_entries:
+            path = os.path.join(cache_dir, name)
+            if (not is_dir and name.endswith(BYTECODE_SUFFIXES) and
+                    is_stale(path, sources.get(name.split('.', 1)[0]))):
+                stale.append(path)
+            else:
+                fresh = True
+        if stale and not fresh:
+            yield discovery.Target('bytecode', cache_dir)
+        else:
+            for path in stale:
+                yield discovery.Target('bytecode', path)
+
+
+def is_stale(bytecode_path, source_path):
+    """
+    Is a bytecode file out of date?
+
+    :param str bytecode_path: the bytecode file to check
+    :param str source_path: the source that the bytecode was compiled
+        from or :data:`None` if there is no source
+    :rtype: bool
+
+    Unreadable or truncated bytecode is considered stale.  Hash-based
+    bytecode is only checked if it was written by the running
+    interpreter since the hash depends on the interpreter version.
+
+    """
+    if source_path is None:
+        return True
+    try:
+        with open(bytecode_path, 'rb') as f:
+            header = parse_header(f.read(16))
+        source_info = os.stat(source_path)
+    except (IOError, OSError):
+        return True
+    if header is None:
+        return True
+
+    magic, source_hash, mtime, size = header
+    if source_hash is not None:
+        if (importlib_util is None or
+                not hasattr(importlib_util, 'source_hash') or
+                magic != importlib_util.MAGIC_NUMBER):
+            return False
+        try:
+            with open(source_path, 'rb') as f:
+                return importlib_util.source_hash(f.read()) != source_hash
+        except (IOError, OSError):
+            return True
+
+    if mtime != int(source_info.st_mtime) & 0xFFFFFFFF:
+        return True
+    return size is not None and size != source_info.st_size & 0xFFFFFFFF
+
+
+def parse_header(data):
+    """
+    Parse the header of a bytecode file.
+
+    :param bytes data: the first 16 bytes of the file
+    :returns: a ``(magic, source_hash, mtime, size)`` tuple or
+        :data:`None` if `data` is not a bytecode header.  `source_hash`
+        is :data:`None` for timestamp-based bytecode, otherwise `mtime`
+        and `size` are :data:`None`.  `size` is also :data:`None` for
+        bytecode written by Python 3.2 and earlier.
+
+    """
+    if len(data) < 8 or data[2:4] != b'\r\n':
+        return None
+    magic = data[:4]
+    version = struct.unpack('<H', data[:2])[0]
+    if version >= 20000 or version < 3230:  # Python 2 and 3.0-3.2
+        return magic, None, struct.unpack('<I', data[4:8])[0], None
+    if version < 3390:  # Python 3.3-3.6
+        if len(data) < 12:
+            return None
+        mtime, size = struct.unpack('<II', data[4:12])
+        return magic, None, mtime, size
+    if len(data) < 16:
+        return None
+    flags = struct.unpack('<I', data[4:8])[0]
+    if flags & 0x01:
+        return magic, data[8:16], None, None
+    mtime, size = struct.unpack('<II', data[8:16])
+    return magic, None, mtime, size
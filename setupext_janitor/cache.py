@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sys
+
+from setupext_janitor import log
+
+
+class AttributeCache(object):
+    """
+    Persist the directories that are resolved from command options.
+
+    :param str path: file that the cache is stored in
+    :param str key: fingerprint of everything that the cached values
+        depend on -- see :func:`fingerprint`
+
+    Resolving build and distribution directories requires importing
+    and finalizing every matching command which is surprisingly
+    expensive.  The resolved values are stored in a small JSON
+    document along with `key`.  The stored values are discarded
+    when the key changes.
+
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self._entries = {}
+        self._dirty = False
+        try:
+            with open(path) as cache_file:
+                document = json.load(cache_file)
+            if document.get('key') == key:
+                self._entries = document.get('entries', {})
+        except (IOError, OSError, ValueError, AttributeError):
+            pass
+
+    def get(self, name):
+        """Return the cached values for `name` or :data:`None`."""
+        values = self._entries.get(name)
+        if values is not None:
+            log.debug('using cached values for %s from %s', name, self.path)
+            return set(values)
+        return None
+
+    def set(self, name, values):
+        """Store `values` as the values for `name`."""
+        self._entries[name] = sorted(values)
+        self._dirty = True
+
+    def save(self):
+        """Write the cache to disk if it has been modified."""
+        if not self._dirty:
+            return
+        try:
+            parent = os.path.dirname(self.path)
+            if parent and not os.path.isdir(parent):
+                os.makedirs(parent)
+            with open(self.path, 'w') as cache_file:
+                json.dump({'key': self.key, 'entries': self._entries},
+                          cache_file, indent=1, sort_keys=True)
+            self._dirty = False
+        except (IOError, OSError) as error:
+            log.warn('failed to write cache %s: %s', self.path, error)
+
+
+def default_cache_dir():
+    """Return the per-user directory that caches are stored in."""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get(
+            'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'setupext-janitor')
+
+
+def cache_path(cache_dir):
+    """Return the cache file for the current directory in `cache_dir`."""
+    project = os.path.abspath(os.curdir).encode('utf-8')
+    return os.path.join(
+        cache_dir, hashlib.sha1(project).hexdigest()[:16] + '.json')
+
+
+def fingerprint(dist, ignore=('clean',)):
+    """
+    Calculate a cache key for a distribution.
+
+    :param distutils.dist.Distribution dist: distribution to process
+    :param ignore: names of commands whose options are excluded
+    :rtype: str
+
+    The key covers the content of the setup script and configuration
+    files, the options that were set for commands other than those
+    listed in `ignore`, the distribution class, the commands that are
+    installed, and the interpreter that is running.  None of this
+    requires importing or finalizing the commands.
+
+    """
+    digest = hashlib.sha1()
+
+    def update(value):
+        digest.update(repr(value).encode('utf-8'))
+        digest.update(b'\0')
+
+    update(sys.version)
+    update(sys.platform)
+    update(os.path.abspath(os.curdir))
+    update((type(dist).__module__, type(dist).__name__))
+    for file_name in [dist.script_name] + list(dist.find_config_files()):
+        update(file_name)
+        try:
+            with open(file_name, 'rb') as f:
+                digest.update(f.read())
+        except (IOError, OSError, TypeError):
+            pass
+    update(sorted(
+        (name, sorted(options.items()))
+        for name, options in dist.command_options.items()
+        if name not in ignore))
+    entry_points = sorted(_command_entry_points())
+    installed = set(value for _, value in entry_points)
+    update(sorted(
+        (name, cls.__module__, cls.__name__)
+        for name, cls in dist.cmdclass.items()
+        if not _is_installed_command(name, cls, installed)))
+    update(entry_points)
+    return digest.hexdigest()
+
+
+def _is_installed_command(name, cls, installed):
+    # dist.cmdclass also contains the commands that have been loaded
+    # so far, which depends on what ran before us.  Only the classes
+    # that were passed to setup() belong in the fingerprint.
+    if '{0}:{1}'.format(cls.__module__, cls.__name__) in installed:
+        return True
+    return any(cls.__module__ == package + name
+               for package in ('distutils.command.',
+                               'setuptools.command.',
+                               'setuptools._distutils.command.'))
+
+
+def _command_entry_points():
+    try:
+        from importlib import metadata
+    except ImportError:
+        metadata = None
+
+    if metadata is not None:
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, 'select'):
+            selected = entry_points.select(group='distutils.commands')
+        else:
+            selected = entry_points.get('distutils.commands', [])
+        return [(ep.name, ep.value) for ep in selected]
+
+    try:
+        import pkg_resources
+    except ImportError:
+        return []
+    return [(ep.name, str(ep))
+            for ep in pkg_resources.iter_entry_points('distutils.commands')]
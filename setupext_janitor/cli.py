@@ -0,0 +1,97 @@
+"""
+The *janitor* command line program.
+
+This runs the same :class:`~setupext_janitor.engine.Cleaner` as
+``setup.py clean`` but reads the ``[clean]``, ``[build]``, and
+``[egg_info]`` settings straight from *setup.cfg* and *pyproject.toml*
+instead of loading the distribution.  It never imports distutils or
+setuptools so it starts quickly.
+
+"""
+import argparse
+import logging
+import os
+import sys
+
+from setupext_janitor import config, engine, log
+
+
+def main(argv=None):
+    """
+    Run the *janitor* program.
+
+    :param list argv: the command line arguments without the program
+        name (default: :data:`sys.argv`)
+    :returns: the exit status
+
+    """
+    parser = _create_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'directory', None):
+        try:
+            os.chdir(args.directory)
+        except OSError as error:
+            parser.error('cannot change to directory {0}: {1}'.format(
+                args.directory, error.strerror or error))
+
+    verbosity = getattr(args, 'verbose', 0) - getattr(args, 'quiet', 0)
+    log.use_logging()
+    logging.basicConfig(
+        format='%(message)s', stream=sys.stdout,
+        level=logging.DEBUG if verbosity > 0 else
+        logging.INFO if verbosity == 0 else logging.WARNING)
+
+    settings = config.read_config()
+    try:
+        cleaner = engine.Cleaner(
+            dry_run=getattr(args, 'dry_run', False),
+            **config.clean_options(settings, dict(
+                (name, value) for name, value in vars(args).items()
+                if name in engine.OPTIONS or name == 'all')))
+        cleaner.finalize()
+    except engine.OptionError as error:
+        parser.error(str(error))
+
+    try:
+        cleaner.execute(config.DirectoryResolver(settings))
+    except (IOError, OSError) as error:
+        log.error('%s', error)
+        return 1
+    return 0
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        prog='janitor', argument_default=argparse.SUPPRESS,
+        description='Remove the by-products of building a Python '
+                    'project using the [clean] settings of setup.cfg '
+                    'and pyproject.toml.')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='remove {0} as well'.format(
+                            ', '.join(engine.TARGET_OPTIONS)))
+    parser.add_argument('-C', dest='directory', metavar='DIR',
+                        help='change to DIR before doing anything')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="don't actually remove anything")
+    parser.add_argument('-q', '--quiet', action='count',
+                        help='log less, may be repeated')
+    parser.add_argument('-v', '--verbose', action='count',
+                        help='log more, may be repeated')
+    for name, short_name, help_text in engine.USER_OPTIONS:
+        flags = ['--' + name.rstrip('=')]
+        if short_name:
+            flags.insert(0, '-' + short_name)
+        if name.endswith('='):
+            parser.add_argument(*flags, metavar=name.rstrip('=').upper(),
+                                help=help_text)
+        elif name in engine.NEGATIVE_OPTIONS:
+            parser.add_argument(
+                *flags, action='store_false', help=help_text,
+                dest=engine.NEGATIVE_OPTIONS[name].replace('-', '_'))
+        else:
+            parser.add_argument(*flags, action='store_true', help=help_text)
+    return parser
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
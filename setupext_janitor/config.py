@@ -0,0 +1,156 @@
+"""
+Read command options without loading the distribution.
+
+The *janitor* program uses this instead of distutils to find the
+settings that ``setup.py clean`` would use.  Options are read from the
+``[tool.distutils.<command>]`` tables of *pyproject.toml* and from
+*setup.cfg*, which takes precedence.
+
+"""
+import os
+
+try:
+    import configparser
+except ImportError:  # pragma: no cover -- Python 2
+    import ConfigParser as configparser
+
+from setupext_janitor import engine
+
+
+# the values that a boolean option can be set to
+TRUE_VALUES = ('1', 'on', 'true', 'yes')
+FALSE_VALUES = ('0', 'off', 'false', 'no')
+
+
+def read_config(directory=os.curdir):
+    """
+    Read the command options of a project.
+
+    :param str directory: the project directory
+    :returns: a :class:`dict` that maps command names to a :class:`dict`
+        of option values.  Option names use underscores instead of
+        dashes like distutils does.
+
+    *pyproject.toml* is only read when a TOML parser (:mod:`tomllib` or
+    :mod:`tomli`) is available.
+
+    """
+    options = {}
+    _read_pyproject(os.path.join(directory, 'pyproject.toml'), options)
+    _read_setup_cfg(os.path.join(directory, 'setup.cfg'), options)
+    return options
+
+
+def as_bool(value):
+    """
+    Convert a configuration value into a boolean.
+
+    :raises engine.OptionError: if `value` is not a recognized
+        boolean value
+
+    """
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise engine.OptionError('invalid boolean value {0!r}'.format(value))
+
+
+def clean_options(settings, overrides=None):
+    """
+    Build the options of a :class:`~setupext_janitor.engine.Cleaner`.
+
+    :param dict settings: command options returned from
+        :func:`read_config`
+    :param dict overrides: option values that take precedence over
+        `settings`
+    :returns: :class:`dict` of the options named in
+        :data:`~setupext_janitor.engine.OPTIONS`
+    :raises engine.OptionError: if a boolean option is invalid
+
+    The options are taken from the ``[clean]`` section along with
+    `egg_base` from ``[egg_info]``.  The `all` option enables the
+    :data:`~setupext_janitor.engine.TARGET_OPTIONS`.
+
+    """
+    values = dict((name, value)
+                  for name, value in settings.get('clean', {}).items()
+                  if name in engine.OPTIONS or name == 'all')
+    if 'egg_base' not in values and 'egg_base' in settings.get(
+            'egg_info', {}):
+        values['egg_base'] = settings['egg_info']['egg_base']
+    values.update(overrides or {})
+    enable_all = as_bool(values.pop('all', False))
+    for name in engine.BOOLEAN_OPTIONS:
+        if name in values:
+            values[name] = as_bool(values[name])
+    if enable_all:
+        for name in engine.TARGET_OPTIONS:
+            values[name] = True
+    return values
+
+
+class DirectoryResolver(object):
+    """
+    Find the build and dist directories in configuration options.
+
+    :param dict options: command options returned from :func:`read_config`
+
+    Instances are passed to :meth:`~setupext_janitor.engine.Cleaner.plan`.
+    The directory attributes of the commands that would be selected in
+    the distribution are used along with the distutils defaults of
+    *build* and *dist* for the commands that do not configure them.
+
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def __call__(self, kind):
+        dir_names = set()
+        for cmd_name, values in self.options.items():
+            if engine.selects_command(kind, cmd_name):
+                for name in engine.DIRECTORY_ATTRIBUTES[kind]:
+                    if values.get(name):
+                        dir_names.add(str(values[name]))
+        if kind == 'build':
+            if not self.options.get('build', {}).get('build_base'):
+                dir_names.add('build')
+        elif not all(self.options.get(cmd_name, {}).get('dist_dir')
+                     for cmd_name in ('bdist', 'sdist')):
+            dir_names.add('dist')
+        return dir_names
+
+
+def _read_pyproject(path, options):
+    if not os.path.exists(path):
+        return
+    try:
+        import tomllib as toml
+    except ImportError:
+        try:
+            import tomli as toml
+        except ImportError:
+            return
+    with open(path, 'rb') as toml_file:
+        document = toml.load(toml_file)
+    tables = document.get('tool', {}).get('distutils', {})
+    for cmd_name, values in tables.items():
+        if isinstance(values, dict):
+            section = options.setdefault(cmd_name.replace('-', '_'), {})
+            for name, value in values.items():
+                section[name.replace('-', '_')] = value
+
+
+def _read_setup_cfg(path, options):
+    if not os.path.exists(path):
+        return
+    parser = configparser.RawConfigParser()
+    parser.read(path)
+    for cmd_name in parser.sections():
+        section = options.setdefault(cmd_name.replace('-', '_'), {})
+        for name, value in parser.items(cmd_name):
+            section[name.replace('-', '_')] = value
@@ -0,0 +1,276 @@
+import collections
+import fnmatch
+import os
+import re
+import stat
+try:
+    from os import scandir
+except ImportError:  # pragma: no cover -- Python 2
+    scandir = None
+
+from setupext_janitor import stats
+
+
+# directory names that are not searched unless overridden by --prune
+DEFAULT_PRUNE = ('.git', '.hg', '.svn', '.tox', '.nox', 'node_modules')
+
+
+def compile_patterns(patterns):
+    """
+    Compile a list of glob patterns into a single matcher.
+
+    :param patterns: :mod:`fnmatch` style patterns
+    :returns: a callable that takes a name and returns a truthy
+        value if the name matches any of the patterns
+
+    """
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return lambda name: False
+    regex = re.compile('|'.join(
+        '(?:{0})'.format(fnmatch.translate(p)) for p in patterns))
+    return regex.match
+
+
+def list_directory(dir_path):
+    """
+    List the entries in a directory.
+
+    :param str dir_path: the directory to list
+    :returns: list of ``(name, is_dir)`` tuples where `is_dir` is
+        :data:`True` for directories that are not symbolic links
+    :raises OSError: if `dir_path` cannot be listed
+
+    """
+    if scandir is not None:
+        return [(entry.name, entry.is_dir(follow_symlinks=False))
+                for entry in scandir(dir_path)]
+
+    entries = []
+    for name in os.listdir(dir_path):
+        path = os.path.join(dir_path, name)
+        entries.append(
+            (name, os.path.isdir(path) and not os.path.islink(path)))
+    return entries
+
+
+class Rule(object):
+    """
+    Selects directory entries that should be removed.
+
+    :param str kind: the type of target that this rule selects
+    :param matches: callable that takes an entry name and returns a
+        truthy value if the entry should be removed
+    :param str directory: if specified, then the rule only applies to
+        the entries in this directory.  Otherwise, it applies to every
+        directory that is searched.
+    :param bool dirs_only: only select entries that are directories
+
+    """
+
+    def __init__(self, kind, matches, directory=None, dirs_only=False):
+        self.kind = kind
+        self.matches = matches
+        self.directory = directory
+        self.dirs_only = dirs_only
+
+
+Target = collections.namedtuple('Target', ['kind', 'path'])
+
+
+def discover(root, rules, prune=DEFAULT_PRUNE, skip=(), inspectors=(),
+             counters=stats.NULL_COUNTERS, fs=None, one_file_system=True):
+    """
+    Find removal targets using a single traversal.
+
+    :param str root: directory to start searching in
+    :param list rules: :class:`Rule` instances that select targets
+    :param prune: glob patterns that match directory names that
+        should not be searched
+    :param skip: directory paths that should not be searched
+    :param inspectors: callables that select targets based on the
+        content of an entire directory.  Each is called with the
+        directory path and its entries as returned by
+        :func:`list_directory` for every directory that is searched
+        and returns an iterable of :class:`Target` instances.  Entries
+        that an inspector selects are not matched against `rules` and
+        the search does not descend into a directory that an inspector
+        selects.
+    :param counters: :class:`~setupext_janitor.stats.Counters` that
+        discovery statistics are added to
+    :param fs: the :mod:`~setupext_janitor.filesystem` backend to
+        search (default: :func:`list_directory` on the real file system)
+    :param bool one_file_system: do not search directories that are on
+        a different device than `root`
+    :returns: an iterator of :class:`Target` instances
+
+    Each directory is listed exactly once and each entry is matched
+    against every rule that applies to the directory.  Rules without
+    a `directory` cause the tree under `root` to be searched.  The
+    search does not descend into targets since they are going to be
+    removed anyway.  Directories that match a pattern in `prune`,
+    directories listed in `skip`, and virtual environments (identified
+    by their *pyvenv.cfg* file) are not searched at all.
+
+    Rules that are bound to a directory that the search does not reach
+    are applied by listing that directory by itself.
+
+    Symbolic links to directories are never followed.  Each directory
+    is identified by its device and inode number so a directory that
+    is reachable more than once -- through a bind mount or a hard link
+    -- is only searched the first time, which bounds the search by the
+    size of the real tree.  Mount points are matched against `rules`
+    like any other directory but, unless `one_file_system` is
+    disabled, the search does not descend into them.
+
+    """
+    recursive = [rule for rule in rules if rule.directory is None]
+    anchored = collections.OrderedDict()
+    for rule in rules:
+        if rule.directory is not None:
+            anchored.setdefault(_path_key(rule.directory), []).append(rule)
+    is_pruned = compile_patterns(prune)
+    skip = frozenset(_path_key(path) for path in skip)
+    listing = list_directory if fs is None else fs.list_directory
+    lstat = os.lstat if fs is None else fs.lstat
+    follow = os.stat if fs is None else fs.stat
+    root_device, visited = None, set()
+
+    pending = [root] if recursive or inspectors else []
+    while pending:
+        dir_path = pending.pop()
+        try:
+            info = lstat(dir_path)
+            if dir_path == root and stat.S_ISLNK(info.st_mode):
+                info = follow(dir_path)
+        except OSError:
+            counters.add(errors=1)
+            continue
+        if dir_path == root:
+            root_device = info.st_dev
+        elif one_file_system and info.st_dev != root_device:
+            counters.add(mount_points_skipped=1)
+            continue
+        if info.st_ino:  # zero where inode numbers are not available
+            if (info.st_dev, info.st_ino) in visited:
+                counters.add(duplicate_directories_skipped=1)
+                continue
+            visited.add((info.st_dev, info.st_ino))
+
+        dir_rules = anchored.pop(_path_key(dir_path), [])
+        try:
+            entries = listing(dir_path)
+        except OSError:
+            counters.add(errors=1)
+            continue
+        counters.add(directories_scanned=1, entries_examined=len(entries))
+
+        descend = dir_path == root or not any(
+            name == 'pyvenv.cfg' for name, _ in entries)
+        claimed = set()
+        if descend:
+            for inspect in inspectors:
+                for target in inspect(dir_path, entries):
+                    claimed.add(target.path)
+                    yield target
+            descend = dir_path not in claimed
+        if descend:
+            dir_rules = recursive + dir_rules
+        for name, is_dir in entries:
+            path = os.path.join(dir_path, name)
+            if path in claimed:
+                continue
+            target = _match(dir_rules, path, name, is_dir)
+            if target is not None:
+                yield target
+            elif (descend and is_dir and not is_pruned(name) and
+                  (not skip or _path_key(path) not in skip)):
+                pending.append(path)
+
+    for dir_rules in anchored.values():
+        dir_path = dir_rules[0].directory
+        try:
+            entries = listing(dir_path)
+        except OSError:
+            counters.add(errors=1)
+            continue
+        counters.add(directories_scanned=1, entries_examined=len(entries))
+        for name, is_dir in entries:
+            target = _match(
+                dir_rules, os.path.join(dir_path, name), name, is_dir)
+            if target is not None:
+                yield target
+
+
+class PathSet(object):
+    """
+    Set of paths that also contains everything below its members.
+
+    :param paths: the initial members
+
+    Paths are normalized in the same way as :func:`collapse` and
+    membership is checked by walking up the parents of the path so
+    the cost is proportional to its depth.
+
+    """
+
+    def __init__(self, paths=()):
+        self._keys = set(_path_key(path) for path in paths)
+
+    def add(self, path):
+        """Add `path` to the set."""
+        self._keys.add(_path_key(path))
+
+    def __contains__(self, path):
+        return _is_below(_path_key(path), self._keys, inclusive=True)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def collapse(targets):
+    """
+    Discard targets that are inside of other targets.
+
+    :param dict targets: mapping of target path to target type
+    :returns: a new :class:`dict` that only contains the outermost
+        targets from `targets`
+
+    Paths are compared after they are normalized so ``build`` and
+    ``./build`` are the same target.  Each target is checked against
+    an index of the normalized paths by walking up its parents so the
+    cost is proportional to the depth of the target rather than the
+    number of targets.
+
+    """
+    index = collections.OrderedDict()
+    for path, kind in targets.items():
+        index.setdefault(_path_key(path), (path, kind))
+
+    outermost = {}
+    for key, (path, kind) in index.items():
+        if not _is_below(key, index):
+            outermost[path] = kind
+    return outermost
+
+
+def _is_below(key, keys, inclusive=False):
+    if inclusive and key in keys:
+        return True
+    child, parent = key, os.path.dirname(key)
+    while parent != child:
+        if parent in keys:
+            return True
+        child, parent = parent, os.path.dirname(parent)
+    return False
+
+
+def _match(rules, path, name, is_dir):
+    for rule in rules:
+        if (is_dir or not rule.dirs_only) and rule.matches(name):
+            return Target(rule.kind, path)
+    return None
+
+
+def _path_key(path):
+    return os.path.normcase(os.path.abspath(path))
@@ -0,0 +1,598 @@
+import json
+import os
+import re
+
+from setupext_janitor import (
+    bytecode, discovery, eviction, filesystem, gitignore, journal, log, pool,
+    removal, stats, throttle, usage)
+
+
+# (option, short option, help) for the options that configure a
+# Cleaner.  Options that take a value end with "=" like distutils.
+USER_OPTIONS = [
+    ('build', 'b', 'remove build directory'),
+    ('dist', 'd', 'remove distribution directory'),
+    ('disk-usage', None,
+     'report the disk space used by the directories that are removed'),
+    ('eggs', None, 'remove egg and egg-info directories'),
+    ('environment', 'E', 'remove virtual environment directory'),
+    ('gitignored', None,
+     'remove files and directories that .gitignore files ignore'),
+    ('idle-io', None,
+     'remove files at idle I/O priority so that other processes that '
+     'use the disk are served first'),
+    ('one-file-system', None,
+     'only search directories that are on the same file system as '
+     'the project (default)'),
+    ('cross-file-systems', None,
+     'search directories that are on other file systems as well'),
+    ('pycache', 'p', 'remove __pycache__ directories'),
+    ('stale-bytecode', None,
+     'remove bytecode files that do not match their source'),
+    ('trash', None,
+     'move directories into the trash directory and remove them '
+     'in the background'),
+
+    ('egg-base=', 'e',
+     'directory containing .egg-info directories '
+     '(default: top of the source tree)'),
+    ('jobs=', 'j',
+     'number of threads used to remove directories '
+     '(default: number of CPUs)'),
+    ('journal=', None,
+     'remove the build, dist, and egg-info artifacts that are '
+     'recorded in this journal instead of searching for them'),
+    ('max-bytes-per-sec=', None,
+     'limit the rate that space is freed at, for example 50M'),
+    ('max-ops-per-sec=', None,
+     'limit the number of files and directories removed per second'),
+    ('max-cache-size=', None,
+     'evict the least recently used .tox and .nox environments and '
+     '.pytest_cache and .mypy_cache directories until they use at '
+     'most this much space, for example 2G'),
+    ('patterns=', None,
+     'comma-separated list of glob patterns that select additional '
+     'files and directories to remove wherever they are found'),
+    ('pycache-budget=', None,
+     'evict the least recently used bytecode until __pycache__ '
+     'directories use at most this much space, for example 500M'),
+    ('pycache-max-age=', None,
+     'evict bytecode that has not been used for this many days'),
+    ('prune=', None,
+     'comma-separated list of directory name patterns that are '
+     'not searched for __pycache__ directories '
+     '(default: {0})'.format(','.join(discovery.DEFAULT_PRUNE))),
+    ('remover=', None,
+     'removal strategy: "fd" removes relative to open directory '
+     'descriptors, "tree" removes each directory with a single '
+     'thread, "latency" keeps --jobs operations in flight for network '
+     'file systems (default: fd where supported, otherwise tree)'),
+    ('stats=', None,
+     'write timings and counters for each phase as JSON to this '
+     'file, use - to write them to the log'),
+    ('trash-dir=', None,
+     'directory that --trash moves directories into '
+     '(default: .janitor-trash)'),
+    ('virtualenv-dir=', None,
+     'root directory for the virtual directory '
+     '(default: value of VIRTUAL_ENV environment variable)'),
+]
+
+# options that turn off the boolean option that they are mapped to,
+# distutils requires each to follow its option in USER_OPTIONS
+NEGATIVE_OPTIONS = {'cross-file-systems': 'one-file-system'}
+
+# the attribute names of USER_OPTIONS
+OPTIONS = [name.rstrip('=').replace('-', '_') for name, _, _ in USER_OPTIONS
+           if name not in NEGATIVE_OPTIONS]
+BOOLEAN_OPTIONS = [name.replace('-', '_') for name, _, _ in USER_OPTIONS
+                   if not name.endswith('=') and
+                   name not in NEGATIVE_OPTIONS]
+
+# the options that --all enables
+TARGET_OPTIONS = ['dist', 'eggs', 'environment', 'pycache']
+
+# the command attributes that name build and distribution directories
+DIRECTORY_ATTRIBUTES = {
+    'build': ('build_base', 'build_clib', 'build_dir', 'build_lib',
+              'build_temp'),
+    'dist': ('dist_dir',),
+}
+
+# options that read files directly and only work on filesystem.OS
+OS_ONLY_OPTIONS = ['gitignored', 'journal', 'max_cache_size',
+                   'pycache_budget', 'pycache_max_age', 'stale_bytecode',
+                   'trash']
+
+# number of targets that discovery can get ahead of removal by
+REMOVAL_BACKLOG = 64
+
+
+class OptionError(ValueError):
+    """Raised by :meth:`Cleaner.finalize` for invalid options."""
+
+
+class ProgressHook(object):
+    """
+    Receives progress from :meth:`Cleaner.execute`.
+
+    Subclass this and override the methods that you are interested
+    in.  :meth:`target_found` is called from the thread that calls
+    :meth:`~Cleaner.execute` while the other methods are called from
+    the thread that removes targets.
+
+    """
+
+    def target_found(self, target):
+        """Called when `target` is selected for removal."""
+
+    def target_removed(self, target):
+        """Called after `target` is removed (or would be in a dry run)."""
+
+    def target_skipped(self, target):
+        """Called instead of removing `target` when it does not exist."""
+
+
+class Cleaner(object):
+    """
+    Finds and removes the by-products of building a project.
+
+    :param options: initial values for the attributes named in
+        :data:`OPTIONS` as well as `dry_run`, `fs`, `root`, and
+        `stats_hook`
+
+    This is the engine behind both the *clean* command and the
+    *janitor* program.  It knows nothing about distutils: the build
+    and distribution directories are supplied by the caller when
+    :meth:`plan` or :meth:`execute` is called.  Call :meth:`finalize`
+    after setting the options to validate them and fill in the
+    defaults.
+
+    The project in the `root` directory is cleaned, which defaults to
+    the current directory.  Relative paths in the options are relative
+    to `root`.
+
+    Targets are searched for and removed through the
+    :mod:`~setupext_janitor.filesystem` backend in `fs`.  The options
+    in :data:`OS_ONLY_OPTIONS` require the default backend.
+
+    """
+
+    def __init__(self, **options):
+        self.build = False
+        self.disk_usage = False
+        self.dist = False
+        self.dry_run = False
+        self.eggs = False
+        self.egg_base = None
+        self.environment = False
+        self.fs = filesystem.OS
+        self.gitignored = False
+        self.idle_io = False
+        self.jobs = None
+        self.journal = None
+        self.max_bytes_per_sec = None
+        self.max_cache_size = None
+        self.max_ops_per_sec = None
+        self.one_file_system = True
+        self.patterns = None
+        self.prune = None
+        self.pycache = False
+        self.pycache_budget = None
+        self.pycache_max_age = None
+        self.remover = None
+        self.root = os.curdir
+        self.stale_bytecode = False
+        self.stats = None
+        self.stats_hook = None
+        self.trash = False
+        self.trash_dir = None
+        self.virtualenv_dir = None
+        self._is_finalized = False
+        for name, value in options.items():
+            if name.startswith('_') or not hasattr(self, name):
+                raise TypeError('unexpected option {0}'.format(name))
+            setattr(self, name, value)
+
+    def finalize(self):
+        """
+        Validate the options and fill in defaults.
+
+        :raises OptionError: if an option is invalid
+
+        This can safely be called more than once.
+
+        """
+        if not self._is_finalized:
+            for name in ('egg_base', 'journal', 'trash_dir',
+                         'virtualenv_dir'):
+                if getattr(self, name):
+                    setattr(self, name, self._path(getattr(self, name)))
+            if self.stats and self.stats != '-':
+                self.stats = self._path(self.stats)
+
+        if self.egg_base is None:
+            self.egg_base = self.root
+
+        if self.trash_dir is None:
+            self.trash_dir = os.path.join(self.root, '.janitor-trash')
+
+        if self.environment and self.virtualenv_dir is None:
+            self.virtualenv_dir = os.environ.get('VIRTUAL_ENV', None)
+
+        if self.patterns is None:
+            self.patterns = []
+        else:
+            self.patterns = _string_list(self.patterns)
+
+        if self.prune is None:
+            self.prune = list(discovery.DEFAULT_PRUNE)
+        else:
+            self.prune = _string_list(self.prune)
+
+        if self.max_ops_per_sec is not None:
+            try:
+                self.max_ops_per_sec = float(self.max_ops_per_sec)
+            except ValueError:
+                raise OptionError(
+                    '--max-ops-per-sec must be a positive number')
+            if self.max_ops_per_sec <= 0:
+                raise OptionError(
+                    '--max-ops-per-sec must be a positive number')
+        if self.max_bytes_per_sec is not None:
+            try:
+                self.max_bytes_per_sec = usage.parse_size(
+                    str(self.max_bytes_per_sec))
+            except ValueError:
+                raise OptionError(
+                    '--max-bytes-per-sec must be a size such as 50M')
+            if self.max_bytes_per_sec <= 0:
+                raise OptionError(
+                    '--max-bytes-per-sec must be a size such as 50M')
+        if self.max_cache_size is not None:
+            try:
+                self.max_cache_size = usage.parse_size(
+                    str(self.max_cache_size))
+            except ValueError:
+                raise OptionError(
+                    '--max-cache-size must be a size such as 2G')
+        if self.pycache_budget is not None:
+            try:
+                self.pycache_budget = usage.parse_size(
+                    str(self.pycache_budget))
+            except ValueError:
+                raise OptionError(
+                    '--pycache-budget must be a size such as 500M')
+        if self.pycache_max_age is not None:
+            try:
+                self.pycache_max_age = float(self.pycache_max_age)
+            except ValueError:
+                raise OptionError(
+                    '--pycache-max-age must be a number of days')
+            if self.pycache_max_age < 0:
+                raise OptionError(
+                    '--pycache-max-age must be a number of days')
+
+        if self.fs is not filesystem.OS:
+            for name in OS_ONLY_OPTIONS:
+                if getattr(self, name) not in (None, False):
+                    raise OptionError(
+                        '--{0} requires the operating system file '
+                        'system'.format(name.replace('_', '-')))
+
+        if self.remover is None:
+            self.remover = removal.DEFAULT_REMOVER
+        elif self.remover not in removal.REMOVERS:
+            raise OptionError('--remover must be one of {0}'.format(
+                ', '.join(sorted(removal.REMOVERS))))
+
+        if self.jobs is None:
+            self.jobs = removal.default_jobs()
+        else:
+            try:
+                self.jobs = int(self.jobs)
+            except ValueError:
+                raise OptionError('--jobs must be a positive integer')
+            if self.jobs < 1:
+                raise OptionError('--jobs must be a positive integer')
+
+        self._is_finalized = True
+
+    def create_stats(self):
+        """Create the object that statistics for a run are recorded in."""
+        if self.stats or self.stats_hook is not None:
+            return stats.Stats(self.stats_hook)
+        return stats.NullStats()
+
+    def plan(self, resolve=None, skip=(), targets=None, run_stats=None):
+        """
+        List what the options select without removing anything.
+
+        :param resolve: callable that returns the directories for the
+            ``'build'`` or ``'dist'`` kind of target that it is called
+            with.  It is only called for the kinds that are enabled and
+            are not answered by the journal.  Relative directories are
+            relative to `root`.
+        :param skip: directories that are not searched
+        :param dict targets: additional paths to remove mapped to the
+            kind of target that they are
+        :param run_stats: the object returned from :meth:`create_stats`
+            to record statistics in
+        :returns: a lazy iterator of
+            :class:`~setupext_janitor.discovery.Target` instances.  The
+            targets that are known up front come first followed by the
+            targets that are discovered as the tree is searched.
+            Targets that are known up front but do not exist are left
+            out.
+
+        Nothing is done until the iterator is advanced and abandoning
+        it stops the search.
+
+        """
+        if run_stats is None:
+            run_stats = stats.NullStats()
+
+        with run_stats.phase('gather') as counters:
+            journaled = set()
+            extra_targets = targets or {}
+            if self.journal:
+                targets, journaled = journal.Journal(self.journal).select(
+                    self._journaled_kinds(), self.root)
+            else:
+                targets = {}
+            for path, kind in extra_targets.items():
+                targets.setdefault(path, kind)
+            self._gather_targets(targets, journaled, resolve)
+            counters.add(targets_found=len(targets))
+            targets = discovery.collapse(targets)
+
+        with run_stats.phase('discover') as counters:
+            found = 0
+            for dir_name in sorted(targets):
+                if self.fs.exists(dir_name):
+                    yield discovery.Target(targets[dir_name], dir_name)
+                    found += 1
+                else:
+                    log.debug('skipping %s since it does not exist',
+                              dir_name)
+            for target in self._discover_targets(
+                    targets, journaled, counters, skip):
+                yield target
+                found += 1
+            counters.add(targets_found=found)
+
+    def execute(self, resolve=None, skip=(), targets=None, run_stats=None,
+                progress=None):
+        """
+        Remove everything that the options select.
+
+        :param progress: a :class:`ProgressHook` that is told about
+            each target as it is found and removed
+
+        The remaining parameters are the same as :meth:`plan`.  If
+        `run_stats` is omitted, then one is created with
+        :meth:`create_stats`.  Targets are removed by a background
+        thread as :meth:`plan` produces them.
+
+        """
+        if run_stats is None:
+            run_stats = self.create_stats()
+        if progress is None:
+            progress = ProgressHook()
+
+        measurements = {} if self.disk_usage else None
+        consumer = pool.Consumer(
+            lambda items: self._remove_targets(items, run_stats, progress,
+                                               measurements),
+            maxsize=REMOVAL_BACKLOG)
+        started = False
+        try:
+            for target in self.plan(resolve, skip, targets, run_stats):
+                if not started:  # after the gather phase
+                    consumer.start()
+                    started = True
+                progress.target_found(target)
+                consumer.put(target)
+            if not started:
+                consumer.start()
+                started = True
+        finally:
+            if started:
+                consumer.close()
+
+        if self.journal and not self.dry_run:
+            journal.Journal(self.journal).discard(self._journaled_kinds())
+
+        if measurements is not None:
+            for line in usage.report(
+                    dict((path, kind) for path, (kind, _)
+                         in measurements.items()),
+                    dict((path, used) for path, (_, used)
+                         in measurements.items())):
+                log.info(line)
+
+        if self.stats == '-':
+            for line in json.dumps(run_stats.as_dict(), indent=2,
+                                   sort_keys=True).splitlines():
+                log.info(line)
+        elif self.stats:
+            with open(self.stats, 'w') as stats_file:
+                run_stats.write(stats_file)
+
+    def _journaled_kinds(self):
+        return [kind for kind in ('build', 'dist', 'eggs')
+                if getattr(self, kind)]
+
+    def _path(self, path):
+        """Return `path` relative to the current directory."""
+        if self.root == os.curdir or os.path.isabs(path):
+            return path
+        return os.path.join(self.root, path)
+
+    def _gather_targets(self, targets, journaled, resolve):
+        """Add the build, dist, and environment targets to `targets`.
+
+        Build and dist targets are not resolved if they are included
+        in the `journaled` kinds.
+
+        """
+        for kind in ('build', 'dist'):
+            if (getattr(self, kind) and kind not in journaled and
+                    resolve is not None):
+                for dir_name in resolve(kind):
+                    targets.setdefault(self._path(dir_name), kind)
+
+        if self.environment and self.virtualenv_dir:
+            targets.setdefault(self.virtualenv_dir, 'environment')
+
+    def _discover_targets(self, targets, journaled, counters, skip=()):
+        """Find the targets that are not already in `targets`.
+
+        :returns: an iterator of :class:`~setupext_janitor.discovery.Target`
+            instances that are produced as the tree is searched
+
+        The egg-info directories are not searched for if eggs are
+        included in the `journaled` kinds.  The directories in `skip`
+        are not searched.
+
+        """
+        rules = []
+        if self.eggs and 'eggs' not in journaled:
+            rules.append(discovery.Rule(
+                'eggs', discovery.compile_patterns(['*.egg-info']),
+                directory=self.egg_base))
+        if self.eggs:
+            rules.append(discovery.Rule(
+                'eggs', discovery.compile_patterns(['*.egg', '*.eggs']),
+                directory=self.root))
+        if self.pycache:
+            rules.append(discovery.Rule(
+                'pycache', lambda name: name == '__pycache__',
+                dirs_only=True))
+        if self.patterns:
+            rules.append(discovery.Rule(
+                'pattern', discovery.compile_patterns(self.patterns)))
+        inspectors, prune = [], self.prune
+        if self.stale_bytecode and not self.pycache:
+            # find_stale inspects __pycache__ from its parent directory
+            inspectors.append(bytecode.find_stale)
+            prune = prune + ['__pycache__']
+        evictor = None
+        if (not self.pycache and (self.pycache_budget is not None or
+                                  self.pycache_max_age is not None)):
+            max_age = self.pycache_max_age
+            evictor = eviction.PycacheEvictor(
+                budget=self.pycache_budget,
+                max_age=max_age * 86400 if max_age is not None else None)
+            inspectors.append(evictor)
+            prune = prune + ['__pycache__']
+
+        skip = [d for d in (self.virtualenv_dir,
+                            os.environ.get('VIRTUAL_ENV', None),
+                            self.trash_dir) if d] + list(skip)
+        skip.extend(targets)
+        if self.gitignored:
+            inspectors.append(gitignore.Inspector(
+                self.root, keep=skip + [p for p in (self.journal,) if p]))
+        cache_evictor = None
+        if self.max_cache_size is not None:
+            cache_evictor = eviction.ToolCacheEvictor(
+                self.max_cache_size, jobs=self.jobs, keep=skip)
+            inspectors.append(cache_evictor)
+        if not rules and not inspectors:
+            return
+        gathered = discovery.PathSet(targets)
+        for target in discovery.discover(
+                self.root, rules, prune=prune, skip=skip,
+                inspectors=inspectors, counters=counters, fs=self.fs,
+                one_file_system=self.one_file_system):
+            if target.path not in gathered:
+                if evictor is not None and target.kind == 'bytecode':
+                    evictor.exclude(target.path)
+                if cache_evictor is not None:
+                    cache_evictor.exclude(target.path)
+                yield target
+        for selector in (evictor, cache_evictor):
+            if selector is not None:
+                for target in selector.targets(counters):
+                    if target.path not in gathered:
+                        yield target
+
+    def _remove_targets(self, targets, run_stats, progress,
+                        measurements=None):
+        """Remove each of the targets as it arrives.
+
+        :param targets: iterator of :class:`~setupext_janitor.discovery.Target`
+            instances to remove
+        :param run_stats: the statistics for the run
+        :param progress: the :class:`ProgressHook` to report to
+        :param dict measurements: if specified, then the kind and
+            :class:`~setupext_janitor.usage.Usage` of each target are
+            stored here.  The usage is what the remover freed unless
+            nothing is removed in the foreground (a dry run or
+            ``--trash``) in which case the target is measured before
+            it is removed.
+
+        This runs in the background thread that :meth:`execute` starts.
+
+        """
+        measure_first = measurements is not None and (self.dry_run or
+                                                      self.trash)
+        tally = measurements is not None and not measure_first
+        with run_stats.phase('remove') as counters:
+            limits = None
+            if self.max_ops_per_sec or self.max_bytes_per_sec:
+                limits = throttle.Throttle(self.max_ops_per_sec,
+                                           self.max_bytes_per_sec)
+            if (self.idle_io and not self.dry_run and
+                    not throttle.set_idle_priority()):
+                log.warn('idle I/O priority is not supported here')
+            remover = removal.REMOVERS[self.remover](
+                jobs=self.jobs, dry_run=self.dry_run, counters=counters,
+                fs=self.fs, throttle=limits)
+            if self.trash:
+                remover = removal.Trash(self.trash_dir, remover,
+                                        idle_io=self.idle_io)
+            for target in targets:
+                if not self.fs.exists(target.path):
+                    log.debug('skipping %s since it does not exist',
+                              target.path)
+                    progress.target_skipped(target)
+                    continue
+                if measure_first:
+                    with run_stats.phase('measure') as measure_counters:
+                        used = usage.measure([target.path], jobs=self.jobs,
+                                             counters=measure_counters,
+                                             fs=self.fs)
+                    measurements[target.path] = (target.kind,
+                                                 used[target.path])
+                if tally:  # count what this target frees by itself
+                    remover.counters = stats.Counters()
+                remover.remove(target.path)
+                if tally:
+                    removed = remover.counters.values
+                    counters.add(**removed)
+                    measurements[target.path] = (target.kind, usage.Usage(
+                        removed['bytes_freed'],
+                        removed['files_removed'] +
+                        removed['directories_removed'] -
+                        removed['links_removed']))
+                progress.target_removed(target)
+            if self.trash:
+                remover.close()
+            if limits is not None:
+                counters.add(throttle_wait=limits.waited)
+
+
+def selects_command(kind, cmd_name):
+    """Does the `cmd_name` command create `kind` directories?"""
+    if kind == 'build':
+        return cmd_name.startswith('build')
+    return 'dist' in cmd_name
+
+
+def _string_list(value):
+    """Split a comma or white space separated string into a list."""
+    if isinstance(value, str):
+        value = re.split(r',\s*|\s+', value)
+    return [item for item in value if item]
@@ -0,0 +1,303 @@
+import collections
+import os
+import re
+import sys
+import time
+
+from setupext_janitor import discovery, stats, usage
+
+
+# a candidate for eviction -- `size` is the number of bytes that evicting
+# it frees, `last_used` is a timestamp, and `dead` entries are always evicted
+Entry = collections.namedtuple(
+    'Entry', ['path', 'size', 'last_used', 'dead'])
+
+
+def select(entries, budget=None, max_age=None, now=None):
+    """
+    Choose the entries to evict.
+
+    :param entries: iterable of :class:`Entry` instances
+    :param int budget: if specified, then the least recently used
+        entries are evicted until the remaining entries use at most
+        this many bytes
+    :param float max_age: if specified, then entries that have not been
+        used for this many seconds are evicted
+    :param float now: the current time (default: :func:`time.time`)
+    :returns: the list of entries to evict in the order that they
+        were chosen
+
+    Dead entries are chosen first followed by entries that are older
+    than `max_age` and then the least recently used entries that do
+    not fit in `budget`.
+
+    """
+    now = time.time() if now is None else now
+    evicted, kept = [], []
+    for entry in entries:
+        if entry.dead:
+            evicted.append(entry)
+        else:
+            kept.append(entry)
+
+    if max_age is not None:
+        expired = [e for e in kept if now - e.last_used > max_age]
+        kept = [e for e in kept if now - e.last_used <= max_age]
+        evicted.extend(sorted(expired, key=lambda e: e.last_used))
+
+    if budget is not None:
+        kept.sort(key=lambda e: e.last_used)
+        total = sum(e.size for e in kept)
+        for entry in kept:
+            if total <= budget:
+                break
+            evicted.append(entry)
+            total -= entry.size
+    return evicted
+
+
+def last_used(info):
+    """Return the later of the access and modification times."""
+    return max(info.st_atime, info.st_mtime)
+
+
+def installed_cache_tags(search_path=None):
+    """
+    Find the bytecode cache tags of the installed interpreters.
+
+    :param str search_path: directories to search for interpreters
+        (default: :envvar:`PATH`)
+    :rtype: set
+
+    The tag of the running interpreter is always included.  Others are
+    derived from versioned executable names like *python3.8* and
+    *pypy3.9* without running them.
+
+    """
+    tags = set()
+    implementation = getattr(sys, 'implementation', None)
+    if getattr(implementation, 'cache_tag', None):
+        tags.add(implementation.cache_tag)
+    if search_path is None:
+        search_path = os.environ.get('PATH', '')
+    for dir_path in search_path.split(os.pathsep):
+        try:
+            names = os.listdir(dir_path)
+        except OSError:
+            continue
+        for name in names:
+            match = _INTERPRETER.match(name)
+            if match is not None:
+                kind, major, minor = match.groups()
+                if kind == 'python':
+                    tags.add('cpython-{0}{1}'.format(major, minor))
+                else:
+                    tags.add('pypy{0}{1}'.format(major, minor))
+    return tags
+
+
+_INTERPRETER = re.compile(r'^(python|pypy)(3)\.(\d+)(?:\.exe)?$')
+
+
+def cache_tag(file_name):
+    """
+    Return the interpreter tag of a cached bytecode file name.
+
+    :returns: the tag, for example ``cpython-38`` for
+        *module.cpython-38.opt-1.pyc*, or :data:`None` if the name
+        does not contain a tag
+
+    """
+    parts = file_name.split('.')
+    if len(parts) < 3:
+        return None
+    return parts[1]
+
+
+class PycacheEvictor(object):
+    """
+    Select the bytecode to evict from *__pycache__* directories.
+
+    :param int budget: the number of bytes that the bytecode in every
+        *__pycache__* directory is allowed to use
+    :param float max_age: evict bytecode that has not been used for
+        this many seconds
+    :param tags: the cache tags of the installed interpreters
+        (default: :func:`installed_cache_tags`)
+
+    This is a :func:`~setupext_janitor.discovery.discover` inspector
+    that records the *__pycache__* directories that are found without
+    selecting anything.  Once the search is complete, :meth:`targets`
+    lists the recorded directories and chooses the files to evict with
+    :func:`select`.  Bytecode for interpreters that are not installed
+    is always evicted and the least recently used bytecode is evicted
+    next.  A *__pycache__* directory is selected as a whole when all of
+    its files are evicted.
+
+    """
+
+    def __init__(self, budget=None, max_age=None, tags=None):
+        self.budget = budget
+        self.max_age = max_age
+        self.tags = installed_cache_tags() if tags is None else set(tags)
+        self.excluded = discovery.PathSet()
+        self._cache_dirs = []
+
+    def __call__(self, dir_path, entries):
+        for name, is_dir in entries:
+            if is_dir and name == '__pycache__':
+                self._cache_dirs.append(os.path.join(dir_path, name))
+        return ()
+
+    def exclude(self, path):
+        """Do not consider `path` since it is being removed already."""
+        self.excluded.add(path)
+
+    def targets(self, counters=stats.NULL_COUNTERS):
+        """
+        Choose the bytecode to evict.
+
+        :param counters: :class:`~setupext_janitor.stats.Counters` that
+            statistics are added to
+        :returns: an iterator of
+            :class:`~setupext_janitor.discovery.Target` instances
+
+        """
+        candidates, remaining = [], {}
+        for cache_dir in self._cache_dirs:
+            if self.excluded and cache_dir in self.excluded:
+                continue
+            try:
+                entries = discovery.list_directory(cache_dir)
+            except OSError:
+                counters.add(errors=1)
+                continue
+            counters.add(directories_scanned=1,
+                         entries_examined=len(entries))
+            remaining[cache_dir] = len(entries)
+            for name, is_dir in entries:
+                path = os.path.join(cache_dir, name)
+                if is_dir or (self.excluded and path in self.excluded):
+                    continue
+                try:
+                    info = os.lstat(path)
+                except OSError:
+                    continue
+                tag = cache_tag(name)
+                candidates.append(Entry(
+                    path, usage.allocated_size(info), last_used(info),
+                    tag is not None and tag not in self.tags))
+
+        evicted = collections.defaultdict(list)
+        for entry in select(candidates, self.budget, self.max_age):
+            evicted[os.path.dirname(entry.path)].append(entry.path)
+        for cache_dir in self._cache_dirs:
+            paths = evicted.get(cache_dir)
+            if not paths:
+                continue
+            if len(paths) == remaining[cache_dir]:
+                yield discovery.Target('pycache', cache_dir)
+            else:
+                for path in paths:
+                    yield discovery.Target('pycache', path)
+
+
+# directories that hold one environment per subdirectory
+ENVIRONMENT_DIRS = ('.nox', '.tox')
+
+# tool caches that are evicted as a whole
+CACHE_DIRS = ('.mypy_cache', '.pytest_cache')
+
+
+class ToolCacheEvictor(object):
+    """
+    Select the tool environments and caches to evict.
+
+    :param int budget: the number of bytes that the tool environments
+        and caches are allowed to use together
+    :param int jobs: maximum number of threads to measure with
+    :param keep: paths that are never selected
+
+    This is a :func:`~setupext_janitor.discovery.discover` inspector
+    that records the directories named in :data:`ENVIRONMENT_DIRS` and
+    :data:`CACHE_DIRS` without selecting anything.  Once the search is
+    complete, :meth:`targets` measures each environment (a subdirectory
+    of an environment directory) and each cache concurrently and evicts
+    the least recently used ones until the rest fit in `budget`.
+
+    An entry was last used when it or one of its immediate children was
+    last modified or, for files, last read.  The access times of
+    directories are ignored since listing a directory updates them.
+
+    """
+
+    def __init__(self, budget, jobs=1, keep=()):
+        self.budget = budget
+        self.jobs = jobs
+        self.keep = discovery.PathSet(keep)
+        self.excluded = discovery.PathSet()
+        self._env_dirs = []
+        self._cache_dirs = []
+
+    def __call__(self, dir_path, entries):
+        for name, is_dir in entries:
+            if is_dir and name in ENVIRONMENT_DIRS:
+                self._env_dirs.append(os.path.join(dir_path, name))
+            elif is_dir and name in CACHE_DIRS:
+                self._cache_dirs.append(os.path.join(dir_path, name))
+        return ()
+
+    def exclude(self, path):
+        """Do not consider `path` since it is being removed already."""
+        self.excluded.add(path)
+
+    def targets(self, counters=stats.NULL_COUNTERS):
+        """
+        Choose the environments and caches to evict.
+
+        :param counters: :class:`~setupext_janitor.stats.Counters` that
+            statistics are added to
+        :returns: an iterator of
+            :class:`~setupext_janitor.discovery.Target` instances
+
+        """
+        paths = list(self._cache_dirs)
+        for env_dir in self._env_dirs:
+            try:
+                entries = discovery.list_directory(env_dir)
+            except OSError:
+                counters.add(errors=1)
+                continue
+            paths.extend(os.path.join(env_dir, name)
+                         for name, is_dir in entries if is_dir)
+        paths = [path for path in paths
+                 if path not in self.keep and
+                 not (self.excluded and path in self.excluded)]
+
+        # read the times before measuring since it reads the trees
+        times = {}
+        for path in paths:
+            used = _last_used_tree(path)
+            if used is not None:
+                times[path] = used
+        sizes = usage.measure(list(times), jobs=self.jobs, counters=counters)
+        for entry in select([Entry(path, sizes[path].bytes, times[path],
+                                   False)
+                             for path in sorted(times)], self.budget):
+            yield discovery.Target('toolcache', entry.path)
+
+
+def _last_used_tree(path):
+    """Return when `path` was last used or :data:`None` if it is gone."""
+    try:
+        used = os.lstat(path).st_mtime
+        entries = discovery.list_directory(path)
+    except OSError:
+        return None
+    for name, is_dir in entries:
+        try:
+            info = os.lstat(os.path.join(path, name))
+        except OSError:
+            continue
+        used = max(used, info.st_mtime if is_dir else last_used(info))
+    return used
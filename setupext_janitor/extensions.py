@@ -0,0 +1,197 @@
+import collections
+import hashlib
+import json
+import os
+import re
+
+from setupext_janitor import discovery, log
+
+
+# name of the index that is kept in each build_temp directory
+INDEX_NAME = '.janitor-objects.json'
+
+# an object file -- `flags` is a string that changes whenever the
+# options that the source is compiled with change
+Object = collections.namedtuple(
+    'Object', ['path', 'source', 'depends', 'include_dirs', 'flags'])
+
+# an extension module or library that is linked from `objects`
+Product = collections.namedtuple('Product', ['path', 'objects'])
+
+_INCLUDE = re.compile(r'^[ \t]*#[ \t]*include[ \t]*["<]([^">\n]+)[">]',
+                      re.MULTILINE)
+
+
+class Inputs(object):
+    """
+    Hashes and include scans that are shared between objects.
+
+    The inputs of an object are its source, the files that its
+    extension depends on, and the headers that the source includes
+    directly or indirectly.  Headers are found by scanning for
+    ``#include`` directives and looking for the named file next to
+    the including file and in the include directories.  Headers that
+    are not found, such as system headers, are not inputs.
+
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._includes = {}
+
+    def collect(self, obj):
+        """Return the sorted input paths of an :class:`Object`."""
+        paths = set([obj.source])
+        paths.update(obj.depends)
+        pending = [obj.source]
+        while pending:
+            for header in self._scan(pending.pop(), obj.include_dirs):
+                if header not in paths:
+                    paths.add(header)
+                    pending.append(header)
+        return sorted(paths)
+
+    def hash(self, path):
+        """Return the content hash of `path` or :data:`None` if missing."""
+        if path not in self._hashes:
+            digest = hashlib.sha1()
+            try:
+                with open(path, 'rb') as input_file:
+                    for chunk in iter(lambda: input_file.read(65536), b''):
+                        digest.update(chunk)
+                self._hashes[path] = digest.hexdigest()
+            except (IOError, OSError):
+                self._hashes[path] = None
+        return self._hashes[path]
+
+    def _scan(self, path, include_dirs):
+        key = (path, tuple(include_dirs))
+        if key not in self._includes:
+            headers = []
+            try:
+                with open(path, 'rb') as source_file:
+                    text = source_file.read().decode('latin-1')
+            except (IOError, OSError):
+                text = ''
+            search = [os.path.dirname(path)] + list(include_dirs)
+            for name in _INCLUDE.findall(text):
+                for dir_name in search:
+                    header = os.path.normpath(os.path.join(dir_name, name))
+                    if os.path.isfile(header):
+                        headers.append(header)
+                        break
+            self._includes[key] = headers
+        return self._includes[key]
+
+
+def find_stale(products, build_temps=(), suffixes=('.o', '.obj'),
+               dry_run=False):
+    """
+    Find the object files and products whose inputs changed.
+
+    :param products: :class:`Product` instances that describe what the
+        build produces
+    :param build_temps: directories that the objects are compiled into.
+        Each one holds an index of the input hashes of the objects in
+        it named :data:`INDEX_NAME`.
+    :param suffixes: file name suffixes of object files.  Files in
+        `build_temps` with these suffixes that no product uses are
+        removed as well.
+    :param bool dry_run: do not update the indexes
+    :returns: list of :class:`~setupext_janitor.discovery.Target`
+        instances
+
+    An object is fresh when its inputs (see :class:`Inputs`) and flags
+    have the same hashes that were recorded in the index the last time
+    that it was found to be fresh.  Objects that are not in the index
+    or that were rebuilt since the index was written are fresh when
+    they are newer than all of their inputs.  A product is removed
+    along with its stale objects so that it is linked again.
+
+    """
+    indexes = dict((os.path.normpath(build_temp), _load_index(build_temp))
+                   for build_temp in build_temps)
+    fresh = dict((build_temp, {}) for build_temp in indexes)
+    inputs, expected, targets = Inputs(), set(), []
+    for product in products:
+        stale = False
+        for obj in product.objects:
+            path = os.path.normpath(obj.path)
+            expected.add(path)
+            paths = inputs.collect(obj)
+            try:
+                info = os.stat(path)
+            except OSError:
+                # build_ext compiles it when the product is out of date
+                stale = stale or _is_newer(paths, product.path)
+                continue
+
+            build_temp = _containing(path, indexes)
+            entry = indexes.get(build_temp, {}).get(path)
+            hashes = dict((p, inputs.hash(p)) for p in paths)
+            stamp = [info.st_size, info.st_mtime]
+            if entry is not None and entry['stamp'] == stamp:
+                is_fresh = (entry['flags'] == obj.flags and
+                            entry['inputs'] == hashes)
+            else:
+                is_fresh = not _is_newer(paths, path)
+            if is_fresh:
+                if build_temp is not None:
+                    fresh[build_temp][path] = {
+                        'flags': obj.flags, 'inputs': hashes,
+                        'stamp': stamp}
+            else:
+                stale = True
+                targets.append(discovery.Target('objects', path))
+        if stale and os.path.exists(product.path):
+            targets.append(discovery.Target('objects', product.path))
+
+    for build_temp in indexes:
+        for dir_path, _, file_names in os.walk(build_temp):
+            for name in file_names:
+                path = os.path.normpath(os.path.join(dir_path, name))
+                if name.endswith(tuple(suffixes)) and path not in expected:
+                    targets.append(discovery.Target('objects', path))
+        if not dry_run and os.path.isdir(build_temp):
+            _save_index(build_temp, fresh[build_temp])
+    return targets
+
+
+def _is_newer(paths, target):
+    """Is any of `paths` missing or newer than `target`?"""
+    try:
+        target_time = os.stat(target).st_mtime
+    except OSError:
+        return True
+    for path in paths:
+        try:
+            if os.stat(path).st_mtime > target_time:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def _containing(path, dir_names):
+    for dir_name in dir_names:
+        if path.startswith(os.path.join(dir_name, '')):
+            return dir_name
+    return None
+
+
+def _load_index(build_temp):
+    try:
+        with open(os.path.join(build_temp, INDEX_NAME)) as index_file:
+            index = json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    return index if isinstance(index, dict) else {}
+
+
+def _save_index(build_temp, index):
+    path = os.path.join(build_temp, INDEX_NAME)
+    try:
+        with open(path, 'w') as index_file:
+            json.dump(index, index_file, indent=2, sort_keys=True)
+    except (IOError, OSError) as error:
+        log.warn('failed to write object index %s: %s', path, error)
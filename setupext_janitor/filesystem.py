@@ -0,0 +1,324 @@
+"""
+File system backends.
+
+The discovery, measurement, and removal code does not call :mod:`os`
+directly.  Instead it goes through a backend that provides the
+following methods:
+
+``list_directory(path)``
+    the ``(name, is_dir)`` entries of a directory as returned from
+    :func:`setupext_janitor.discovery.list_directory`
+``listdir(path)``, ``lstat(path)``, ``remove(path)``, ``rmdir(path)``,
+``stat(path)``
+    the same as the :mod:`os` functions
+``exists(path)``
+    the same as :func:`os.path.exists`
+
+:data:`OS` is the real file system and is used by default.
+:class:`MemoryFilesystem` holds a tree in memory so that the
+algorithms can be exercised with millions of entries, injected
+failures, and -- when wrapped in a :class:`LatencyFilesystem` --
+simulated latency without touching the disk.
+
+"""
+import collections
+import errno
+import os
+import stat
+import threading
+import time
+
+from setupext_janitor import discovery
+
+
+class OSFilesystem(object):
+    """The file system of the operating system."""
+
+    listdir = staticmethod(os.listdir)
+    lstat = staticmethod(os.lstat)
+    remove = staticmethod(os.remove)
+    rmdir = staticmethod(os.rmdir)
+    stat = staticmethod(os.stat)
+
+    def list_directory(self, path):
+        return discovery.list_directory(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+
+# the default backend
+OS = OSFilesystem()
+
+
+class _Entry(object):
+
+    __slots__ = ('device', 'ino', 'size', 'mtime', 'children')
+
+    def __init__(self, device, ino, size=0, mtime=0.0, children=None):
+        self.device = device
+        self.ino = ino
+        self.size = size
+        self.mtime = mtime
+        self.children = children
+
+
+class MemoryFilesystem(object):
+    """
+    A file system that only exists in memory.
+
+    :param int device: the device number of the root directory
+
+    Relative paths are relative to the root directory so ``pkg`` and
+    ``/pkg`` name the same entry.  Populate the tree with
+    :meth:`add_directory`, :meth:`add_file`, and :meth:`bind`.  Every
+    method is safe to call from multiple threads and the number of
+    calls made to each one is counted in :attr:`operations`.
+
+    Use :meth:`fail` to make an operation raise :exc:`OSError` for a
+    specific path.
+
+    """
+
+    def __init__(self, device=1):
+        self.operations = collections.Counter()
+        self._root = _Entry(device, 1, children={})
+        self._inodes = 1
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def add_directory(self, path, mtime=0.0, device=None):
+        """
+        Create `path` and any missing parent directories.
+
+        :param int device: the device number of the directories that
+            are created, which simulates mounting another file system.
+            They are on the same device as their parent by default.
+
+        """
+        with self._lock:
+            self._makedirs(path, _split(path), mtime, device)
+
+    def add_file(self, path, size=0, mtime=0.0):
+        """Create a file of `size` bytes and any missing parents."""
+        names = _split(path)
+        with self._lock:
+            parent = self._makedirs(path, names[:-1], mtime)
+            if not names or names[-1] in parent.children:
+                raise _error(errno.EEXIST, path)
+            self._create(parent, names[-1], mtime, size=size)
+
+    def bind(self, source, path):
+        """
+        Make the directory `path` another name for `source`.
+
+        This simulates a bind mount or a hard link to a directory.
+        The parent of `path` must exist.
+
+        """
+        with self._lock:
+            entry = self._lookup(source)
+            if entry.children is None:
+                raise _error(errno.ENOTDIR, source)
+            parent, name = self._parent(path)
+            if name in parent.children:
+                raise _error(errno.EEXIST, path)
+            parent.children[name] = entry
+
+    def fail(self, path, operation, error=errno.EACCES):
+        """
+        Make `operation` fail for `path`.
+
+        :param str path: the path that fails
+        :param str operation: name of the method that fails
+        :param int error: the :mod:`errno` code of the failure
+
+        """
+        with self._lock:
+            self._failures[operation, _key(path)] = error
+
+    def count(self):
+        """Return the number of entries below the root directory."""
+        with self._lock:
+            total, pending = 0, [self._root]
+            while pending:
+                entry = pending.pop()
+                if entry.children is not None:
+                    total += len(entry.children)
+                    pending.extend(entry.children.values())
+            return total
+
+    def exists(self, path):
+        with self._lock:
+            self.operations['exists'] += 1
+            try:
+                self._lookup(path)
+            except OSError:
+                return False
+            return True
+
+    def list_directory(self, path):
+        with self._lock:
+            entry = self._directory('list_directory', path)
+            return [(name, child.children is not None)
+                    for name, child in entry.children.items()]
+
+    def listdir(self, path):
+        with self._lock:
+            return list(self._directory('listdir', path).children)
+
+    def lstat(self, path):
+        return self._stat('lstat', path)
+
+    def stat(self, path):
+        # there are no symbolic links to follow
+        return self._stat('stat', path)
+
+    def remove(self, path):
+        with self._lock:
+            self._check('remove', path)
+            parent, name = self._parent(path)
+            entry = parent.children.get(name)
+            if entry is None:
+                raise _error(errno.ENOENT, path)
+            if entry.children is not None:
+                raise _error(errno.EISDIR, path)
+            del parent.children[name]
+
+    def rmdir(self, path):
+        with self._lock:
+            self._check('rmdir', path)
+            parent, name = self._parent(path)
+            entry = parent.children.get(name)
+            if entry is None:
+                raise _error(errno.ENOENT, path)
+            if entry.children is None:
+                raise _error(errno.ENOTDIR, path)
+            if entry.children:
+                raise _error(errno.ENOTEMPTY, path)
+            del parent.children[name]
+
+    def _create(self, parent, name, mtime, size=0, children=None,
+                device=None):
+        self._inodes += 1
+        entry = _Entry(parent.device if device is None else device,
+                       self._inodes, size, mtime, children)
+        parent.children[name] = entry
+        return entry
+
+    def _makedirs(self, path, names, mtime, device=None):
+        entry = self._root
+        for name in names:
+            child = entry.children.get(name)
+            if child is None:
+                child = self._create(entry, name, mtime, children={},
+                                     device=device)
+            elif child.children is None:
+                raise _error(errno.ENOTDIR, path)
+            entry = child
+        return entry
+
+    def _stat(self, operation, path):
+        with self._lock:
+            self._check(operation, path)
+            entry = self._lookup(path)
+            if entry.children is None:
+                mode, nlink = stat.S_IFREG | 0o644, 1
+            else:
+                mode, nlink = stat.S_IFDIR | 0o755, 2
+            return os.stat_result((mode, entry.ino, entry.device, nlink, 0,
+                                   0, entry.size, entry.mtime, entry.mtime,
+                                   entry.mtime))
+
+    def _check(self, operation, path):
+        self.operations[operation] += 1
+        if self._failures:
+            error = self._failures.get((operation, _key(path)))
+            if error is not None:
+                raise _error(error, path)
+
+    def _directory(self, operation, path):
+        self._check(operation, path)
+        entry = self._lookup(path)
+        if entry.children is None:
+            raise _error(errno.ENOTDIR, path)
+        return entry
+
+    def _lookup(self, path):
+        entry = self._root
+        for name in _split(path):
+            if entry.children is None:
+                raise _error(errno.ENOTDIR, path)
+            entry = entry.children.get(name)
+            if entry is None:
+                raise _error(errno.ENOENT, path)
+        return entry
+
+    def _parent(self, path):
+        names = _split(path)
+        if not names:
+            raise _error(errno.EBUSY, path)
+        parent = self._lookup(os.sep.join([''] + names[:-1]) or os.sep)
+        if parent.children is None:
+            raise _error(errno.ENOTDIR, path)
+        return parent, names[-1]
+
+
+class LatencyFilesystem(object):
+    """
+    Add a fixed delay to each file system operation.
+
+    :param float latency: seconds to delay each operation by
+    :param fs: the :mod:`~setupext_janitor.filesystem` backend to
+        delegate to (default: the real file system)
+
+    This simulates a high-latency network file system on a local disk
+    or on a :class:`~setupext_janitor.filesystem.MemoryFilesystem`
+    which is useful for testing and benchmarking.
+
+    """
+
+    def __init__(self, latency, fs=OS):
+        self.latency = latency
+        self.fs = fs
+
+    def exists(self, path):
+        time.sleep(self.latency)
+        return self.fs.exists(path)
+
+    def list_directory(self, path):
+        time.sleep(self.latency)
+        return self.fs.list_directory(path)
+
+    def listdir(self, path):
+        time.sleep(self.latency)
+        return self.fs.listdir(path)
+
+    def lstat(self, path):
+        time.sleep(self.latency)
+        return self.fs.lstat(path)
+
+    def stat(self, path):
+        time.sleep(self.latency)
+        return self.fs.stat(path)
+
+    def remove(self, path):
+        time.sleep(self.latency)
+        return self.fs.remove(path)
+
+    def rmdir(self, path):
+        time.sleep(self.latency)
+        return self.fs.rmdir(path)
+
+
+def _key(path):
+    return tuple(_split(path))
+
+
+def _split(path):
+    path = os.path.normpath(os.path.join(os.sep, path))
+    return [name for name in path.split(os.sep) if name]
+
+
+def _error(code, path):
+    return OSError(code, os.strerror(code), path)
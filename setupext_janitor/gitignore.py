@@ -0,0 +1,367 @@
+import os
+import re
+import struct
+
+from setupext_janitor import discovery
+
+
+# turns the raw bytes of a path in the git index into a str
+_decode = getattr(os, 'fsdecode', lambda name: name)
+
+
+def translate(pattern):
+    """
+    Translate a *.gitignore* glob into a regular expression.
+
+    :param str pattern: the glob without its leading ``!``, leading
+        ``/``, or trailing ``/``
+    :rtype: str
+
+    ``*`` and ``?`` do not match ``/``, a leading ``**/`` matches in
+    every directory, ``/**/`` matches zero or more directories, and a
+    trailing ``/**`` matches everything inside of a directory.
+    Backslash escapes the next character.
+
+    """
+    i, n, parts = 0, len(pattern), []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            if pattern[i:i + 1] == '*':
+                i += 1
+                at_boundary = i == 2 or pattern[i - 3] == '/'
+                if at_boundary and pattern[i:i + 1] == '/':
+                    parts.append('(?:.*/)?')
+                    i += 1
+                    continue
+                if at_boundary and i == n:
+                    parts.append('.*')
+                    continue
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '\\' and i < n:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+        elif c == '[':
+            j = i
+            if pattern[j:j + 1] in ('!', '^'):
+                j += 1
+            if pattern[j:j + 1] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                parts.append('\\[')
+                continue
+            body = pattern[i:j].replace('\\', '\\\\')
+            if body[:1] in ('!', '^'):
+                body = '^' + body[1:]
+            parts.append('[{0}]'.format(body))
+            i = j + 1
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts)
+
+
+def read_index(path, hash_size=20):
+    """
+    Read the paths that a git index tracks.
+
+    :param str path: the *index* file of a repository
+    :param int hash_size: the length of an object name in bytes, 32
+        for repositories that use SHA-256
+    :returns: list of ``/`` separated paths relative to the top of
+        the work tree.  An empty list is returned if the index cannot
+        be read or its format is not understood.
+
+    Versions 2, 3, and 4 of the index format are supported.  Only the
+    path of each entry is used, the rest of the entry and the index
+    extensions are skipped.
+
+    """
+    try:
+        with open(path, 'rb') as index_file:
+            data = index_file.read()
+    except (IOError, OSError):
+        return []
+    if data[:4] != b'DIRC':
+        return []
+    try:
+        version, count = struct.unpack('>II', data[4:12])
+        if version not in (2, 3, 4):
+            return []
+        paths, offset, previous = [], 12, b''
+        for _ in range(count):
+            start = offset
+            offset += 40 + hash_size  # stat fields and object name
+            flags, = struct.unpack('>H', data[offset:offset + 2])
+            offset += 4 if version > 2 and flags & 0x4000 else 2
+            if version == 4:
+                strip, offset = _read_offset(data, offset)
+                end = data.index(b'\0', offset)
+                name = previous[:len(previous) - strip] + data[offset:end]
+                offset = end + 1
+            else:
+                end = data.index(b'\0', offset)
+                name = data[offset:end]
+                offset = start + ((end - start + 8) & ~7)
+            previous = name
+            paths.append(_decode(name).rstrip('/'))
+    except (struct.error, ValueError, IndexError):
+        return []
+    return paths
+
+
+def _read_offset(data, offset):
+    """Decode the variable length integer that version 4 uses."""
+    byte = bytearray(data[offset:offset + 1])[0]
+    offset += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = bytearray(data[offset:offset + 1])[0]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, offset
+
+
+class IgnoreFile(object):
+    """
+    The compiled patterns from a single *.gitignore* file.
+
+    :param lines: the lines of the file
+
+    Every pattern is translated with :func:`translate` and the patterns
+    are combined into a single regular expression with the last pattern
+    first so that the first alternative that matches is the pattern that
+    git would use.  Directory-only patterns are left out of the
+    expression that is used for files.
+
+    """
+
+    def __init__(self, lines):
+        patterns = []
+        for line in lines:
+            line = re.sub(r'(?<!\\) +$', '', line.rstrip('\r\n'))
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            dirs_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            regex = translate(line.lstrip('/'))
+            if '/' not in line:
+                regex = '(?:.*/)?' + regex
+            patterns.append((regex, negated, dirs_only))
+        self._dirs = _compile(patterns)
+        self._files = _compile([p for p in patterns if not p[2]])
+
+    @classmethod
+    def load(cls, path):
+        """Read and compile `path` or return :data:`None` if unreadable."""
+        try:
+            with open(path) as ignore_file:
+                return cls(ignore_file.readlines())
+        except (IOError, OSError, UnicodeDecodeError):
+            return None
+
+    def match(self, path, is_dir):
+        """
+        Match a path against the patterns.
+
+        :param str path: ``/`` separated path relative to the directory
+            that contains the file
+        :param bool is_dir: is `path` a directory?
+        :returns: :data:`True` if `path` is ignored, :data:`False` if
+            it is explicitly re-included by a negated pattern, or
+            :data:`None` if no pattern matches
+
+        """
+        regex, negations = self._dirs if is_dir else self._files
+        if regex is None:
+            return None
+        match = regex.match(path)
+        if match is None:
+            return None
+        return not negations[match.lastindex - 1]
+
+
+def _compile(patterns):
+    if not patterns:
+        return None, []
+    patterns = list(reversed(patterns))
+    regex = re.compile('(?:{0})\\Z'.format(
+        '|'.join('({0})'.format(regex) for regex, _, _ in patterns)),
+        re.DOTALL)
+    return regex, [negated for _, negated, _ in patterns]
+
+
+class Inspector(object):
+    """
+    Select the paths that *.gitignore* files ignore.
+
+    :param str root: the directory that discovery starts in
+    :param keep: paths that are never selected
+
+    This is a :func:`~setupext_janitor.discovery.discover` inspector.
+    The *.gitignore* file in each directory that is searched is
+    compiled the first time the directory is listed and applies to
+    everything below it, with deeper files taking precedence.  When
+    `root` is inside of a git work tree, the *.gitignore* files in the
+    directories between the top of the work tree and `root` as well as
+    *.git/info/exclude* apply too.
+
+    Ignored directories are selected as a whole so the search does not
+    descend into them.  Virtual environments (identified by their
+    *pyvenv.cfg* file) and the *.git* directory are never selected.
+
+    Files that are tracked by the work tree's *.git/index* are never
+    selected even if they are ignored, just like ``git clean -X``.  An
+    ignored directory that contains tracked files is searched instead
+    of being selected and its untracked entries are selected.  Git is
+    not required.
+
+    """
+
+    def __init__(self, root, keep=()):
+        self.root = root
+        self.keep = discovery.PathSet(keep)
+        self._prefix_length = len(os.path.join(root, ''))
+        self._chains = {}
+        self._ignored_dirs = set()
+        self._tracked, self._tracked_dirs = set(), set()
+        self._base = self._find_ancestors()
+
+    def __call__(self, dir_path, entries):
+        chain = self._chain(dir_path, entries)
+        inside_ignored = dir_path in self._ignored_dirs
+        if not chain and not inside_ignored:
+            return
+        for name, is_dir in entries:
+            if name == '.git':
+                continue
+            path = os.path.join(dir_path, name)
+            relative = self._relative(path)
+            ignored = inside_ignored
+            if not inside_ignored:
+                for ignore_file, strip, prefix in reversed(chain):
+                    ignored = ignore_file.match(prefix + relative[strip:],
+                                                is_dir)
+                    if ignored is not None:
+                        break
+            if not ignored or path in self.keep or relative in self._tracked:
+                continue
+            if is_dir and relative in self._tracked_dirs:
+                self._ignored_dirs.add(path)
+                continue
+            if is_dir and os.path.exists(os.path.join(path, 'pyvenv.cfg')):
+                continue
+            yield discovery.Target('gitignored', path)
+
+    def _chain(self, dir_path, entries):
+        """Return the files that apply to the entries in `dir_path`."""
+        if dir_path == self.root:
+            chain = self._base
+        else:
+            chain = self._lookup(os.path.dirname(dir_path))
+        if any(name == '.gitignore' and not is_dir
+               for name, is_dir in entries):
+            ignore_file = IgnoreFile.load(
+                os.path.join(dir_path, '.gitignore'))
+            if ignore_file is not None:
+                relative = self._relative(dir_path)
+                chain = chain + [(ignore_file,
+                                  len(relative) + 1 if relative else 0, '')]
+                self._chains[dir_path] = chain
+        return chain
+
+    def _lookup(self, dir_path):
+        while True:
+            chain = self._chains.get(dir_path)
+            if chain is not None:
+                return chain
+            parent = os.path.dirname(dir_path)
+            if dir_path == self.root or parent == dir_path:
+                return self._base
+            dir_path = parent
+
+    def _relative(self, path):
+        if path == self.root:
+            return ''
+        relative = path[self._prefix_length:]
+        if os.sep != '/':
+            relative = relative.replace(os.sep, '/')
+        return relative
+
+    def _find_ancestors(self):
+        """Load the files above `root` in the same work tree."""
+        parts, current = [], os.path.abspath(self.root)
+        while not os.path.exists(os.path.join(current, '.git')):
+            parent = os.path.dirname(current)
+            if parent == current:
+                return []
+            parts.insert(0, os.path.basename(current))
+            current = parent
+
+        self._load_tracked(current, parts)
+        chain = []
+        for file_name in (os.path.join(current, '.git', 'info', 'exclude'),
+                          os.path.join(current, '.gitignore')):
+            ignore_file = IgnoreFile.load(file_name)
+            if ignore_file is not None and parts:
+                chain.append((ignore_file, 0, '/'.join(parts) + '/'))
+        for n in range(1, len(parts)):
+            ignore_file = IgnoreFile.load(
+                os.path.join(current, *(parts[:n] + ['.gitignore'])))
+            if ignore_file is not None:
+                chain.append((ignore_file, 0, '/'.join(parts[n:]) + '/'))
+        if not parts:  # root is the top of the work tree
+            ignore_file = IgnoreFile.load(
+                os.path.join(current, '.git', 'info', 'exclude'))
+            if ignore_file is not None:
+                chain.append((ignore_file, 0, ''))
+        return chain
+
+    def _load_tracked(self, top, parts):
+        """Read the paths below `root` that the work tree tracks."""
+        git_dir = os.path.join(top, '.git')
+        if os.path.isfile(git_dir):  # a linked work tree or submodule
+            try:
+                with open(git_dir) as git_file:
+                    line = git_file.readline().strip()
+            except (IOError, OSError):
+                return
+            if not line.startswith('gitdir:'):
+                return
+            git_dir = os.path.join(top, line[len('gitdir:'):].strip())
+
+        common_dir = git_dir
+        try:
+            with open(os.path.join(git_dir, 'commondir')) as common_file:
+                common_dir = os.path.join(git_dir,
+                                          common_file.readline().strip())
+        except (IOError, OSError):
+            pass
+        hash_size = 20
+        try:
+            with open(os.path.join(common_dir, 'config')) as config_file:
+                if re.search(r'^\s*objectformat\s*=\s*sha256\s*$',
+                             config_file.read(), re.I | re.M):
+                    hash_size = 32
+        except (IOError, OSError, UnicodeDecodeError):
+            pass
+
+        prefix = '/'.join(parts) + '/' if parts else ''
+        for path in read_index(os.path.join(git_dir, 'index'), hash_size):
+            if not path.startswith(prefix):
+                continue
+            path = path[len(prefix):]
+            self._tracked.add(path)
+            while '/' in path:
+                path = path.rsplit('/', 1)[0]
+                if path in self._tracked_dirs:
+                    break
+                self._tracked_dirs.add(path)
@@ -1,8 +1,10 @@
-from distutils import dir_util, errors, log
+from distutils import ccompiler, errors, log
 from distutils.command.clean import clean as _CleanCommand
+import json
 import os.path
 
 import setupext_janitor
+from setupext_janitor import cache, engine, extensions, projects, usage
 
 # backwards compat -- WILL BE REMOVED IN THE FUTURE
 version_info = setupext_janitor.version_info
@@ -36,6 +38,15 @@ class CleanCommand(_CleanCommand):
     ``--dry-run`` global option so that there should be no question
     what it is going to remove.
 
+    Programs that run this command in-process can set the
+    ``stats_hook`` attribute to a :class:`~setupext_janitor.stats.StatsHook`
+    instance to receive the same timings and counters that the
+    ``--stats`` option writes.
+
+    The work is done by a :class:`~setupext_janitor.engine.Cleaner`.
+    This command supplies it with the options and with the build and
+    distribution directories that the distribution's commands use.
+
     """
 
     # See _set_options for `user_options`
@@ -43,11 +54,33 @@ class CleanCommand(_CleanCommand):
     def initialize_options(self):
         _CleanCommand.initialize_options(self)
         self.build = False
+        self.cache_dir = None
+        self.disk_usage = False
         self.dist = False
         self.eggs = False
         self.egg_base = None
         self.environment = False
+        self.gitignored = False
+        self.idle_io = False
+        self.jobs = None
+        self.journal = None
+        self.max_bytes_per_sec = None
+        self.max_cache_size = None
+        self.max_ops_per_sec = None
+        self.one_file_system = True
+        self.patterns = None
+        self.prune = None
         self.pycache = False
+        self.pycache_budget = None
+        self.pycache_max_age = None
+        self.recursive_projects = False
+        self.remover = None
+        self.stale_bytecode = False
+        self.stale_objects = False
+        self.stats = None
+        self.stats_hook = None
+        self.trash = False
+        self.trash_dir = None
         self.virtualenv_dir = None
 
     def finalize_options(self):
@@ -58,55 +91,145 @@ class CleanCommand(_CleanCommand):
         except errors.DistutilsError:
             pass
 
-        if self.egg_base is None:
-            self.egg_base = os.curdir
-
         if self.all:
-            for flag in self.boolean_options:
+            for flag in self.target_options:
                 setattr(self, flag, True)
 
-        if self.environment and self.virtualenv_dir is None:
-            self.virtualenv_dir = os.environ.get('VIRTUAL_ENV', None)
+        if self.cache_dir is None:
+            self.cache_dir = cache.default_cache_dir()
+
+        if self.stale_objects and self.build:
+            raise errors.DistutilsOptionError(
+                '--stale-objects cannot be combined with --build')
+
+        cleaner = self._create_cleaner()
+        for name in engine.OPTIONS:
+            setattr(self, name, getattr(cleaner, name))
 
     def run(self):
-        _CleanCommand.run(self)
-
-        dir_names = set()
-        if self.build:
-            dir_names.update(_gather_attributes(
-                self.distribution,
-                lambda cmd_name: cmd_name.startswith('build'),
-                'build_base', 'build_clib', 'build_dir', 'build_lib',
-                'build_temp'))
-
-        if self.dist:
-            dir_names.update(_gather_attributes(
-                self.distribution, lambda cmd_name: 'dist' in cmd_name,
-                'dist_dir'))
-
-        if self.eggs:
-            for name in os.listdir(self.egg_base):
-                if name.endswith('.egg-info'):
-                    dir_names.add(os.path.join(self.egg_base, name))
-            for name in os.listdir(os.curdir):
-                for e in ['.egg', '.eggs']:
-                    if name.endswith(e):
-                        dir_names.add(name)
-
-        if self.environment and self.virtualenv_dir:
-            dir_names.add(self.virtualenv_dir)
-
-        if self.pycache:
-            for root, dirs, _ in os.walk(os.curdir):
-                if '__pycache__' in dirs:
-                    dir_names.add(os.path.join(root, '__pycache__'))
-
-        for dir_name in dir_names:
-            if os.path.exists(dir_name):
-                dir_util.remove_tree(dir_name, dry_run=self.dry_run)
-            else:
-                self.announce(
-                    'skipping {0} since it does not exist'.format(dir_name))
+        if not self.stale_objects:
+            _CleanCommand.run(self)
+
+        cleaner = self._create_cleaner()
+        run_stats = cleaner.create_stats()
+
+        project_dirs, failed = [], 0
+        if self.recursive_projects:
+            with run_stats.phase('projects') as counters:
+                project_dirs, failed = self._clean_projects(counters)
+
+        targets = {}
+        if self.stale_objects:
+            with run_stats.phase('objects') as counters:
+                for target in extensions.find_stale(
+                        *_gather_products(self.distribution),
+                        dry_run=self.dry_run):
+                    targets[target.path] = target.kind
+                counters.add(targets_found=len(targets))
+
+        resolver = _DirectoryResolver(self.distribution, self.cache_dir)
+        cleaner.execute(resolver, skip=project_dirs, targets=targets,
+                        run_stats=run_stats)
+        if not self.dry_run:
+            resolver.save()
+
+        if failed:
+            raise errors.DistutilsError(
+                'failed to clean {0} of {1} projects'.format(
+                    failed, len(project_dirs)))
+
+    def _create_cleaner(self):
+        """Create a finalized engine with the options of this command."""
+        cleaner = engine.Cleaner(
+            dry_run=self.dry_run, stats_hook=self.stats_hook,
+            **dict((name, getattr(self, name)) for name in engine.OPTIONS))
+        try:
+            cleaner.finalize()
+        except engine.OptionError as error:
+            raise errors.DistutilsOptionError(str(error))
+        return cleaner
+
+    def _clean_projects(self, counters):
+        """Clean the projects below the current directory.
+
+        :returns: a tuple of the list of project directories that were
+            found and the number of projects that could not be cleaned
+
+        Each project is cleaned in a process of its own with the
+        options from the command line.  A summary of each project is
+        logged as it finishes.
+
+        """
+        skip = [d for d in (self.virtualenv_dir,
+                            os.environ.get('VIRTUAL_ENV', None),
+                            self.trash_dir) if d]
+        project_dirs = projects.find_projects(
+            os.curdir, prune=self.prune, skip=skip, counters=counters,
+            one_file_system=self.one_file_system)
+        options = dict(
+            (name, value) for name, (source, value)
+            in self.distribution.get_option_dict('clean').items()
+            if source == 'command line' and
+            name not in projects.LOCAL_OPTIONS)
+
+        failed = 0
+        totals = {}
+        for summary in projects.clean_projects(
+                project_dirs, type(self), options, dry_run=self.dry_run,
+                jobs=self.jobs):
+            if summary['error']:
+                failed += 1
+                log.error('failed to clean %s: %s', summary['project'],
+                          summary['error'])
+                continue
+            for name, value in summary.items():
+                if name not in ('project', 'error'):
+                    totals[name] = totals.get(name, 0) + value
+            log.info('cleaned %s: %d targets, %s freed',
+                     summary['project'], summary['targets'],
+                     usage.format_size(summary.get('bytes_freed', 0)))
+
+        counters.add(projects_found=len(project_dirs),
+                     projects_failed=failed, **totals)
+        log.info('cleaned %d of %d projects: %d targets, %s freed',
+                 len(project_dirs) - failed,
+                 len(project_dirs), totals.get('targets', 0),
+                 usage.format_size(totals.get('bytes_freed', 0)))
+        return project_dirs, failed
+
+
+class _DirectoryResolver(object):
+    """Find the build and dist directories of a distribution.
+
+    :param distutils.dist.Distribution dist: the distribution
+    :param str cache_dir: directory that the resolved directories
+        are cached in or an empty value to disable caching
+
+    Instances are passed to :meth:`~setupext_janitor.engine.Cleaner.plan`
+    so the distribution's commands are only finalized when the
+    directories are needed and are not in the cache.
+
+    """
+
+    def __init__(self, dist, cache_dir):
+        self.dist = dist
+        self.cache_dir = cache_dir
+        self.attribute_cache = None
+
+    def __call__(self, kind):
+        if self.attribute_cache is None and self.cache_dir:
+            self.attribute_cache = cache.AttributeCache(
+                cache.cache_path(self.cache_dir),
+                cache.fingerprint(self.dist))
+        return _gather_cached_attributes(
+            self.attribute_cache, kind, self.dist,
+            lambda cmd_name: engine.selects_command(kind, cmd_name),
+            *engine.DIRECTORY_ATTRIBUTES[kind])
+
+    def save(self):
+        """Write the resolved directories to the cache."""
+        if self.attribute_cache is not None:
+            self.attribute_cache.save()
 
 
 def _gather_attributes(dist, selector, *attributes):
@@ -146,6 +269,88 @@ def _gather_attributes(dist, selector, *attributes):
     return dir_names
 
 
+def _gather_cached_attributes(attribute_cache, name, dist, selector,
+                              *attributes):
+    """Call :func:`_gather_attributes` unless `name` is cached.
+
+    :param setupext_janitor.cache.AttributeCache attribute_cache:
+        cache to consult or :data:`None` to disable caching
+    :param str name: name that the result is cached under
+
+    The remaining parameters are passed to :func:`_gather_attributes`
+    when the cache does not contain `name`.
+
+    """
+    if attribute_cache is not None:
+        dir_names = attribute_cache.get(name)
+        if dir_names is not None:
+            return dir_names
+    dir_names = _gather_attributes(dist, selector, *attributes)
+    if attribute_cache is not None:
+        attribute_cache.set(name, dir_names)
+    return dir_names
+
+
+def _gather_products(dist):
+    """Describe the extensions and libraries that `dist` builds.
+
+    :param distutils.dist.Distribution dist: distribution to process
+    :returns: a tuple of the list of
+        :class:`~setupext_janitor.extensions.Product` instances and
+        the list of directories that objects are compiled into
+
+    Extensions that are built in place are left out since their
+    outputs live in the source tree.
+
+    """
+    products, build_temps = [], []
+    build_ext = dist.get_command_obj('build_ext')
+    build_ext.ensure_finalized()
+    compiler = ccompiler.new_compiler(compiler=build_ext.compiler,
+                                      dry_run=True)
+    if not build_ext.inplace:
+        build_temps.append(build_ext.build_temp)
+        for ext in build_ext.extensions or []:
+            flags = json.dumps([ext.define_macros, ext.undef_macros,
+                                ext.extra_compile_args, ext.include_dirs])
+            products.append(_describe_product(
+                compiler, build_ext.get_ext_fullpath(ext.name),
+                ext.sources, build_ext.build_temp, ext.depends,
+                ext.include_dirs, flags))
+
+    if dist.has_c_libraries():
+        build_clib = dist.get_command_obj('build_clib')
+        build_clib.ensure_finalized()
+        build_temps.append(build_clib.build_temp)
+        for lib_name, build_info in build_clib.libraries or []:
+            flags = json.dumps([build_info.get('macros'),
+                                build_info.get('include_dirs')])
+            products.append(_describe_product(
+                compiler,
+                compiler.library_filename(
+                    lib_name, output_dir=build_clib.build_clib),
+                build_info.get('sources', []), build_clib.build_temp,
+                build_info.get('depends', []),
+                build_info.get('include_dirs') or [], flags))
+
+    return [p for p in products if p is not None], build_temps
+
+
+def _describe_product(compiler, path, sources, build_temp, depends,
+                      include_dirs, flags):
+    sources = sorted(sources)
+    try:
+        object_names = compiler.object_filenames(sources,
+                                                 output_dir=build_temp)
+    except errors.UnknownFileError as err:  # for example, SWIG sources
+        log.warn('ignoring %s: %s', path, err)
+        return None
+    return extensions.Product(path, [
+        extensions.Object(object_name, source, list(depends or []),
+                          list(include_dirs or []), flags)
+        for object_name, source in zip(object_names, sources)])
+
+
 def _set_options():
     """
     Set the options for CleanCommand.
@@ -163,23 +368,27 @@ def _set_options():
 
     """
     CleanCommand.user_options = _CleanCommand.user_options[:]
+    CleanCommand.user_options.extend(engine.USER_OPTIONS)
     CleanCommand.user_options.extend([
-        ('build', 'b', 'remove build directory'),
-        ('dist', 'd', 'remove distribution directory'),
-        ('eggs', None, 'remove egg and egg-info directories'),
-        ('environment', 'E', 'remove virtual environment directory'),
-        ('pycache', 'p', 'remove __pycache__ directories'),
-
-        ('egg-base=', 'e',
-         'directory containing .egg-info directories '
-         '(default: top of the source tree)'),
-        ('virtualenv-dir=', None,
-         'root directory for the virtual directory '
-         '(default: value of VIRTUAL_ENV environment variable)'),
+        ('stale-objects', None,
+         'remove the object files, libraries, and extension modules '
+         'whose sources or headers changed and keep the rest of '
+         'build_temp'),
+        ('recursive-projects', None,
+         'clean the projects below the current directory as well using '
+         '--jobs processes'),
+        ('cache-dir=', None,
+         'directory that resolved build and distribution directories '
+         'are cached in, set to an empty value to disable caching '
+         '(default: ~/.cache/setupext-janitor)'),
     ])
+    CleanCommand.target_options = engine.TARGET_OPTIONS[:]
     CleanCommand.boolean_options = _CleanCommand.boolean_options[:]
     CleanCommand.boolean_options.extend(
-        ['dist', 'eggs', 'environment', 'pycache'])
+        name.replace('_', '-') for name in engine.BOOLEAN_OPTIONS)
+    CleanCommand.boolean_options.extend(
+        ['recursive-projects', 'stale-objects'])
+    CleanCommand.negative_opt = dict(engine.NEGATIVE_OPTIONS)
 
 
 _set_options()
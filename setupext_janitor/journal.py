@@ -0,0 +1,173 @@
+import collections
+import json
+import os
+
+from setupext_janitor import log
+
+
+# attributes that hold the outputs of the commands that are journaled
+BUILD_ATTRIBUTES = ('build_base', 'build_clib', 'build_dir', 'build_lib',
+                    'build_temp')
+DIST_ATTRIBUTES = ('dist_dir',)
+
+
+def install(dist):
+    """
+    Record the artifacts of each command that `dist` runs.
+
+    :param distutils.dist.Distribution dist: the distribution to hook
+
+    This is registered as a ``setuptools.finalize_distribution_options``
+    entry point so it is called for every distribution that setuptools
+    creates when the janitor is installed.  It wraps
+    :meth:`~distutils.dist.Distribution.run_command` so that the
+    outputs of the *build*, *dist*, and *egg_info* commands are
+    appended to the journal named by the ``journal`` option in the
+    ``[clean]`` section of the configuration.  Nothing is recorded
+    unless that option is set.
+
+    """
+    if getattr(dist, '_janitor_journal_installed', False):
+        return
+    dist._janitor_journal_installed = True
+    run_command = dist.run_command
+
+    def journaling_run_command(command):
+        already_run = dist.have_run.get(command)
+        run_command(command)
+        if not already_run:
+            try:
+                record_command(dist, command)
+            except Exception as error:  # never break the build
+                log.warn('failed to journal %s: %s', command, error)
+
+    dist.run_command = journaling_run_command
+
+
+def record_command(dist, command):
+    """Append the artifacts produced by `command` to the journal."""
+    _, journal_file = dist.get_option_dict('clean').get('journal', (0, 0))
+    if not journal_file:
+        return
+
+    cmd = dist.get_command_obj(command)
+    if command.startswith('build'):
+        kind, attributes = 'build', BUILD_ATTRIBUTES
+    elif 'dist' in command:
+        kind, attributes = 'dist', DIST_ATTRIBUTES
+    elif command == 'egg_info':
+        kind, attributes = 'eggs', ('egg_info',)
+    else:
+        return
+
+    paths = [getattr(cmd, name, None) for name in attributes]
+    Journal(journal_file).record(kind, command, [p for p in paths if p])
+
+
+class Journal(object):
+    """
+    Append-only record of the artifacts that commands produced.
+
+    :param str path: the journal file
+
+    Each line of the journal is a JSON object that contains the type
+    of target (`kind`), the `path` of the artifact, the `command` that
+    produced it, and the modification time (`mtime`) of the artifact
+    when it was recorded.  Later lines supersede earlier lines for the
+    same path.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, kind, command, paths):
+        """Append the artifacts in `paths` that exist to the journal."""
+        lines = []
+        for path in paths:
+            try:
+                mtime = os.lstat(path).st_mtime
+            except OSError:
+                continue
+            lines.append(json.dumps({'kind': kind, 'path': path,
+                                     'command': command, 'mtime': mtime},
+                                    sort_keys=True))
+        if lines:
+            with open(self.path, 'a') as journal_file:
+                journal_file.write('\n'.join(lines) + '\n')
+
+    def read(self):
+        """
+        Read the journal.
+
+        :returns: an ordered mapping of path to the most recent record
+            for the path.  Malformed lines are ignored.
+
+        """
+        records = collections.OrderedDict()
+        try:
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                        records[record['path']] = record
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except (IOError, OSError):
+            pass
+        return records
+
+    def select(self, kinds, root=os.curdir):
+        """
+        Select the journaled targets of the specified kinds.
+
+        :param kinds: the types of target to select
+        :param str root: the directory that the journaled commands ran
+            in.  Relative paths in the journal are relative to it.
+        :returns: a tuple of a :class:`dict` mapping target path to
+            target type and the set of kinds that the journal can be
+            trusted for
+
+        Each selected artifact is checked with a single :func:`os.lstat`.
+        Artifacts that no longer exist are ignored.  If an artifact was
+        modified after it was recorded, then something that did not
+        write to the journal has touched it and the journal is not
+        trusted for that kind of target.  Kinds that do not appear in
+        the journal are not trusted either.
+
+        """
+        targets, trusted, drifted = {}, set(), set()
+        for path, record in self.read().items():
+            kind = record.get('kind')
+            if kind not in kinds:
+                continue
+            if root != os.curdir and not os.path.isabs(path):
+                path = os.path.join(root, path)
+            try:
+                info = os.lstat(path)
+            except OSError:
+                trusted.add(kind)
+                continue
+            if info.st_mtime != record.get('mtime'):
+                log.debug('%s changed after it was journaled', path)
+                drifted.add(kind)
+            trusted.add(kind)
+            targets[path] = kind
+        return targets, trusted - drifted
+
+    def discard(self, kinds):
+        """Rewrite the journal without the records of `kinds`."""
+        records = [r for r in self.read().values()
+                   if r.get('kind') not in kinds]
+        if not records:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            return
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as journal_file:
+            for record in records:
+                journal_file.write(json.dumps(record, sort_keys=True) + '\n')
+        getattr(os, 'replace', os.rename)(temp_path, self.path)
@@ -0,0 +1,46 @@
+"""
+Log through :mod:`distutils.log` when it is in use.
+
+The janitor runs both as a distutils command and as a standalone
+program that must not pay for importing distutils.  Messages go to
+:mod:`distutils.log` when it has already been imported so that they
+honor the verbosity of ``setup.py`` and to the ``setupext_janitor``
+:mod:`logging` logger otherwise.
+
+"""
+import logging
+import sys
+
+logger = logging.getLogger('setupext_janitor')
+
+_use_distutils = True
+
+
+def use_logging():
+    """Send messages to :mod:`logging` even if distutils is loaded."""
+    global _use_distutils
+    _use_distutils = False
+
+
+def debug(msg, *args):
+    _log('debug', logging.DEBUG, msg, args)
+
+
+def info(msg, *args):
+    _log('info', logging.INFO, msg, args)
+
+
+def warn(msg, *args):
+    _log('warn', logging.WARNING, msg, args)
+
+
+def error(msg, *args):
+    _log('error', logging.ERROR, msg, args)
+
+
+def _log(name, level, msg, args):
+    distutils_log = sys.modules.get('distutils.log')
+    if _use_distutils and distutils_log is not None:
+        getattr(distutils_log, name)(msg, *args)
+    else:
+        logger.log(level, msg, *args)
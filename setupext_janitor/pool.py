@@ -0,0 +1,153 @@
+import threading
+try:
+    import queue
+except ImportError:  # pragma: no cover -- Python 2
+    import Queue as queue
+
+
+def run(items, handler, jobs=1, lifo=False):
+    """
+    Process a growing collection of work items.
+
+    :param items: the initial work items
+    :param handler: callable that processes a single item.  It is
+        called as ``handler(item, submit)`` where `submit` is a
+        callable that adds another item to the work queue.
+    :param int jobs: maximum number of threads to process items with
+    :param bool lifo: process the most recently submitted items first.
+        This results in a depth-first traversal when handlers submit
+        the children of the item that they are processing.
+
+    Items are processed in the calling thread and up to ``jobs - 1``
+    additional threads.  The extra threads are only started when more
+    items are queued than the running threads can pick up, so a run
+    that never submits more than one item at a time -- removing a
+    directory that only contains files, for example -- does not pay
+    for starting and joining threads.  The call returns when the
+    queue is empty and no handler is running.  When `jobs` is one, a
+    handler's exception propagates immediately.  Otherwise the
+    remaining items are processed and the first exception is
+    re-raised when the queue is empty.
+
+    """
+    work = queue.LifoQueue() if lifo else queue.Queue()
+    for item in items:
+        work.put(item)
+
+    if jobs <= 1:
+        while True:
+            try:
+                item = work.get_nowait()
+            except queue.Empty:
+                break
+            handler(item, work.put)
+        return
+
+    failures = []
+    threads = []
+    lock = threading.Lock()
+
+    def process(item):
+        try:
+            handler(item, submit)
+        except Exception as error:
+            failures.append(error)
+        finally:
+            work.task_done()
+
+    def worker():
+        while True:
+            item = work.get()
+            if item is None:
+                work.task_done()
+                break
+            process(item)
+
+    def grow():
+        # the calling thread takes the next item, the others need help
+        while len(threads) < jobs - 1 and work.qsize() > len(threads) + 1:
+            with lock:
+                if len(threads) >= jobs - 1:
+                    break
+                thread = threading.Thread(target=worker)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+    def submit(item):
+        work.put(item)
+        grow()
+
+    grow()
+    while True:
+        try:
+            item = work.get_nowait()
+        except queue.Empty:
+            break
+        process(item)
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+
+
+class Consumer(object):
+    """
+    Process items in a background thread as they are produced.
+
+    :param target: callable that is called in the background thread
+        with an iterator of the items that are put into the consumer
+    :param int maxsize: maximum number of items that are waiting to
+        be consumed.  :meth:`put` blocks when the consumer falls this
+        far behind so memory use does not grow with the number of items.
+
+    """
+
+    def __init__(self, target, maxsize=0):
+        self.target = target
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._finished = False
+        self._failure = None
+
+    def start(self):
+        """Start the background thread."""
+        self._thread.start()
+
+    def put(self, item):
+        """Queue `item` for the consumer."""
+        self._queue.put(item)
+
+    def close(self):
+        """
+        Wait for the consumer to process every item.
+
+        If the consumer raised an exception, then it is re-raised.
+
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._failure is not None:
+            raise self._failure
+
+    def _items(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._finished = True
+                return
+            yield item
+
+    def _run(self):
+        try:
+            self.target(self._items())
+        except Exception as error:
+            self._failure = error
+        finally:
+            # keep the producer from blocking on a full queue
+            while not self._finished:
+                self._finished = self._queue.get() is None
@@ -0,0 +1,153 @@
+from distutils import core, log
+import multiprocessing
+import os
+import sys
+
+from setupext_janitor import discovery, stats
+
+
+# files that mark a directory as the root of a project
+PROJECT_FILES = ('setup.py', 'setup.cfg', 'pyproject.toml')
+
+# options that are never passed on to the projects that are cleaned
+LOCAL_OPTIONS = ('environment', 'jobs', 'recursive_projects', 'stats',
+                 'virtualenv_dir')
+
+
+def find_projects(root, prune=discovery.DEFAULT_PRUNE, skip=(),
+                  counters=stats.NULL_COUNTERS, one_file_system=True):
+    """
+    Find the projects below a directory.
+
+    :param str root: directory to start searching in
+    :param prune: glob patterns that match directory names that
+        should not be searched
+    :param skip: directory paths that should not be searched
+    :param counters: :class:`~setupext_janitor.stats.Counters` that
+        discovery statistics are added to
+    :param bool one_file_system: do not search directories that are on
+        a different device than `root`
+    :returns: sorted list of project directories
+
+    A project is a directory that contains one of the files listed in
+    :data:`PROJECT_FILES`.  `root` is not included and the search does
+    not descend into projects so projects that are nested inside of
+    other projects are cleaned along with their parent.
+
+    """
+    def inspect(dir_path, entries):
+        if dir_path != root and any(
+                not is_dir and name in PROJECT_FILES
+                for name, is_dir in entries):
+            yield discovery.Target('project', dir_path)
+
+    return sorted(target.path for target in discovery.discover(
+        root, [], prune=prune, skip=skip, inspectors=[inspect],
+        counters=counters, one_file_system=one_file_system))
+
+
+def clean_projects(projects, command_class, options, dry_run=False,
+                   jobs=1):
+    """
+    Clean several projects using a pool of processes.
+
+    :param list projects: the project directories to clean
+    :param type command_class: the clean command class to run
+    :param dict options: option values that are applied to the clean
+        command of every project after its configuration is read
+    :param bool dry_run: do not remove anything
+    :param int jobs: number of processes to clean projects with
+    :returns: an iterator of the summaries returned by
+        :func:`clean_project` in the same order as `projects`
+
+    Each process cleans a single project so that the modules that a
+    setup script imports do not leak into the next project.  Processes
+    are forked where that is supported so the cost of starting the
+    interpreter is only paid once.
+
+    """
+    if not projects:
+        return
+    pool = multiprocessing.Pool(min(jobs, len(projects)),
+                                maxtasksperchild=1)
+    try:
+        results = [pool.apply_async(clean_project,
+                                    (project, command_class, options,
+                                     dry_run))
+                   for project in projects]
+        for result in results:
+            yield result.get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def clean_project(project_dir, command_class, options, dry_run=False):
+    """
+    Clean a single project in the current process.
+
+    :param str project_dir: the project directory
+    :param type command_class: the clean command class to run
+    :param dict options: option values that are applied to the clean
+        command after the project's configuration is read
+    :param bool dry_run: do not remove anything
+    :returns: a :class:`dict` that summarizes the clean.  The `project`
+        key contains `project_dir`, `error` contains a message if the
+        clean failed, and the remaining keys are the counters from the
+        removal phase along with the number of `targets` that were found.
+
+    This changes the working directory and loads the project's setup
+    script so it is meant to be run in a process of its own.  The
+    project's distribution is loaded with its configuration files but
+    none of its commands are run.  Projects without a setup script are
+    loaded from their configuration files alone.
+
+    """
+    summary = {'project': project_dir, 'error': None, 'targets': 0}
+    hook = _SummaryHook(summary)
+    log.set_threshold(log.WARN)
+    try:
+        os.chdir(project_dir)
+        dist = _load_distribution()
+        dist.dry_run = dry_run
+        option_dict = dist.get_option_dict('clean')
+        for name, value in options.items():
+            option_dict[name] = ('command line', value)
+        option_dict['jobs'] = ('command line', '1')
+        dist.cmdclass['clean'] = command_class
+        command = dist.get_command_obj('clean')
+        command.ensure_finalized()
+        command.environment = False
+        command.stats_hook = hook
+        command.run()
+    except (Exception, SystemExit) as error:
+        summary['error'] = str(error) or error.__class__.__name__
+    return summary
+
+
+def _load_distribution():
+    if os.path.exists('setup.py'):
+        sys.path.insert(0, os.path.abspath(os.curdir))
+        return core.run_setup('setup.py', script_args=[],
+                              stop_after='config')
+    try:
+        from setuptools import dist as dist_module
+    except ImportError:  # pragma: no cover -- setuptools is optional
+        from distutils import dist as dist_module
+    dist = dist_module.Distribution()
+    dist.script_name = 'setup.py'
+    dist.parse_config_files()
+    return dist
+
+
+class _SummaryHook(stats.StatsHook):
+
+    def __init__(self, summary):
+        self.summary = summary
+
+    def phase_finished(self, name, result):
+        if name == 'discover':
+            self.summary['targets'] = result.get('targets_found', 0)
+        elif name == 'remove':
+            self.summary.update((key, value) for key, value in result.items()
+                                if key != 'wall_time')
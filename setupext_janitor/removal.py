@@ -0,0 +1,555 @@
+import os
+import stat
+import sys
+import threading
+
+from setupext_janitor import (
+    filesystem, log, pool, stats, throttle, usage)
+
+
+def default_jobs():
+    """Return the default number of removal threads."""
+    cpu_count = getattr(os, 'cpu_count', None)
+    if cpu_count is not None:
+        return cpu_count() or 1
+    import multiprocessing  # pragma: no cover -- Python 2
+    try:  # pragma: no cover
+        return multiprocessing.cpu_count()
+    except NotImplementedError:  # pragma: no cover
+        return 1
+
+
+def announce(path, fs=filesystem.OS):
+    """Log the removal of `path` the same way that distutils does."""
+    try:
+        is_dir = stat.S_ISDIR(fs.lstat(path).st_mode)
+    except OSError:
+        is_dir = False
+    if is_dir:
+        log.info("removing '%s' (and everything under it)", path)
+    else:
+        log.info("removing '%s'", path)
+
+
+class _Node(object):
+    """A directory that is waiting for its children to be removed."""
+
+    __slots__ = ('path', 'parent', 'pending', 'size')
+
+    def __init__(self, path, parent, size=0):
+        self.path = path
+        self.parent = parent
+        self.pending = 1  # released when the directory has been scanned
+        self.size = size  # bytes freed when the directory is removed
+
+
+class TreeRemover(object):
+    """
+    Remove directory trees using a bounded pool of threads.
+
+    :param int jobs: maximum number of threads to remove with
+    :param bool dry_run: if :data:`True`, then log what would be
+        removed without removing anything
+    :param counters: :class:`~setupext_janitor.stats.Counters` that
+        removal statistics are added to
+    :param fs: the :mod:`~setupext_janitor.filesystem` backend to
+        remove from.  Only the ``listdir``, ``lstat``, ``remove``, and
+        ``rmdir`` methods are used so :mod:`os` itself works as well.
+    :param throttle: optional :class:`~setupext_janitor.throttle.Throttle`
+        that each unlink and rmdir waits on
+
+    This is a drop-in replacement for :func:`distutils.dir_util.remove_tree`
+    that does not build the list of files in memory before removing
+    them.  Each directory is scanned by a worker thread that unlinks
+    the files that it contains and queues its sub-directories for the
+    other workers.  A directory is removed as soon as the last of its
+    children is gone so the pool is never idle waiting on a single
+    deep branch.
+
+    Space is accounted for the same way that
+    :func:`~setupext_janitor.usage.measure` does: the blocks allocated
+    to directories are included in ``bytes_freed`` and a file with
+    several hard links in the tree is only counted once.  The other
+    links are counted in ``links_removed``.
+
+    Errors are logged and otherwise ignored just as they are by
+    :func:`~distutils.dir_util.remove_tree`.
+
+    """
+
+    def __init__(self, jobs=1, dry_run=False, counters=stats.NULL_COUNTERS,
+                 fs=filesystem.OS, throttle=None):
+        self.jobs = max(1, jobs)
+        self.dry_run = dry_run
+        self.counters = counters
+        self.fs = fs
+        self.throttle = throttle
+        self._lock = threading.Lock()
+        self._root = None
+        self._seen = set()
+
+    def remove(self, root):
+        """Remove `root` and everything under it."""
+        announce(root, self.fs)
+        if not self.dry_run:
+            self.purge(root)
+
+    def purge(self, root):
+        """Remove `root` without announcing it or honoring dry-run."""
+        self._root, self._seen = root, set()
+        try:
+            info = self.fs.lstat(root)
+        except OSError as error:
+            self._report(error)
+            return
+
+        if stat.S_ISDIR(info.st_mode):
+            pool.run([_Node(root, None, usage.allocated_size(info))],
+                     self._scan, self.jobs)
+        else:
+            self._count(*self._unlink_file(root, info))
+        _forget_created_paths(root)
+
+    def _scan(self, node, submit):
+        try:
+            names = self.fs.listdir(node.path)
+        except OSError as error:
+            self._report(error)
+            names = []
+
+        removed, freed, links = 0, 0, 0
+        for name in names:
+            path = os.path.join(node.path, name)
+            try:
+                info = self.fs.lstat(path)
+            except OSError as error:
+                self._report(error)
+                continue
+            if stat.S_ISDIR(info.st_mode):
+                with self._lock:
+                    node.pending += 1
+                submit(_Node(path, node, usage.allocated_size(info)))
+            else:
+                files, size, link = self._unlink_file(path, info)
+                removed += files
+                freed += size
+                links += link
+
+        self._count(removed, freed, links, directories_scanned=1,
+                    entries_examined=len(names))
+        self._release(node)
+
+    def _release(self, node):
+        while node is not None:
+            with self._lock:
+                node.pending -= 1
+                finished = node.pending == 0
+            if not finished:
+                break
+            try:
+                self._wait()
+                self.fs.rmdir(node.path)
+                self.counters.add(directories_removed=1,
+                                  bytes_freed=node.size)
+            except OSError as error:
+                self._report(error)
+            node = node.parent
+
+    def _unlink_file(self, path, info, unlink=None):
+        """
+        Unlink a file and work out what that frees.
+
+        :param unlink: called as ``unlink(path, size)`` to remove the
+            file (default: :meth:`_unlink`)
+        :returns: a tuple of the number of files removed, the bytes
+            freed, and the number of those files that were another
+            link to a file that was already counted
+
+        """
+        size, counted = usage.allocated_size(info), True
+        # the link count drops as links are removed so the last link
+        # to a file is found by its inode and not by its link count
+        if info.st_nlink > 1 or self._seen:
+            key = (info.st_dev, info.st_ino)
+            with self._lock:
+                counted = key not in self._seen
+                if info.st_nlink > 1:
+                    self._seen.add(key)
+            if not counted:
+                size = 0
+        if not (unlink or self._unlink)(path, size):
+            return 0, 0, 0
+        return 1, size, 0 if counted else 1
+
+    def _count(self, removed, freed, links, **counts):
+        if links:
+            counts['links_removed'] = links
+        self.counters.add(files_removed=removed, bytes_freed=freed,
+                          **counts)
+
+    def _unlink(self, path, size=0):
+        try:
+            self._wait(size)
+            self.fs.remove(path)
+            return True
+        except OSError as error:
+            self._report(error)
+            return False
+
+    def _wait(self, size=0):
+        if self.throttle is not None:
+            self.throttle.wait(size)
+
+    def _report(self, error):
+        self.counters.add(errors=1)
+        log.warn('error removing %s: %s', self._root, error)
+
+
+class LatencyHidingRemover(TreeRemover):
+    """
+    Remove directory trees with as many operations in flight as possible.
+
+    This has the same interface as :class:`TreeRemover`.  Instead of
+    having a thread remove every file in the directory that it scans,
+    each entry is queued separately so that `jobs` metadata operations
+    are outstanding at any time.  That hides the round-trip latency of
+    network file systems where each :func:`~os.unlink` and
+    :func:`~os.rmdir` is a request to the server.  Work is processed
+    most recent first so the traversal is depth-first and directories
+    are removed as soon as possible.
+
+    """
+
+    def purge(self, root):
+        """Remove `root` without announcing it or honoring dry-run."""
+        self._root, self._seen = root, set()
+        try:
+            info = self.fs.lstat(root)
+        except OSError as error:
+            self._report(error)
+            return
+
+        if stat.S_ISDIR(info.st_mode):
+            pool.run([_Node(root, None, usage.allocated_size(info))],
+                     self._process, self.jobs, lifo=True)
+        else:
+            self._count(*self._unlink_file(root, info))
+        _forget_created_paths(root)
+
+    def _process(self, node, submit):
+        if node.parent is not None:
+            try:
+                info = self.fs.lstat(node.path)
+            except OSError as error:
+                self._report(error)
+                self._release(node.parent)
+                return
+            if not stat.S_ISDIR(info.st_mode):
+                self._count(*self._unlink_file(node.path, info))
+                self._release(node.parent)
+                return
+            node.size = usage.allocated_size(info)
+
+        try:
+            names = self.fs.listdir(node.path)
+        except OSError as error:
+            self._report(error)
+            names = []
+        with self._lock:
+            node.pending += len(names)
+        for name in names:
+            submit(_Node(os.path.join(node.path, name), node))
+        self.counters.add(directories_scanned=1, entries_examined=len(names))
+        self._release(node)
+
+
+class _DescriptorNode(_Node):
+    """A directory that is removed relative to its parent's descriptor."""
+
+    __slots__ = ('name', 'fd')
+
+    def __init__(self, path, name, parent, size=0):
+        super(_DescriptorNode, self).__init__(path, parent, size)
+        self.name = name
+        self.fd = None
+
+
+class DescriptorRemover(TreeRemover):
+    """
+    Remove directory trees relative to open directory descriptors.
+
+    This has the same interface as :class:`TreeRemover`.  Each
+    directory is opened once and its entries are listed, unlinked, and
+    removed with ``dir_fd`` relative calls so the kernel never resolves
+    a full path below the root.  Directories are opened with
+    ``O_NOFOLLOW`` which means that a directory that is swapped for a
+    symbolic link while the tree is being removed is never followed.
+    Work is processed most recent first so the traversal is depth-first
+    and the number of open descriptors is proportional to the depth of
+    the tree.
+
+    Entries are only stat'ed when `counters` are collected or
+    `throttle` limits the bytes freed per second.  This falls back to
+    :class:`TreeRemover` on platforms that do not support descriptor
+    relative operations or when `fs` is not the real file system.
+
+    """
+
+    supported = (
+        hasattr(os, 'O_DIRECTORY') and hasattr(os, 'O_NOFOLLOW') and
+        os.open in getattr(os, 'supports_dir_fd', ()) and
+        os.unlink in getattr(os, 'supports_dir_fd', ()) and
+        os.rmdir in getattr(os, 'supports_dir_fd', ()) and
+        getattr(os, 'scandir', None) in getattr(os, 'supports_fd', ()))
+
+    def purge(self, root):
+        """Remove `root` without announcing it or honoring dry-run."""
+        if not self.supported or self.fs not in (filesystem.OS, os):
+            return super(DescriptorRemover, self).purge(root)
+
+        self._root, self._seen = root, set()
+        try:
+            info = os.lstat(root)
+        except OSError as error:
+            self._report(error)
+            return
+
+        if stat.S_ISDIR(info.st_mode):
+            pool.run([_DescriptorNode(root, None, None,
+                                      usage.allocated_size(info))],
+                     self._scan_descriptor, self.jobs, lifo=True)
+        else:
+            self._count(*self._unlink_file(root, info))
+        _forget_created_paths(root)
+
+    def _scan_descriptor(self, node, submit):
+        flags = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+        try:
+            if node.parent is None:
+                node.fd = os.open(node.path, flags)
+            else:
+                node.fd = os.open(node.name, flags, dir_fd=node.parent.fd)
+            with os.scandir(node.fd) as iterator:
+                entries = list(iterator)
+        except OSError as error:
+            self._report(error)
+            entries = []
+
+        def unlink(name, size=0):
+            try:
+                self._wait(size)
+                os.unlink(name, dir_fd=node.fd)
+                return True
+            except OSError as error:
+                self._report(error)
+                return False
+
+        measure = (self.counters is not stats.NULL_COUNTERS or
+                   getattr(self.throttle, 'bytes', None) is not None)
+        removed, freed, links = 0, 0, 0
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                info = entry.stat(follow_symlinks=False) if measure else None
+            except OSError as error:
+                self._report(error)
+                continue
+            if is_dir:
+                with self._lock:
+                    node.pending += 1
+                submit(_DescriptorNode(
+                    os.path.join(node.path, entry.name), entry.name, node,
+                    usage.allocated_size(info) if measure else 0))
+            elif measure:
+                files, size, link = self._unlink_file(entry.name, info,
+                                                      unlink)
+                removed += files
+                freed += size
+                links += link
+            elif unlink(entry.name):
+                removed += 1
+
+        self._count(removed, freed, links, directories_scanned=1,
+                    entries_examined=len(entries))
+        self._release_descriptor(node)
+
+    def _release_descriptor(self, node):
+        while node is not None:
+            with self._lock:
+                node.pending -= 1
+                finished = node.pending == 0
+            if not finished:
+                break
+            if node.fd is not None:
+                os.close(node.fd)
+                node.fd = None
+            try:
+                self._wait()
+                if node.parent is None:
+                    os.rmdir(node.path)
+                else:
+                    os.rmdir(node.name, dir_fd=node.parent.fd)
+                self.counters.add(directories_removed=1,
+                                  bytes_freed=node.size)
+            except OSError as error:
+                self._report(error)
+            node = node.parent
+
+
+# removal strategies that can be selected with the --remover option
+REMOVERS = {
+    'fd': DescriptorRemover,
+    'latency': LatencyHidingRemover,
+    'tree': TreeRemover,
+}
+
+# the remover that is used when --remover is not specified
+DEFAULT_REMOVER = 'fd' if DescriptorRemover.supported else 'tree'
+
+
+class Trash(object):
+    """
+    Move trees aside and remove them in a background process.
+
+    :param str trash_dir: directory that trees are moved into
+    :param TreeRemover remover: used to remove trees that cannot
+        be moved into `trash_dir`
+    :param bool idle_io: run the background process at idle I/O
+        priority.  It is throttled like `remover` either way.
+
+    Each tree is renamed into a per-run directory under `trash_dir`
+    which is an atomic and nearly instantaneous operation when both
+    are on the same file system.  Trees on other devices are removed
+    in the foreground by `remover`.  Calling :meth:`close` starts a
+    detached process that empties `trash_dir` -- including anything
+    left behind by an earlier process that was interrupted.
+
+    """
+
+    def __init__(self, trash_dir, remover, idle_io=False):
+        self.trash_dir = trash_dir
+        self.remover = remover
+        self.idle_io = idle_io
+        self._run_dir = None
+        self._run_dev = None
+        self._count = 0
+
+    def remove(self, root):
+        """Move `root` into the trash."""
+        announce(root)
+        if self.remover.dry_run:
+            return
+
+        try:
+            if self._run_dir is None:
+                self._create_run_dir()
+            same_device = os.lstat(root).st_dev == self._run_dev
+        except OSError:
+            same_device = False
+        if same_device:
+            self._count += 1
+            target = os.path.join(
+                self._run_dir, '{0}-{1}'.format(
+                    self._count, os.path.basename(os.path.normpath(root))))
+            try:
+                os.rename(root, target)
+                self.remover.counters.add(targets_trashed=1)
+                _forget_created_paths(root)
+                return
+            except OSError:
+                pass
+        self.remover.purge(root)
+
+    def close(self):
+        """Start a background process to empty the trash."""
+        if self.remover.dry_run:
+            return
+        try:
+            if not os.listdir(self.trash_dir):
+                return
+        except OSError:
+            return
+        limits = self.remover.throttle or throttle.Throttle()
+        _spawn_trash_worker(self.trash_dir, self.remover.jobs,
+                            limits.ops_per_sec, limits.bytes_per_sec,
+                            self.idle_io)
+
+    def _create_run_dir(self):
+        if not os.path.isdir(self.trash_dir):
+            os.makedirs(self.trash_dir)
+        import tempfile  # only imported when needed for a fast start up
+        self._run_dir = tempfile.mkdtemp(prefix='run-', dir=self.trash_dir)
+        self._run_dev = os.stat(self._run_dir).st_dev
+
+
+def empty_trash(trash_dir, jobs=1, ops_per_sec=None, bytes_per_sec=None,
+                idle_io=False):
+    """
+    Remove everything in `trash_dir` followed by `trash_dir` itself.
+
+    :param float ops_per_sec: maximum number of removals per second
+    :param int bytes_per_sec: maximum number of bytes freed per second
+    :param bool idle_io: remove at idle I/O priority
+
+    This is what the background process started by :meth:`Trash.close`
+    runs.  It is safe to run more than one concurrently since removal
+    errors are ignored.
+
+    """
+    if idle_io:
+        throttle.set_idle_priority()
+    limits = None
+    if ops_per_sec or bytes_per_sec:
+        limits = throttle.Throttle(ops_per_sec, bytes_per_sec)
+    remover = TreeRemover(jobs=jobs, throttle=limits)
+    try:
+        names = os.listdir(trash_dir)
+    except OSError:
+        return
+    for name in names:
+        remover.purge(os.path.join(trash_dir, name))
+    try:
+        os.rmdir(trash_dir)
+    except OSError:
+        pass  # another run has added to the trash
+
+
+def _spawn_trash_worker(trash_dir, jobs, ops_per_sec=None,
+                        bytes_per_sec=None, idle_io=False):
+    import subprocess
+
+    package_root = os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__)))
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (package_root, env.get('PYTHONPATH')) if p)
+    if os.name == 'posix':
+        kwargs = {'preexec_fn': os.setsid}
+    else:
+        kwargs = {'creationflags': 0x00000008}  # DETACHED_PROCESS
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(
+            [sys.executable, '-m', 'setupext_janitor.removal',
+             str(jobs), os.path.abspath(trash_dir), str(ops_per_sec or 0),
+             str(bytes_per_sec or 0), '1' if idle_io else '0'],
+            stdin=devnull, stdout=devnull, stderr=devnull,
+            close_fds=True, env=env, **kwargs)
+
+
+def _forget_created_paths(root):
+    # distutils remembers the directories that it creates so that
+    # mkpath can skip them.  remove_tree prunes this cache and we
+    # need to as well or a later command would not recreate them.
+    dir_util = sys.modules.get('distutils.dir_util')
+    created = getattr(dir_util, '_path_created', {})
+    prefix = os.path.join(os.path.abspath(root), '')
+    for path in list(created):
+        if path == prefix[:-1] or path.startswith(prefix):
+            del created[path]
+
+
+if __name__ == '__main__':
+    empty_trash(sys.argv[2], jobs=int(sys.argv[1]),
+                ops_per_sec=float(sys.argv[3]) if len(sys.argv) > 3 else None,
+                bytes_per_sec=int(sys.argv[4]) if len(sys.argv) > 4 else None,
+                idle_io=len(sys.argv) > 5 and sys.argv[5] == '1')
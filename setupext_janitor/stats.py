@@ -0,0 +1,124 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class Counters(object):
+    """Thread-safe collection of named counters for a single phase."""
+
+    def __init__(self):
+        self.values = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        """Increment each named counter by the specified amount."""
+        with self._lock:
+            self.values.update(counts)
+
+
+class _NullCounters(object):
+
+    def add(self, **counts):
+        pass
+
+
+NULL_COUNTERS = _NullCounters()
+
+
+class StatsHook(object):
+    """
+    Receives statistics as they are recorded.
+
+    Subclass this and pass an instance as the ``stats_hook`` attribute
+    of the clean command to receive statistics without parsing the
+    JSON document that ``--stats`` writes.  The *remove* and *measure*
+    phases run in a background thread while the *discover* phase is
+    running so the hook may be called from more than one thread.  The
+    *measure* phase is reported each time a target is measured with
+    the totals so far.
+
+    """
+
+    def phase_started(self, name):
+        """Called when the phase named `name` starts."""
+
+    def phase_finished(self, name, stats):
+        """Called with a :class:`dict` of statistics when a phase ends."""
+
+
+class Stats(object):
+    """
+    Records the wall time and counters for each phase of a run.
+
+    :param StatsHook hook: optional object that is notified as each
+        phase starts and finishes
+
+    Phases can overlap, so the wall time of the run is the time from
+    the start of the first phase to the end of the last one rather
+    than the sum of the phases.
+
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook if hook is not None else StatsHook()
+        self.phases = collections.OrderedDict()
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time a phase and collect its counters.
+
+        :param str name: the name of the phase
+        :returns: a context manager that yields a :class:`Counters`
+            instance for the phase
+
+        A phase can be entered more than once.  Its counters and wall
+        time are added to what was recorded the previous times.
+
+        """
+        counters = Counters()
+        self.hook.phase_started(name)
+        start = timer()
+        with self._lock:
+            if self._started is None:
+                self._started = start
+        try:
+            yield counters
+        finally:
+            finish = timer()
+            with self._lock:
+                self._finished = max(finish, self._finished or finish)
+                result = collections.Counter(self.phases.get(name, {}))
+                result.update(counters.values)
+                result.update(wall_time=finish - start)
+                result = dict(result)
+                self.phases[name] = result
+            self.hook.phase_finished(name, result)
+
+    def as_dict(self):
+        """Return the recorded statistics as a :class:`dict`."""
+        wall_time = 0
+        if self._started is not None and self._finished is not None:
+            wall_time = self._finished - self._started
+        return {'phases': self.phases, 'wall_time': wall_time}
+
+    def write(self, fp):
+        """Write the recorded statistics to `fp` as JSON."""
+        json.dump(self.as_dict(), fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+
+class NullStats(object):
+    """Stand-in for :class:`Stats` that does not record anything."""
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        yield NULL_COUNTERS
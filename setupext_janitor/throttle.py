@@ -0,0 +1,140 @@
+import os
+import sys
+import threading
+import time
+
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class TokenBucket(object):
+    """
+    Limit the rate of an activity.
+
+    :param float rate: the number of tokens that are added per second
+    :param float burst: the maximum number of tokens that accumulate
+        while the bucket is idle (default: one second's worth)
+
+    :meth:`take` may be called from several threads.  A request that
+    is larger than the bucket is allowed and puts the bucket into debt
+    so large files do not block forever and the long term rate is
+    still respected.
+
+    """
+
+    def __init__(self, rate, burst=None, clock=clock, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self, amount=1):
+        """
+        Take `amount` tokens and wait until they are available.
+
+        :returns: the number of seconds that were spent waiting
+
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            self.sleep(delay)
+        return delay
+
+
+class Throttle(object):
+    """
+    Limit the rate of removal operations.
+
+    :param float ops_per_sec: maximum number of files and directories
+        removed per second
+    :param int bytes_per_sec: maximum number of bytes freed per second
+
+    Removers call :meth:`wait` before each unlink and rmdir.  The total
+    time spent waiting is available in :attr:`waited`.
+
+    """
+
+    def __init__(self, ops_per_sec=None, bytes_per_sec=None):
+        self.ops_per_sec = ops_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.ops = None if not ops_per_sec else TokenBucket(ops_per_sec)
+        self.bytes = None if not bytes_per_sec else TokenBucket(bytes_per_sec)
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, size=0):
+        """Wait until an operation that frees `size` bytes is allowed."""
+        delay = 0
+        if self.ops is not None:
+            delay += self.ops.take()
+        if self.bytes is not None and size:
+            delay += self.bytes.take(size)
+        if delay:
+            with self._lock:
+                self.waited += delay
+
+
+def set_idle_priority():
+    """
+    Lower the I/O priority so that other processes are served first.
+
+    :returns: :data:`True` if the priority was changed
+
+    On Linux, this puts the calling thread and the threads that it
+    starts afterwards in the idle I/O scheduling class.  On macOS the
+    whole process is throttled and on Windows it enters background
+    processing mode.  Other platforms are not supported.
+
+    """
+    try:
+        import ctypes
+        import ctypes.util
+    except ImportError:  # pragma: no cover
+        return False
+    try:
+        if sys.platform.startswith('linux'):
+            return _set_linux_idle_priority(ctypes)
+        if sys.platform == 'darwin':  # pragma: no cover
+            libc = ctypes.CDLL(ctypes.util.find_library('c'))
+            # setiopolicy_np(IOPOL_TYPE_DISK, IOPOL_SCOPE_PROCESS,
+            #                IOPOL_THROTTLE)
+            return libc.setiopolicy_np(0, 0, 3) == 0
+        if os.name == 'nt':  # pragma: no cover
+            kernel32 = ctypes.windll.kernel32
+            return bool(kernel32.SetPriorityClass(
+                kernel32.GetCurrentProcess(),
+                0x00100000))  # PROCESS_MODE_BACKGROUND_BEGIN
+    except (AttributeError, OSError):  # pragma: no cover
+        pass
+    return False  # pragma: no cover
+
+
+# ioprio_set system call numbers by machine
+_IOPRIO_SET = {
+    'aarch64': 30,
+    'armv7l': 314,
+    'i386': 289,
+    'i686': 289,
+    'ppc64le': 273,
+    's390x': 282,
+    'x86_64': 251,
+}
+
+
+def _set_linux_idle_priority(ctypes):
+    number = _IOPRIO_SET.get(os.uname()[4])
+    if number is None:  # pragma: no cover
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    # IOPRIO_WHO_PROCESS with a pid of zero is the calling thread
+    idle = 3 << 13  # IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+    return libc.syscall(number, 1, 0, idle) == 0
@@ -0,0 +1,162 @@
+import collections
+import os
+import stat
+import threading
+
+from setupext_janitor import filesystem, pool, stats
+
+
+Usage = collections.namedtuple('Usage', ['bytes', 'inodes'])
+
+
+def allocated_size(info):
+    """Return the number of bytes allocated to a :func:`os.stat` result."""
+    blocks = getattr(info, 'st_blocks', None)
+    if blocks is None:
+        return info.st_size
+    return blocks * 512
+
+
+def measure(paths, jobs=1, counters=stats.NULL_COUNTERS, fs=filesystem.OS):
+    """
+    Calculate the disk space used by a collection of trees.
+
+    :param paths: the trees to measure
+    :param int jobs: maximum number of threads to measure with
+    :param counters: :class:`~setupext_janitor.stats.Counters` that
+        statistics are added to
+    :param fs: the :mod:`~setupext_janitor.filesystem` backend that
+        the trees are on
+    :returns: :class:`dict` mapping each path to a :class:`Usage`
+
+    The directories in every tree are shared between a pool of `jobs`
+    threads so a single large tree is measured concurrently.  Sizes
+    are based on the blocks that are allocated to each entry and
+    files with multiple hard links are only counted once.  Symbolic
+    links are counted but not followed.
+
+    """
+    totals = dict((path, [0, 0]) for path in paths)
+    lock = threading.Lock()
+    seen = set()
+
+    def add(root, size, inodes):
+        with lock:
+            totals[root][0] += size
+            totals[root][1] += inodes
+
+    def count(info):
+        if info.st_nlink > 1 and not stat.S_ISDIR(info.st_mode):
+            key = (info.st_dev, info.st_ino)
+            with lock:
+                if key in seen:
+                    return 0, 0
+                seen.add(key)
+        return allocated_size(info), 1
+
+    def scan(item, submit):
+        root, dir_path = item
+        size, inodes = 0, 0
+        try:
+            entries = fs.list_directory(dir_path)
+        except OSError:
+            counters.add(errors=1)
+            entries = []
+        for name, is_dir in entries:
+            path = os.path.join(dir_path, name)
+            try:
+                info = fs.lstat(path)
+            except OSError:
+                continue
+            entry_size, entry_inodes = count(info)
+            size += entry_size
+            inodes += entry_inodes
+            if is_dir:
+                submit((root, path))
+        add(root, size, inodes)
+        counters.add(directories_scanned=1, entries_examined=len(entries))
+
+    roots = []
+    for path in totals:
+        try:
+            info = fs.lstat(path)
+        except OSError:
+            continue
+        add(path, *count(info))
+        if stat.S_ISDIR(info.st_mode):
+            roots.append((path, path))
+    pool.run(roots, scan, jobs)
+
+    return dict((path, Usage(*total)) for path, total in totals.items())
+
+
+def format_size(size):
+    """Format a byte count for humans."""
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024.0
+    if unit == 'bytes':
+        return '{0} {1}'.format(int(size), unit)
+    return '{0:.1f} {1}'.format(size, unit)
+
+
+def parse_size(text):
+    """
+    Parse a human readable size.
+
+    :param str text: a number of bytes optionally followed by one of
+        the ``K``, ``M``, ``G``, or ``T`` binary multipliers
+    :rtype: int
+    :raises ValueError: if `text` is not a size
+
+    """
+    value = text.strip().upper()
+    if value.endswith('IB'):
+        value = value[:-2]
+    elif value.endswith('B'):
+        value = value[:-1]
+    multiplier = 1
+    if value and value[-1] in _SIZE_SUFFIXES:
+        multiplier = 1024 ** (_SIZE_SUFFIXES.index(value[-1]) + 1)
+        value = value[:-1]
+    size = int(float(value) * multiplier)
+    if size < 0:
+        raise ValueError('size must not be negative')
+    return size
+
+
+_SIZE_SUFFIXES = 'KMGT'
+
+
+def report(targets, measurements):
+    """
+    Generate a disk usage report.
+
+    :param dict targets: mapping of target path to the type of target
+    :param dict measurements: mapping of target path to :class:`Usage`
+        as returned from :func:`measure`
+    :returns: an iterator of report lines
+
+    Targets are listed largest first followed by the total for each
+    type of target and the overall total.
+
+    """
+    by_kind = collections.defaultdict(lambda: [0, 0])
+    rows = sorted(measurements.items(),
+                  key=lambda item: (-item[1].bytes, item[0]))
+    yield 'disk usage by target:'
+    for path, used in rows:
+        kind = targets.get(path, '')
+        by_kind[kind][0] += used.bytes
+        by_kind[kind][1] += used.inodes
+        yield '  {0:>10} {1:>9} inodes  {2:<12} {3}'.format(
+            format_size(used.bytes), used.inodes, kind, path)
+    yield 'disk usage by type:'
+    for kind, (size, inodes) in sorted(by_kind.items(),
+                                       key=lambda item: -item[1][0]):
+        yield '  {0:>10} {1:>9} inodes  {2}'.format(
+            format_size(size), inodes, kind)
+    yield 'total: {0} in {1} inodes'.format(
+        format_size(sum(u.bytes for u in measurements.values())),
+        sum(u.inodes for u in measurements.values()))
@@ -1,9 +1,16 @@
 from distutils import core, dist, errors, log
 from distutils.command import clean
+from distutils.extension import Extension
 import atexit
+import json
 import os.path
+import py_compile
 import shutil
+import struct
+import subprocess
+import sys
 import tempfile
+import time
 import unittest
 import uuid
 try:
@@ -13,7 +20,11 @@ except ImportError:
 
 import sphinx.setup_command
 
-from setupext_janitor import janitor
+import setupext_janitor
+from setupext_janitor import (
+    api, bytecode, cache, cli, config, discovery, engine, eviction,
+    extensions, filesystem, gitignore, janitor, journal, pool, projects,
+    removal, stats, throttle, usage)
 
 
 def run_setup(*command_line, **setup_kwargs):
@@ -22,6 +33,8 @@ def run_setup(*command_line, **setup_kwargs):
 
     :param command_line: the command line arguments to pass
         as the simulated command line
+    :param setup_kwargs: additional keyword parameters to pass
+        to :func:`distutils.core.setup`
 
     This function runs :func:`distutils.core.setup` after it
     configures an environment that mimics passing the specified
@@ -51,12 +64,31 @@ def run_setup(*command_line, **setup_kwargs):
     cmd_classes = setup_kwargs.pop('cmdclass', {})
     cmd_classes['clean'] = janitor.CleanCommand
     log.sys = mock.Mock()  # stop distutils from spewing output
-    core.setup(
-        distclass=FakeDistribution,
-        script_name='testsetup.py',
-        script_args=command_line,
-        cmdclass=cmd_classes,
-    )
+    with isolated_cache():
+        core.setup(
+            distclass=FakeDistribution,
+            script_name='testsetup.py',
+            script_args=command_line,
+            cmdclass=cmd_classes,
+            **setup_kwargs
+        )
+
+
+_CACHE_HOME = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _CACHE_HOME, True)
+
+
+def isolated_cache():
+    """
+    Keep the clean command out of the per-user cache directory.
+
+    The environment variables that :func:`cache.default_cache_dir`
+    reads are pointed at a temporary directory so that projects cleaned
+    in a child process are isolated as well.
+
+    """
+    return mock.patch.dict(os.environ, {'XDG_CACHE_HOME': _CACHE_HOME,
+                                        'LOCALAPPDATA': _CACHE_HOME})
 
 
 class CommandOptionTests(unittest.TestCase):
@@ -85,6 +117,12 @@ class DirectoryCleanupMixin(unittest.TestCase):
         cls.temp_dir = tempfile.mkdtemp()
         atexit.register(shutil.rmtree, cls.temp_dir)
 
+    def setUp(self):
+        super(DirectoryCleanupMixin, self).setUp()
+        patcher = isolated_cache()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @classmethod
     def create_directory(cls, dir_name):
         return tempfile.mkdtemp(dir=cls.temp_dir, prefix=dir_name)
@@ -298,6 +336,703 @@ class PycacheCleanupTests(DirectoryCleanupMixin, unittest.TestCase):
             self.assert_path_does_not_exist(cache_dir)
 
 
+class PycacheDiscoveryTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(PycacheDiscoveryTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+
+    def find(self, **kwargs):
+        rule = discovery.Rule(
+            'pycache', lambda name: name == '__pycache__', dirs_only=True)
+        return set(target.path for target in discovery.discover(
+            self.test_root, [rule], **kwargs))
+
+    def test_that_pruned_directories_are_not_searched(self):
+        found = self.mkdirs(
+            os.path.join(self.test_root, 'pkg', '__pycache__'))
+        self.mkdirs(
+            os.path.join(self.test_root, '.git', 'x', '__pycache__'),
+            os.path.join(self.test_root, '.tox', 'py', '__pycache__'),
+            os.path.join(self.test_root, 'node_modules', '__pycache__'))
+        self.assertEqual(self.find(), set(found))
+
+    def test_that_prune_patterns_can_be_overridden(self):
+        found = self.mkdirs(
+            os.path.join(self.test_root, '.git', '__pycache__'))
+        self.mkdirs(os.path.join(self.test_root, 'docs', '__pycache__'))
+        self.assertEqual(self.find(prune=['d*']), set(found))
+
+    def test_that_matched_directories_are_not_searched(self):
+        found = self.mkdirs(os.path.join(self.test_root, '__pycache__'))
+        self.mkdirs(os.path.join(found[0], 'x', '__pycache__'))
+        self.assertEqual(self.find(), set(found))
+
+    def test_that_virtual_environments_are_not_searched(self):
+        env_dir = os.path.join(self.test_root, 'env')
+        self.mkdirs(os.path.join(env_dir, 'lib', '__pycache__'))
+        with open(os.path.join(env_dir, 'pyvenv.cfg'), 'w') as f:
+            f.write('home = /usr/bin')
+        self.assertEqual(self.find(), set())
+
+    def test_that_skipped_directories_are_not_searched(self):
+        env_dir = os.path.join(self.test_root, 'legacy-env')
+        self.mkdirs(os.path.join(env_dir, 'lib', '__pycache__'))
+        self.assertEqual(self.find(skip=[env_dir]), set())
+
+    def test_that_prune_option_is_honored(self):
+        cache_dir = self.mkdirs(
+            os.path.join(self.test_root, 'pkg', '__pycache__'))[0]
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+        run_setup('clean', '--pycache', '--prune=pkg')
+        self.assert_path_exists(cache_dir)
+        run_setup('clean', '--pycache')
+        self.assert_path_does_not_exist(cache_dir)
+
+
+class SinglePassDiscoveryTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(SinglePassDiscoveryTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        self.pycache_rule = discovery.Rule(
+            'pycache', lambda name: name == '__pycache__', dirs_only=True)
+
+    def egg_info_rule(self, directory):
+        return discovery.Rule(
+            'eggs', discovery.compile_patterns(['*.egg-info']),
+            directory=directory)
+
+    def discover(self, *rules):
+        listed = []
+        real_list_directory = discovery.list_directory
+
+        def list_directory(dir_path):
+            listed.append(dir_path)
+            return real_list_directory(dir_path)
+
+        with mock.patch.object(discovery, 'list_directory', list_directory):
+            targets = set(discovery.discover(self.test_root, rules))
+        return targets, listed
+
+    def test_that_each_directory_is_listed_once(self):
+        self.mkdirs(os.path.join(self.test_root, 'foo.egg-info'),
+                    os.path.join(self.test_root, 'pkg', '__pycache__'))
+        targets, listed = self.discover(
+            self.pycache_rule, self.egg_info_rule(self.test_root))
+        self.assertEqual(sorted(listed),
+                         [self.test_root, os.path.join(self.test_root, 'pkg')])
+        self.assertEqual(targets, set([
+            discovery.Target(
+                'eggs', os.path.join(self.test_root, 'foo.egg-info')),
+            discovery.Target(
+                'pycache', os.path.join(self.test_root, 'pkg', '__pycache__')),
+        ]))
+
+    def test_that_anchored_rules_only_apply_to_their_directory(self):
+        self.mkdirs(os.path.join(self.test_root, 'pkg', 'nested.egg-info'))
+        targets, _ = self.discover(self.egg_info_rule(self.test_root))
+        self.assertEqual(targets, set())
+
+    def test_that_unreached_directories_are_listed(self):
+        egg_base = self.create_directory('egg-base')
+        self.mkdirs(os.path.join(egg_base, 'foo.egg-info'))
+        targets, listed = self.discover(
+            self.pycache_rule, self.egg_info_rule(egg_base))
+        self.assertEqual(listed, [self.test_root, egg_base])
+        self.assertEqual(targets, set([discovery.Target(
+            'eggs', os.path.join(egg_base, 'foo.egg-info'))]))
+
+    def test_that_tree_is_not_searched_without_recursive_rules(self):
+        self.mkdirs(os.path.join(self.test_root, 'pkg', '__pycache__'))
+        _, listed = self.discover(self.egg_info_rule(self.test_root))
+        self.assertEqual(listed, [self.test_root])
+
+
+class OneFileSystemTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(OneFileSystemTests, self).setUp()
+        self.fs = filesystem.MemoryFilesystem()
+        self.root = os.path.join(os.sep, 'project')
+        self.fs.add_file(os.path.join(self.root, 'pkg', '__pycache__',
+                                      'mod.cpython-38.pyc'))
+        self.fs.add_directory(os.path.join(self.root, 'data'), device=2)
+        self.fs.add_directory(
+            os.path.join(self.root, 'data', 'set', '__pycache__'))
+        self.rules = [discovery.Rule(
+            'pycache', lambda name: name == '__pycache__', dirs_only=True)]
+
+    def discover(self, counters=stats.NULL_COUNTERS, **kwargs):
+        return sorted(target.path for target in discovery.discover(
+            self.root, self.rules, fs=self.fs, counters=counters, **kwargs))
+
+    def test_that_other_devices_are_not_searched(self):
+        counters = stats.Counters()
+        self.assertEqual(
+            self.discover(counters),
+            [os.path.join(self.root, 'pkg', '__pycache__')])
+        self.assertEqual(counters.values['mount_points_skipped'], 1)
+
+    def test_that_other_devices_can_be_searched(self):
+        self.assertEqual(
+            self.discover(one_file_system=False),
+            [os.path.join(self.root, 'data', 'set', '__pycache__'),
+             os.path.join(self.root, 'pkg', '__pycache__')])
+
+    def test_that_mount_points_are_still_matched(self):
+        self.rules.append(discovery.Rule(
+            'pattern', discovery.compile_patterns(['data'])))
+        self.assertIn(os.path.join(self.root, 'data'), self.discover())
+
+    def test_that_bound_directories_are_searched_once(self):
+        self.fs.bind(os.path.join(self.root, 'pkg'),
+                     os.path.join(self.root, 'alias'))
+        counters = stats.Counters()
+        self.assertEqual(len(self.discover(counters)), 1)
+        self.assertEqual(counters.values['duplicate_directories_skipped'], 1)
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'symlinks are required')
+    def test_that_directory_symlinks_are_not_followed(self):
+        root, outside = self.mkdirs(
+            os.path.join(self.create_directory('root'), 'project'),
+            os.path.join(self.create_directory('outside'), 'pkg',
+                         '__pycache__'))
+        os.symlink(os.path.dirname(outside), os.path.join(root, 'link'))
+        self.assertEqual(list(discovery.discover(root, self.rules)), [])
+
+    def test_that_cross_file_systems_option_is_honored(self):
+        with mock.patch.object(discovery, 'discover',
+                               return_value=iter([])) as discover:
+            run_setup('clean', '--pycache', py_modules=[])
+            self.assertTrue(discover.call_args[1]['one_file_system'])
+            run_setup('clean', '--pycache', '--cross-file-systems',
+                      py_modules=[])
+            self.assertFalse(discover.call_args[1]['one_file_system'])
+        self.assertFalse(config.clean_options(
+            {'clean': {'one_file_system': 'no'}})['one_file_system'])
+
+
+class StaleBytecodeTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(StaleBytecodeTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        self.pkg = self.mkdirs(os.path.join(self.test_root, 'pkg'))[0]
+        self.cache_dir = os.path.join(self.pkg, '__pycache__')
+
+    def write_module(self, name, content='x = 1\n'):
+        path = os.path.join(self.pkg, name + '.py')
+        with open(path, 'w') as f:
+            f.write(content)
+        return py_compile.compile(path, doraise=True)
+
+    def find(self):
+        return set(discovery.discover(
+            self.test_root, [], prune=['__pycache__'],
+            inspectors=[bytecode.find_stale]))
+
+    def test_that_fresh_bytecode_is_kept(self):
+        self.write_module('fresh')
+        self.assertEqual(self.find(), set())
+
+    def test_that_orphaned_bytecode_is_removed(self):
+        self.write_module('fresh')
+        orphan = self.write_module('orphan')
+        os.remove(os.path.join(self.pkg, 'orphan.py'))
+        self.assertEqual(self.find(),
+                         set([discovery.Target('bytecode', orphan)]))
+
+    def test_that_modified_sources_make_bytecode_stale(self):
+        self.write_module('fresh')
+        modified = self.write_module('modified')
+        with open(os.path.join(self.pkg, 'modified.py'), 'a') as f:
+            f.write('y = 2\n')
+        self.assertEqual(self.find(),
+                         set([discovery.Target('bytecode', modified)]))
+
+    def test_that_entirely_stale_cache_directory_is_removed(self):
+        self.write_module('orphan')
+        os.remove(os.path.join(self.pkg, 'orphan.py'))
+        self.assertEqual(self.find(),
+                         set([discovery.Target('bytecode', self.cache_dir)]))
+
+    def test_that_orphaned_legacy_bytecode_is_removed(self):
+        self.write_module('fresh')
+        legacy = os.path.join(self.pkg, 'gone.pyc')
+        cached = os.listdir(self.cache_dir)[0]
+        shutil.copy(os.path.join(self.cache_dir, cached), legacy)
+        self.assertEqual(self.find(),
+                         set([discovery.Target('bytecode', legacy)]))
+
+    @unittest.skipUnless(hasattr(py_compile, 'PycInvalidationMode'),
+                         'requires hash-based bytecode')
+    def test_that_hash_based_bytecode_is_checked(self):
+        path = os.path.join(self.pkg, 'hashed.py')
+        with open(path, 'w') as f:
+            f.write('x = 1\n')
+        py_compile.compile(
+            path, doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+        self.assertEqual(self.find(), set())
+        with open(path, 'w') as f:
+            f.write('x = 2\n')
+        self.assertEqual(len(self.find()), 1)
+
+    def test_that_stale_bytecode_option_is_honored(self):
+        self.write_module('fresh')
+        orphan = self.write_module('orphan')
+        os.remove(os.path.join(self.pkg, 'orphan.py'))
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+        run_setup('clean', '--stale-bytecode')
+        self.assert_path_does_not_exist(orphan)
+        self.assert_path_exists(self.cache_dir)
+
+
+class PatternTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(PatternTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+        self.mkdirs(os.path.join(self.test_root, '.pytest_cache', 'v'),
+                    os.path.join(self.test_root, 'src', 'pkg', '__pycache__'),
+                    os.path.join(self.test_root, 'htmlcov'))
+        for name in ('.coverage.host.1', 'keep.py',
+                     os.path.join('src', 'pkg', 'ext.cpython-38.so'),
+                     os.path.join('src', 'pkg', 'api_pb2.py'),
+                     os.path.join('src', 'pkg', 'api.py')):
+            open(os.path.join(self.test_root, name), 'w').close()
+
+    def test_that_matching_files_and_directories_are_removed(self):
+        run_setup('clean', '--patterns=.pytest_cache,htmlcov,*.so,'
+                           '.coverage.*,*_pb2.py')
+        for name in ('.pytest_cache', 'htmlcov', '.coverage.host.1',
+                     os.path.join('src', 'pkg', 'ext.cpython-38.so'),
+                     os.path.join('src', 'pkg', 'api_pb2.py')):
+            self.assert_path_does_not_exist(self.test_root, name)
+        for name in ('keep.py', os.path.join('src', 'pkg', 'api.py'),
+                     os.path.join('src', 'pkg', '__pycache__')):
+            self.assert_path_exists(self.test_root, name)
+
+    def test_that_patterns_share_the_pycache_walk(self):
+        listed = []
+        real_list_directory = discovery.list_directory
+
+        def list_directory(dir_path):
+            listed.append(dir_path)
+            return real_list_directory(dir_path)
+
+        with mock.patch.object(discovery, 'list_directory', list_directory):
+            run_setup('clean', '--pycache', '--patterns=*.so,htmlcov')
+        self.assertEqual(len(listed), len(set(listed)))
+        self.assert_path_does_not_exist(
+            self.test_root, 'src', 'pkg', '__pycache__')
+        self.assert_path_does_not_exist(
+            self.test_root, 'src', 'pkg', 'ext.cpython-38.so')
+        self.assert_path_does_not_exist(self.test_root, 'htmlcov')
+
+    def test_that_patterns_are_read_from_configuration(self):
+        distribution = dist.Distribution({
+            'script_name': 'setup.py',
+            'cmdclass': {'clean': janitor.CleanCommand}})
+        distribution.get_option_dict('clean')['patterns'] = (
+            'setup.cfg', '\nhtmlcov\n*.so')
+        command = distribution.get_command_obj('clean')
+        command.ensure_finalized()
+        self.assertEqual(command.patterns, ['htmlcov', '*.so'])
+
+
+class GitignoreTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(GitignoreTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+
+    def write(self, path, content=''):
+        parent = os.path.dirname(path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_pattern_matching(self):
+        ignore_file = gitignore.IgnoreFile([
+            '# comment', '', '*.log', '!keep.log', 'build/', '/top',
+            'docs/_build', '**/gen', 'a/**/z', 'cache/**', r'\#hash',
+            'space\\ ', '[!a]x'])
+        cases = [
+            ('debug.log', False, True), ('src/debug.log', False, True),
+            ('src/keep.log', False, False), ('build', True, True),
+            ('build', False, None), ('src/build', True, True),
+            ('top', True, True), ('src/top', True, None),
+            ('docs/_build', True, True), ('src/docs/_build', True, None),
+            ('gen', True, True), ('x/y/gen', False, True),
+            ('a/z', True, True), ('a/b/c/z', True, True),
+            ('cache', True, None), ('cache/x', False, True),
+            ('#hash', False, True), ('space ', False, True),
+            ('bx', False, True), ('ax', False, None),
+            ('comment', False, None),
+        ]
+        for path, is_dir, expected in cases:
+            self.assertEqual(ignore_file.match(path, is_dir), expected,
+                             path)
+
+    def test_that_ignored_paths_are_removed(self):
+        self.write('.gitignore', '*.log\n!keep.log\n/build/\n.env/\n')
+        self.write(os.path.join('src', 'pkg', '.gitignore'), 'generated/\n')
+        self.write(os.path.join('src', 'pkg', 'generated', 'data.py'))
+        self.write(os.path.join('src', 'pkg', 'module.py'))
+        self.write(os.path.join('src', 'debug.log'))
+        self.write(os.path.join('src', 'keep.log'))
+        self.write(os.path.join('build', 'lib', 'module.py'))
+        self.write(os.path.join('.env', 'pyvenv.cfg'))
+        listed = []
+        real_list_directory = discovery.list_directory
+
+        def list_directory(dir_path):
+            listed.append(os.path.normpath(dir_path))
+            return real_list_directory(dir_path)
+
+        with mock.patch.object(discovery, 'list_directory', list_directory):
+            run_setup('clean', '--gitignored')
+        for path in ('build', os.path.join('src', 'debug.log'),
+                     os.path.join('src', 'pkg', 'generated')):
+            self.assert_path_does_not_exist(path)
+        for path in ('.gitignore', os.path.join('src', 'keep.log'),
+                     os.path.join('src', 'pkg', 'module.py'),
+                     os.path.join('.env', 'pyvenv.cfg')):
+            self.assert_path_exists(path)
+        self.assertNotIn('build', listed)
+        self.assertNotIn(os.path.join('src', 'pkg', 'generated'), listed)
+
+    def test_that_nested_files_take_precedence(self):
+        self.write('.gitignore', '*.txt\n')
+        self.write(os.path.join('src', '.gitignore'), '!notes.txt\n')
+        self.write(os.path.join('src', 'notes.txt'))
+        self.write(os.path.join('src', 'other.txt'))
+        run_setup('clean', '--gitignored')
+        self.assert_path_exists('src', 'notes.txt')
+        self.assert_path_does_not_exist('src', 'other.txt')
+
+    def test_that_work_tree_files_above_the_root_apply(self):
+        self.write(os.path.join('.git', 'info', 'exclude'), '*.tmp\n')
+        self.write('.gitignore', 'project/src/*.out\n')
+        project = os.path.join(self.test_root, 'project')
+        self.write(os.path.join(project, 'src', 'a.tmp'))
+        self.write(os.path.join(project, 'src', 'b.out'))
+        self.write(os.path.join(project, 'src', 'c.py'))
+        targets = set(t.path for t in discovery.discover(
+            project, [], inspectors=[gitignore.Inspector(project)]))
+        self.assertEqual(targets, set([
+            os.path.join(project, 'src', 'a.tmp'),
+            os.path.join(project, 'src', 'b.out')]))
+
+    def write_index(self, paths):
+        entries = []
+        for path in sorted(paths):
+            name = path.encode('utf-8')
+            entry = struct.pack('>10I20sH', *([0] * 10 + [b'', len(name)]))
+            entry += name
+            entries.append(entry + b'\0' * (8 - len(entry) % 8))
+        self.write(os.path.join('.git', 'index'))
+        with open(os.path.join('.git', 'index'), 'wb') as f:
+            f.write(b'DIRC' + struct.pack('>II', 2, len(entries)))
+            f.write(b''.join(entries) + b'\0' * 20)
+
+    def test_that_index_is_read(self):
+        self.write_index(['a.txt', 'src/pkg/module.py'])
+        self.assertEqual(
+            gitignore.read_index(os.path.join('.git', 'index')),
+            ['a.txt', 'src/pkg/module.py'])
+        self.assertEqual(gitignore.read_index('missing'), [])
+
+    def test_that_tracked_files_are_not_selected(self):
+        self.write('.gitignore', '*.local\nbuild/\n')
+        self.write('settings.local')
+        self.write('other.local')
+        self.write(os.path.join('build', 'keep.txt'))
+        self.write(os.path.join('build', 'lib', 'module.py'))
+        self.write_index(['.gitignore', 'settings.local', 'build/keep.txt'])
+        inspector = gitignore.Inspector(os.curdir)
+        targets = set(os.path.normpath(t.path) for t in discovery.discover(
+            os.curdir, [], inspectors=[inspector]))
+        self.assertEqual(targets, set([
+            'other.local', os.path.join('build', 'lib')]))
+
+    def test_that_kept_paths_are_not_selected(self):
+        self.write('.gitignore', 'trash/\n')
+        self.mkdirs('trash')
+        inspector = gitignore.Inspector(os.curdir, keep=['trash'])
+        self.assertEqual(list(discovery.discover(
+            os.curdir, [], inspectors=[inspector])), [])
+
+
+@unittest.skipUnless(hasattr(sys, 'implementation'),
+                     'interpreter does not use __pycache__')
+class PycacheEvictionTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(PycacheEvictionTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+        self.tag = sys.implementation.cache_tag
+        self.cache_dir = self.mkdirs(
+            os.path.join('src', 'pkg', '__pycache__'))[0]
+        now = time.time()
+        self.files = {}
+        for name, tag, age in (('old', self.tag, 30), ('new', self.tag, 0),
+                               ('dead', 'cpython-20', 0)):
+            path = os.path.join(self.cache_dir,
+                                '{0}.{1}.pyc'.format(name, tag))
+            with open(path, 'wb') as f:
+                f.write(b'x' * 8192)
+            timestamp = now - age * 86400
+            os.utime(path, (timestamp, timestamp))
+            self.files[name] = path
+
+    def test_that_select_orders_by_priority(self):
+        entries = [eviction.Entry('a', 10, 100, False),
+                   eviction.Entry('b', 10, 50, False),
+                   eviction.Entry('c', 10, 200, False),
+                   eviction.Entry('d', 10, 300, True)]
+        self.assertEqual(
+            [e.path for e in eviction.select(entries, budget=15, now=300)],
+            ['d', 'b', 'a'])
+        self.assertEqual(
+            [e.path for e in eviction.select(entries, max_age=150, now=300)],
+            ['d', 'b', 'a'])
+        self.assertEqual(eviction.select(entries[:3]), [])
+
+    def test_that_cache_tags_are_parsed(self):
+        self.assertEqual(eviction.cache_tag('mod.cpython-38.opt-1.pyc'),
+                         'cpython-38')
+        self.assertEqual(eviction.cache_tag('mod.pyc'), None)
+
+    def test_that_installed_interpreters_are_found(self):
+        bin_dir = self.create_directory('bin')
+        for name in ('python3.6', 'pypy3.9', 'python3', 'python3.6-config'):
+            open(os.path.join(bin_dir, name), 'w').close()
+        tags = eviction.installed_cache_tags(bin_dir)
+        self.assertEqual(tags, set(['cpython-36', 'pypy39', self.tag]))
+
+    def test_that_dead_interpreters_are_evicted(self):
+        run_setup('clean', '--pycache-max-age=365')
+        self.assert_path_does_not_exist(self.files['dead'])
+        self.assert_path_exists(self.files['old'])
+        self.assert_path_exists(self.files['new'])
+
+    def test_that_old_bytecode_is_evicted(self):
+        run_setup('clean', '--pycache-max-age=7')
+        self.assert_path_does_not_exist(self.files['old'])
+        self.assert_path_exists(self.files['new'])
+
+    def test_that_least_recently_used_bytecode_is_evicted(self):
+        budget = os.lstat(self.files['new']).st_blocks * 512
+        run_setup('clean', '--pycache-budget={0}'.format(budget))
+        self.assert_path_does_not_exist(self.files['old'])
+        self.assert_path_does_not_exist(self.files['dead'])
+        self.assert_path_exists(self.files['new'])
+
+    def test_that_empty_caches_are_removed(self):
+        run_setup('clean', '--pycache-budget=0')
+        self.assert_path_does_not_exist(self.cache_dir)
+
+    def test_that_invalid_options_are_rejected(self):
+        for option in ('--pycache-budget=lots', '--pycache-max-age=-1'):
+            with self.assertRaises(SystemExit):
+                run_setup('clean', option)
+
+
+class ToolCacheEvictionTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(ToolCacheEvictionTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+        now = time.time()
+        self.paths = {}
+        for name, age in (('.tox/py38', 3), ('.nox/tests', 2),
+                          ('.tox/py39', 1), ('src/.mypy_cache', 0)):
+            path = os.path.join(os.curdir, *name.split('/'))
+            os.makedirs(os.path.join(path, 'lib'))
+            with open(os.path.join(path, 'data'), 'wb') as f:
+                f.write(b'x' * 65536)
+            timestamp = now - age * 86400
+            for entry in (os.path.join(path, 'lib'),
+                          os.path.join(path, 'data'), path):
+                os.utime(entry, (timestamp, timestamp))
+            self.paths[name] = path
+        self.size = usage.measure(
+            [self.paths['.tox/py38']])[self.paths['.tox/py38']].bytes
+
+    def test_that_least_recently_used_entries_are_evicted(self):
+        run_setup('clean', '--max-cache-size={0}'.format(self.size * 2))
+        self.assert_path_does_not_exist(self.paths['.tox/py38'])
+        self.assert_path_does_not_exist(self.paths['.nox/tests'])
+        self.assert_path_exists(self.paths['.tox/py39'])
+        self.assert_path_exists(self.paths['src/.mypy_cache'])
+        self.assert_path_exists('.tox')
+
+    def test_that_reads_count_as_use(self):
+        data_file = os.path.join(self.paths['.tox/py38'], 'data')
+        os.utime(data_file, (time.time(), os.stat(data_file).st_mtime))
+        run_setup('clean', '--max-cache-size={0}'.format(self.size * 3))
+        self.assert_path_exists(self.paths['.tox/py38'])
+        self.assert_path_does_not_exist(self.paths['.nox/tests'])
+
+    def test_that_the_active_environment_is_kept(self):
+        env = {'VIRTUAL_ENV': os.path.abspath(self.paths['.tox/py38'])}
+        with mock.patch.dict(os.environ, env):
+            run_setup('clean', '--max-cache-size=0')
+        self.assert_path_exists(self.paths['.tox/py38'])
+        for name in ('.nox/tests', '.tox/py39', 'src/.mypy_cache'):
+            self.assert_path_does_not_exist(self.paths[name])
+
+    def test_that_entries_within_budget_are_kept(self):
+        evictor = eviction.ToolCacheEvictor(self.size * 10, jobs=2)
+        for target in discovery.discover(os.curdir, [],
+                                         inspectors=[evictor]):
+            pass
+        self.assertEqual(list(evictor.targets()), [])
+
+    def test_that_invalid_sizes_are_rejected(self):
+        with self.assertRaises(SystemExit):
+            run_setup('clean', '--max-cache-size=lots')
+
+
+class StaleObjectTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(StaleObjectTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+        self.mkdirs('src', 'include')
+        self.write_file(os.path.join('include', 'ext.h'), '#define X 1\n')
+        self.write_file(os.path.join('src', 'ext.c'),
+                        '#include <Python.h>\n#include "ext.h"\n')
+        self.extension = Extension('pkg.ext', [os.path.join('src', 'ext.c')],
+                                   include_dirs=['include'])
+        distribution = dist.Distribution({'ext_modules': [self.extension]})
+        products, self.build_temps = janitor._gather_products(distribution)
+        self.product = products[0].path
+        self.object = products[0].objects[0].path
+        self.mkdirs(os.path.dirname(self.product),
+                    os.path.dirname(self.object))
+        for path in (self.object, self.product):
+            self.write_file(path, 'binary', age=-10)
+
+    @staticmethod
+    def write_file(path, content, age=0):
+        with open(path, 'w') as f:
+            f.write(content)
+        timestamp = time.time() - age
+        os.utime(path, (timestamp, timestamp))
+
+    def run_clean(self, *args):
+        run_setup('clean', '--stale-objects', *args,
+                  ext_modules=[self.extension])
+
+    def test_that_fresh_objects_are_kept(self):
+        orphan = os.path.join(os.path.dirname(self.object), 'gone.o')
+        self.write_file(orphan, 'binary')
+        self.run_clean()
+        self.assert_path_exists(self.object)
+        self.assert_path_exists(self.product)
+        self.assert_path_does_not_exist(orphan)
+        self.assert_path_exists(self.build_temps[0], extensions.INDEX_NAME)
+
+    def test_that_header_changes_are_detected_by_content(self):
+        self.run_clean()
+        self.write_file(os.path.join('include', 'ext.h'), '#define X 2\n',
+                        age=100)
+        self.run_clean()
+        self.assert_path_does_not_exist(self.object)
+        self.assert_path_does_not_exist(self.product)
+
+    def test_that_touched_sources_are_not_stale(self):
+        self.run_clean()
+        source = os.path.join('src', 'ext.c')
+        os.utime(source, (time.time() + 60, time.time() + 60))
+        self.run_clean()
+        self.assert_path_exists(self.object)
+        self.assert_path_exists(self.product)
+
+    def test_that_newer_sources_are_stale_without_an_index(self):
+        self.write_file(os.path.join('src', 'ext.c'), '', age=-60)
+        self.run_clean('--dry-run')
+        self.assert_path_exists(self.object)
+        self.assert_path_does_not_exist(self.build_temps[0],
+                                        extensions.INDEX_NAME)
+        self.run_clean()
+        self.assert_path_does_not_exist(self.object)
+        self.assert_path_does_not_exist(self.product)
+
+    def test_that_includes_are_collected(self):
+        obj = extensions.Object('x.o', os.path.join('src', 'ext.c'), [],
+                                ['include'], '')
+        self.assertEqual(extensions.Inputs().collect(obj),
+                         [os.path.join('include', 'ext.h'),
+                          os.path.join('src', 'ext.c')])
+
+    def test_that_build_cannot_be_combined(self):
+        with self.assertRaises(SystemExit):
+            self.run_clean('--build')
+
+
+class CollapseTargetsTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def test_that_nested_targets_are_collapsed(self):
+        targets = discovery.collapse({
+            'build': 'build',
+            os.path.join('build', 'lib'): 'build',
+            os.path.join('.', 'build', 'lib', '__pycache__'): 'pycache',
+            os.path.join('.', 'pkg', '__pycache__'): 'pycache',
+            'dist': 'dist',
+        })
+        self.assertEqual(targets, {
+            'build': 'build',
+            os.path.join('.', 'pkg', '__pycache__'): 'pycache',
+            'dist': 'dist',
+        })
+
+    def test_that_equivalent_paths_are_collapsed(self):
+        targets = discovery.collapse({
+            'build': 'build', os.path.join('.', 'build'): 'build',
+            os.path.abspath('build'): 'build'})
+        self.assertEqual(len(targets), 1)
+
+    def test_that_siblings_with_common_prefixes_are_kept(self):
+        targets = {'build': 'build', 'build-docs': 'build'}
+        self.assertEqual(discovery.collapse(targets), targets)
+
+    def test_that_targets_are_not_searched_for_pycache(self):
+        test_root = self.create_directory('test-root')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(test_root)
+        self.mkdirs(os.path.join('dist', 'foo', '__pycache__'))
+        with mock.patch.object(removal.TreeRemover, 'remove') as remove:
+            run_setup('sdist', '--dist-dir=dist',
+                      'clean', '--dist', '--pycache')
+        remove.assert_called_once_with('dist')
+
+
 class BuildCleanupTests(DirectoryCleanupMixin, unittest.TestCase):
 
     def setUp(self):
@@ -374,6 +1109,1078 @@ class RemoveAllTests(DirectoryCleanupMixin, unittest.TestCase):
         self.assert_path_does_not_exist(self.env_dir)
 
 
+class WorkPoolTests(unittest.TestCase):
+
+    def test_that_single_items_are_processed_inline(self):
+        processed = []
+        with mock.patch.object(pool.threading, 'Thread') as thread:
+            pool.run([1], lambda item, submit: processed.append(item),
+                     jobs=8)
+        self.assertFalse(thread.called)
+        self.assertEqual(processed, [1])
+
+    def test_that_threads_are_started_for_queued_work(self):
+        processed = []
+
+        def handler(item, submit):
+            if item < 16:
+                submit(item * 2)
+                submit(item * 2 + 1)
+            processed.append(item)
+
+        with mock.patch.object(pool.threading, 'Thread',
+                               wraps=pool.threading.Thread) as thread:
+            pool.run([1], handler, jobs=4)
+        self.assertTrue(thread.called)
+        self.assertLessEqual(thread.call_count, 3)
+        self.assertEqual(sorted(processed), list(range(1, 32)))
+
+    def test_that_handler_failures_are_reraised(self):
+        def handler(item, submit):
+            raise RuntimeError(item)
+
+        with self.assertRaises(RuntimeError):
+            pool.run([1, 2, 3], handler, jobs=4)
+
+
+class TreeRemoverTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TreeRemoverTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        self.tree = os.path.join(self.test_root, 'tree')
+        for dir_name in self.mkdirs(
+                os.path.join(self.tree, 'a', 'b', 'c'),
+                os.path.join(self.tree, 'd')):
+            for n in range(3):
+                with open(os.path.join(dir_name, str(n)), 'w') as f:
+                    f.write('content')
+
+    def test_that_tree_is_removed_by_multiple_threads(self):
+        removal.TreeRemover(jobs=4).remove(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+
+    def test_that_tree_is_removed_by_a_single_thread(self):
+        removal.TreeRemover(jobs=1).remove(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+
+    def test_that_tree_is_not_removed_in_dry_run_mode(self):
+        removal.TreeRemover(jobs=4, dry_run=True).remove(self.tree)
+        self.assert_path_exists(self.tree, 'a', 'b', 'c', '0')
+
+    def test_that_symlinked_directories_are_not_followed(self):
+        outside = self.create_directory('outside')
+        with open(os.path.join(outside, 'keep'), 'w') as f:
+            f.write('content')
+        os.symlink(outside, os.path.join(self.tree, 'a', 'link'))
+        removal.TreeRemover(jobs=4).remove(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+        self.assert_path_exists(outside, 'keep')
+
+    def test_that_errors_are_logged(self):
+        with mock.patch.object(removal.log, 'warn') as warn:
+            removal.TreeRemover(jobs=4).remove(
+                os.path.join(self.test_root, 'missing'))
+        self.assertEqual(warn.call_count, 1)
+
+
+class LatencyHidingRemoverTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(LatencyHidingRemoverTests, self).setUp()
+        self.tree = self.create_directory('tree')
+        for dir_name in self.mkdirs(os.path.join(self.tree, 'a', 'b'),
+                                    os.path.join(self.tree, 'c')):
+            for n in range(10):
+                with open(os.path.join(dir_name, str(n)), 'w') as f:
+                    f.write('content')
+
+    def test_that_tree_is_removed(self):
+        counters = stats.Counters()
+        removal.LatencyHidingRemover(jobs=4, counters=counters).purge(
+            self.tree)
+        self.assert_path_does_not_exist(self.tree)
+        self.assertEqual(counters.values['files_removed'], 20)
+        self.assertEqual(counters.values['directories_removed'], 4)
+
+    def test_that_tree_is_removed_by_a_single_thread(self):
+        removal.LatencyHidingRemover(jobs=1).purge(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+
+    def test_that_operations_overlap(self):
+        remover = removal.LatencyHidingRemover(
+            jobs=16, fs=filesystem.LatencyFilesystem(0.02))
+        start = time.time()
+        remover.purge(self.tree)
+        elapsed = time.time() - start
+        self.assert_path_does_not_exist(self.tree)
+        # 20 files, 4 directories, and an lstat for each entry would
+        # take at least 1.1 seconds serially
+        self.assertLess(elapsed, 0.6)
+
+    def test_that_remover_option_is_honored(self):
+        with mock.patch.object(removal.LatencyHidingRemover,
+                               'remove') as remove:
+            run_setup('clean', '--environment', '--remover=latency',
+                      '--virtualenv-dir={0}'.format(self.tree))
+        remove.assert_called_once_with(self.tree)
+
+    def test_that_unknown_removers_are_rejected(self):
+        with self.assertRaises(SystemExit):
+            run_setup('clean', '--remover=unknown')
+
+
+@unittest.skipUnless(removal.DescriptorRemover.supported,
+                     'descriptor relative removal is not supported')
+class DescriptorRemoverTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(DescriptorRemoverTests, self).setUp()
+        self.tree = self.create_directory('tree')
+        for dir_name in self.mkdirs(os.path.join(self.tree, 'a', 'b', 'c'),
+                                    os.path.join(self.tree, 'd')):
+            for n in range(5):
+                with open(os.path.join(dir_name, str(n)), 'w') as f:
+                    f.write('content')
+
+    def test_that_tree_is_removed(self):
+        counters = stats.Counters()
+        removal.DescriptorRemover(jobs=4, counters=counters).purge(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+        self.assertEqual(counters.values['files_removed'], 10)
+        self.assertEqual(counters.values['directories_removed'], 5)
+        self.assertGreater(counters.values['bytes_freed'], 0)
+
+    def test_that_tree_is_removed_by_a_single_thread(self):
+        removal.DescriptorRemover(jobs=1).purge(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+
+    def test_that_paths_below_the_root_are_not_resolved(self):
+        with mock.patch.object(os, 'lstat', wraps=os.lstat) as lstat:
+            removal.DescriptorRemover(jobs=1).purge(self.tree)
+        lstat.assert_called_once_with(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+
+    def test_that_symlinked_directories_are_not_followed(self):
+        outside = self.create_directory('outside')
+        with open(os.path.join(outside, 'keep'), 'w') as f:
+            f.write('content')
+        os.symlink(outside, os.path.join(self.tree, 'a', 'link'))
+        removal.DescriptorRemover(jobs=4).purge(self.tree)
+        self.assert_path_does_not_exist(self.tree)
+        self.assert_path_exists(outside, 'keep')
+
+    def test_that_swapped_directories_are_not_followed(self):
+        outside = self.create_directory('outside')
+        with open(os.path.join(outside, 'keep'), 'w') as f:
+            f.write('content')
+        swapped = os.path.join(self.tree, 'd')
+        real_scandir = os.scandir
+
+        class Listing(list):
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+        def scandir(fd):
+            # swap the directory after it is listed but before it is opened
+            entries = Listing(real_scandir(fd))
+            if not os.path.islink(swapped):
+                os.rename(swapped, os.path.join(outside, 'moved'))
+                os.symlink(outside, swapped)
+            return entries
+
+        with mock.patch.object(removal.os, 'scandir', scandir):
+            with mock.patch.object(removal.log, 'warn'):
+                removal.DescriptorRemover(jobs=1).purge(self.tree)
+        self.assert_path_exists(outside, 'keep')
+
+    def test_that_it_is_the_default_remover(self):
+        self.assertEqual(removal.DEFAULT_REMOVER, 'fd')
+        with mock.patch.object(removal.DescriptorRemover,
+                               'remove') as remove:
+            run_setup('clean', '--environment',
+                      '--virtualenv-dir={0}'.format(self.tree))
+        remove.assert_called_once_with(self.tree)
+
+    def test_that_other_file_systems_fall_back_to_paths(self):
+        fs = filesystem.LatencyFilesystem(0)
+        with mock.patch.object(fs, 'remove', wraps=fs.remove) as remove:
+            removal.DescriptorRemover(jobs=1, fs=fs).purge(self.tree)
+        self.assertEqual(remove.call_count, 10)
+        self.assert_path_does_not_exist(self.tree)
+
+
+class TrashTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TrashTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        self.trash_dir = os.path.join(self.test_root, '.janitor-trash')
+        self.target = self.mkdirs(
+            os.path.join(self.test_root, 'target', 'nested'))[0]
+        patcher = mock.patch.object(removal, '_spawn_trash_worker')
+        self.spawn_worker = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def trash(self, dry_run=False):
+        return removal.Trash(
+            self.trash_dir, removal.TreeRemover(jobs=2, dry_run=dry_run))
+
+    def test_that_targets_are_moved_into_the_trash(self):
+        trash = self.trash()
+        trash.remove(os.path.join(self.test_root, 'target'))
+        trash.close()
+        self.assert_path_does_not_exist(self.test_root, 'target')
+        run_dirs = os.listdir(self.trash_dir)
+        self.assertEqual(len(run_dirs), 1)
+        self.assert_path_exists(
+            self.trash_dir, run_dirs[0], '1-target', 'nested')
+        self.spawn_worker.assert_called_once_with(
+            self.trash_dir, 2, None, None, False)
+
+    def test_that_trash_is_emptied(self):
+        trash = self.trash()
+        trash.remove(os.path.join(self.test_root, 'target'))
+        removal.empty_trash(self.trash_dir)
+        self.assert_path_does_not_exist(self.trash_dir)
+
+    def test_that_leftover_trash_is_emptied(self):
+        self.mkdirs(os.path.join(self.trash_dir, 'run-leftover'))
+        self.trash().close()
+        self.spawn_worker.assert_called_once_with(
+            self.trash_dir, 2, None, None, False)
+
+    def test_that_other_devices_are_removed_in_place(self):
+        trash = self.trash()
+        with mock.patch.object(removal.os, 'rename',
+                               side_effect=OSError('cross-device link')):
+            trash.remove(os.path.join(self.test_root, 'target'))
+        self.assert_path_does_not_exist(self.test_root, 'target')
+
+    def test_that_nothing_is_moved_in_dry_run_mode(self):
+        trash = self.trash(dry_run=True)
+        trash.remove(os.path.join(self.test_root, 'target'))
+        trash.close()
+        self.assert_path_exists(self.target)
+        self.assert_path_does_not_exist(self.trash_dir)
+        self.assertFalse(self.spawn_worker.called)
+
+    def test_that_trash_option_is_honored(self):
+        dist_dir = self.create_directory('dist-dir')
+        run_setup(
+            'sdist', '--dist-dir={0}'.format(dist_dir),
+            'clean', '--dist', '--trash',
+            '--trash-dir={0}'.format(self.trash_dir),
+        )
+        self.assert_path_does_not_exist(dist_dir)
+        self.assertEqual(len(os.listdir(self.trash_dir)), 1)
+
+
+class TrashWorkerTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def test_that_worker_empties_the_trash(self):
+        trash_dir = os.path.join(self.create_directory('test-root'), 'trash')
+        self.mkdirs(os.path.join(trash_dir, 'run-1', 'a', 'b'))
+        removal.Trash(trash_dir, removal.TreeRemover()).close()
+        deadline = time.time() + 30
+        while os.path.exists(trash_dir) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assert_path_does_not_exist(trash_dir)
+
+
+class StreamingRemovalTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(StreamingRemovalTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+
+    def test_that_removal_starts_before_discovery_finishes(self):
+        first, second = self.mkdirs(os.path.join('src', 'a', '__pycache__'),
+                                    os.path.join('src', 'b', '__pycache__'))
+        removed_early = []
+
+        def discover(*args, **kwargs):
+            yield discovery.Target('pycache', first)
+            deadline = time.time() + 5
+            while os.path.exists(first) and time.time() < deadline:
+                time.sleep(0.01)
+            removed_early.append(not os.path.exists(first))
+            yield discovery.Target('pycache', second)
+
+        with mock.patch.object(discovery, 'discover', discover):
+            run_setup('clean', '--pycache')
+        self.assertEqual(removed_early, [True])
+        self.assert_path_does_not_exist(second)
+
+    def test_that_discovery_waits_for_removal(self):
+        with mock.patch.object(engine, 'REMOVAL_BACKLOG', 1):
+            dirs = self.mkdirs(*[os.path.join('src', str(n), '__pycache__')
+                                 for n in range(10)])
+            run_setup('clean', '--pycache')
+        for dir_name in dirs:
+            self.assert_path_does_not_exist(dir_name)
+
+    def test_that_gathered_targets_are_not_rediscovered(self):
+        env_dir = self.mkdirs(os.path.join(self.test_root, 'env'))[0]
+        with mock.patch.object(engine.log, 'debug') as debug:
+            run_setup('clean', '--environment', '--patterns=env',
+                      '--virtualenv-dir={0}'.format(env_dir))
+        self.assert_path_does_not_exist(env_dir)
+        self.assertFalse(any('skipping' in c[0][0]
+                             for c in debug.call_args_list))
+
+    def test_that_consumer_failures_are_raised(self):
+        def fail(items):
+            next(items)
+            raise RuntimeError('failed')
+
+        consumer = pool.Consumer(fail, maxsize=1)
+        consumer.start()
+        for n in range(5):  # does not block once the consumer fails
+            consumer.put(n)
+        with self.assertRaises(RuntimeError):
+            consumer.close()
+
+
+class ThrottleTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(ThrottleTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        self.target = os.path.join(self.test_root, 'target')
+        self.mkdirs(os.path.join(self.target, 'nested'))
+        for name in ('a', os.path.join('nested', 'b')):
+            with open(os.path.join(self.target, name), 'wb') as f:
+                f.write(b'x' * 4096)
+
+    def test_that_bucket_delays_requests_beyond_the_burst(self):
+        sleep = mock.Mock()
+        bucket = throttle.TokenBucket(10, burst=1, clock=lambda: 100.0,
+                                      sleep=sleep)
+        self.assertEqual([bucket.take() for _ in range(3)], [0, 0.1, 0.2])
+        self.assertEqual([c[0][0] for c in sleep.call_args_list],
+                         [0.1, 0.2])
+
+    def test_that_large_requests_go_into_debt(self):
+        now = [0.0]
+        bucket = throttle.TokenBucket(100, clock=lambda: now[0],
+                                      sleep=mock.Mock())
+        self.assertEqual(bucket.take(500), 4.0)
+        now[0] = 5.0
+        self.assertEqual(bucket.take(100), 0)
+
+    def test_that_every_removal_waits(self):
+        limits = mock.Mock(spec=throttle.Throttle)
+        removal.TreeRemover(jobs=2, throttle=limits).purge(self.target)
+        self.assert_path_does_not_exist(self.target)
+        self.assertEqual(limits.wait.call_count, 4)
+        self.assertEqual(
+            sorted(c[0][0] for c in limits.wait.call_args_list),
+            [0, 0, 4096, 4096])
+
+    @unittest.skipUnless(removal.DescriptorRemover.supported,
+                         'descriptor relative removal is not supported')
+    def test_that_descriptor_removal_waits(self):
+        limits = throttle.Throttle(ops_per_sec=1000, bytes_per_sec=1 << 30)
+        with mock.patch.object(limits, 'wait') as wait:
+            removal.DescriptorRemover(jobs=2, throttle=limits).purge(
+                self.target)
+        self.assert_path_does_not_exist(self.target)
+        self.assertEqual(wait.call_count, 4)
+        self.assertEqual(sorted(c[0][0] for c in wait.call_args_list),
+                         [0, 0, 4096, 4096])
+
+    def test_that_clean_records_the_time_spent_waiting(self):
+        stats_file = os.path.join(self.test_root, 'stats.json')
+        run_setup('clean', '--environment', '--max-ops-per-sec=1000',
+                  '--max-bytes-per-sec=1G', '--stats={0}'.format(stats_file),
+                  '--virtualenv-dir={0}'.format(self.target))
+        self.assert_path_does_not_exist(self.target)
+        with open(stats_file) as f:
+            self.assertIn('throttle_wait', json.load(f)['phases']['remove'])
+
+    def test_that_idle_priority_is_requested(self):
+        with mock.patch.object(throttle, 'set_idle_priority',
+                               return_value=True) as set_idle_priority:
+            run_setup('clean', '--environment', '--idle-io', '--dry-run',
+                      '--virtualenv-dir={0}'.format(self.target))
+            self.assertFalse(set_idle_priority.called)
+            run_setup('clean', '--environment', '--idle-io',
+                      '--virtualenv-dir={0}'.format(self.target))
+            self.assertTrue(set_idle_priority.called)
+        self.assert_path_does_not_exist(self.target)
+
+    def test_that_invalid_limits_are_rejected(self):
+        for option in ('--max-ops-per-sec=0', '--max-ops-per-sec=fast',
+                       '--max-bytes-per-sec=lots'):
+            with self.assertRaises(SystemExit):
+                run_setup('clean', option)
+
+
+class JobsOptionTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def test_that_directories_are_removed_with_jobs(self):
+        dist_dir = self.create_directory('dist-dir')
+        self.mkdirs(os.path.join(dist_dir, 'a', 'b'))
+        run_setup(
+            'sdist', '--dist-dir={0}'.format(dist_dir),
+            'clean', '--dist', '--jobs=4',
+        )
+        self.assert_path_does_not_exist(dist_dir)
+
+    def test_that_invalid_jobs_are_rejected(self):
+        for value in ('0', 'many'):
+            with self.assertRaises(SystemExit):
+                run_setup('clean', '--jobs={0}'.format(value))
+
+
+class RecursiveProjectsTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(RecursiveProjectsTests, self).setUp()
+        self.test_root = self.create_directory('monorepo')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+
+    def create_project(self, name, setup_script=None):
+        project_dir = os.path.join(self.test_root, 'packages', name)
+        self.mkdirs(os.path.join(project_dir, 'build', 'lib'),
+                    os.path.join(project_dir, 'src', '__pycache__'))
+        with open(os.path.join(project_dir, 'setup.py'), 'w') as f:
+            f.write(setup_script or
+                    'import setuptools\n'
+                    'setuptools.setup(name={0!r}, py_modules=[])\n'.format(
+                        name))
+        return project_dir
+
+    def test_that_projects_are_found(self):
+        first = self.create_project('first')
+        second = os.path.join(self.test_root, 'second')
+        self.mkdirs(os.path.join(first, 'tests', 'fixture'),
+                    os.path.join(second, '.tox', 'nested'))
+        for path in (os.path.join(first, 'tests', 'fixture', 'setup.cfg'),
+                     os.path.join(second, 'pyproject.toml'),
+                     os.path.join(second, '.tox', 'nested', 'setup.py'),
+                     os.path.join(self.test_root, 'setup.py')):
+            open(path, 'w').close()
+        self.assertEqual(projects.find_projects(self.test_root),
+                         [first, second])
+
+    def test_that_each_project_is_cleaned(self):
+        project_dirs = [self.create_project(name)
+                        for name in ('first', 'second')]
+        run_setup('clean', '--recursive-projects', '--build', '--pycache',
+                  '--cache-dir=', '--jobs=2')
+        for project_dir in project_dirs:
+            self.assert_path_does_not_exist(project_dir, 'build')
+            self.assert_path_does_not_exist(
+                project_dir, 'src', '__pycache__')
+            self.assert_path_exists(project_dir, 'setup.py')
+
+    def test_that_projects_are_not_cleaned_by_the_parent(self):
+        project_dir = self.create_project('first')
+        with mock.patch.object(projects, 'clean_projects',
+                               return_value=iter([])):
+            run_setup('clean', '--recursive-projects', '--pycache')
+        self.assert_path_exists(project_dir, 'src', '__pycache__')
+
+    def test_that_failures_are_reported(self):
+        good = self.create_project('good')
+        self.create_project('bad', 'raise RuntimeError("broken")\n')
+        with self.assertRaises(SystemExit) as context:
+            run_setup('clean', '--recursive-projects', '--build',
+                      '--cache-dir=')
+        self.assertIn('failed to clean 1 of 2 projects',
+                      str(context.exception))
+        self.assert_path_does_not_exist(good, 'build')
+
+    def test_that_summary_counts_removals(self):
+        project_dir = self.create_project('first')
+        # the setup script imports setuptools which patches distutils
+        # so it has to run in a process of its own
+        summary, = projects.clean_projects(
+            [project_dir], janitor.CleanCommand,
+            {'build': 1, 'cache_dir': ''})
+        self.assertIsNone(summary['error'])
+        self.assertEqual(summary['project'], project_dir)
+        self.assertEqual(summary['targets'], 1)
+        self.assertEqual(summary['directories_removed'], 2)
+        self.assert_path_does_not_exist(project_dir, 'build')
+
+
+class DiskUsageTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(DiskUsageTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        self.big, self.small = self.mkdirs(
+            os.path.join(self.test_root, 'big', 'nested'),
+            os.path.join(self.test_root, 'small'))
+        with open(os.path.join(self.big, 'data'), 'wb') as f:
+            f.write(b'x' * 65536)
+        with open(os.path.join(self.small, 'data'), 'wb') as f:
+            f.write(b'x')
+
+    def test_that_trees_are_measured(self):
+        big = os.path.dirname(self.big)
+        measured = usage.measure([big, self.small], jobs=4)
+        self.assertEqual(measured[big].inodes, 3)
+        self.assertEqual(measured[self.small].inodes, 2)
+        self.assertGreaterEqual(measured[big].bytes, 65536)
+        self.assertGreater(measured[big].bytes, measured[self.small].bytes)
+
+    def test_that_hard_links_are_counted_once(self):
+        os.link(os.path.join(self.big, 'data'),
+                os.path.join(self.small, 'link'))
+        measured = usage.measure([self.big, self.small])
+        self.assertEqual(measured[self.big].inodes +
+                         measured[self.small].inodes, 4)
+
+    def test_that_missing_trees_are_empty(self):
+        missing = os.path.join(self.test_root, 'missing')
+        self.assertEqual(usage.measure([missing]),
+                         {missing: usage.Usage(0, 0)})
+
+    def test_that_report_is_ordered_by_size(self):
+        lines = list(usage.report(
+            {'a': 'pycache', 'b': 'build', 'c': 'pycache'},
+            {'a': usage.Usage(10, 1), 'b': usage.Usage(2048, 3),
+             'c': usage.Usage(4096, 2)}))
+        self.assertEqual(lines, [
+            'disk usage by target:',
+            '     4.0 KiB         2 inodes  pycache      c',
+            '     2.0 KiB         3 inodes  build        b',
+            '    10 bytes         1 inodes  pycache      a',
+            'disk usage by type:',
+            '     4.0 KiB         3 inodes  pycache',
+            '     2.0 KiB         3 inodes  build',
+            'total: 6.0 KiB in 6 inodes',
+        ])
+
+    def test_that_usage_is_reported_in_dry_run_mode(self):
+        dist_dir = os.path.dirname(self.big)
+        with mock.patch.object(janitor.log, 'info') as info:
+            run_setup(
+                'sdist', '--dist-dir={0}'.format(dist_dir),
+                'clean', '--dist', '--disk-usage', '--dry-run')
+        self.assert_path_exists(self.big)
+        lines = [c[0][0] for c in info.call_args_list]
+        self.assertIn('disk usage by target:', lines)
+        self.assertTrue(any(line.endswith('dist         ' + dist_dir)
+                            for line in lines))
+
+    def test_that_usage_is_reported_from_removal(self):
+        dist_dir = os.path.dirname(self.big)
+        with mock.patch.object(janitor.log, 'info') as info:
+            with mock.patch.object(usage, 'measure') as measure:
+                run_setup(
+                    'sdist', '--dist-dir={0}'.format(dist_dir),
+                    'clean', '--dist', '--disk-usage')
+        self.assertFalse(measure.called)
+        self.assert_path_does_not_exist(dist_dir)
+        lines = [c[0][0] for c in info.call_args_list]
+        row = [line for line in lines
+               if line.endswith('dist         ' + dist_dir)]
+        self.assertEqual(len(row), 1)
+        self.assertIn(' 3 inodes ', row[0])
+
+    def test_that_dry_runs_and_removal_report_the_same_usage(self):
+        def create_tree():
+            dist_dir = self.create_directory('dist')
+            for n in range(5):
+                self.mkdirs(os.path.join(dist_dir, str(n)))
+                with open(os.path.join(dist_dir, str(n), 'data'),
+                          'wb') as f:
+                    f.write(b'x' * 5000)
+            os.link(os.path.join(dist_dir, '0', 'data'),
+                    os.path.join(dist_dir, '1', 'link'))
+            return dist_dir
+
+        def total(*args):
+            dist_dir = create_tree()
+            with mock.patch.object(janitor.log, 'info') as info:
+                run_setup('sdist', '--dist-dir={0}'.format(dist_dir),
+                          'clean', '--dist', '--disk-usage', *args)
+            return [c[0][0] for c in info.call_args_list
+                    if c[0][0].startswith('total: ')]
+
+        for remover in removal.REMOVERS:
+            option = '--remover={0}'.format(remover)
+            expected = total('--dry-run', option)
+            self.assertEqual(len(expected), 1)
+            self.assertEqual(total(option), expected, remover)
+
+
+class StatsTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(StatsTests, self).setUp()
+        self.env_dir = self.create_directory('venv')
+        self.mkdirs(os.path.join(self.env_dir, 'lib'))
+        with open(os.path.join(self.env_dir, 'lib', 'data'), 'wb') as f:
+            f.write(b'x' * 8192)
+
+    def test_that_stats_are_written_as_json(self):
+        stats_file = os.path.join(self.create_directory('stats'), 'out')
+        run_setup('clean', '--environment', '--disk-usage',
+                  '--virtualenv-dir={0}'.format(self.env_dir),
+                  '--stats={0}'.format(stats_file))
+        with open(stats_file) as f:
+            document = json.load(f)
+        self.assertEqual(sorted(document['phases']),
+                         ['discover', 'gather', 'remove'])
+        removed = document['phases']['remove']
+        self.assertEqual(removed['files_removed'], 1)
+        self.assertEqual(removed['directories_removed'], 2)
+        self.assertGreaterEqual(removed['bytes_freed'], 8192)
+        self.assertIn('wall_time', removed)
+
+    def test_that_hook_receives_stats(self):
+        hook = mock.Mock(spec=stats.StatsHook)
+        distribution = dist.Distribution({
+            'script_name': 'setup.py',
+            'cmdclass': {'clean': janitor.CleanCommand}})
+        command = distribution.get_command_obj('clean')
+        command.environment = True
+        command.virtualenv_dir = self.env_dir
+        command.stats_hook = hook
+        distribution.run_command('clean')
+
+        self.assert_path_does_not_exist(self.env_dir)
+        self.assertEqual(
+            [c[0][0] for c in hook.phase_started.call_args_list],
+            ['gather', 'discover', 'remove'])
+        finished = dict(c[0] for c in hook.phase_finished.call_args_list)
+        self.assertEqual(finished['remove']['files_removed'], 1)
+
+    def test_that_repeated_phases_accumulate(self):
+        run_stats = stats.Stats()
+        with mock.patch.object(stats, 'timer', side_effect=[0, 1, 2, 4]):
+            for n in range(2):
+                with run_stats.phase('measure') as counters:
+                    counters.add(directories_scanned=n + 1)
+        measured = run_stats.as_dict()['phases']['measure']
+        self.assertEqual(measured['directories_scanned'], 3)
+        self.assertEqual(measured['wall_time'], 3)
+
+    def test_that_total_wall_time_is_elapsed_time(self):
+        run_stats = stats.Stats()
+        with mock.patch.object(stats, 'timer', side_effect=[0, 1, 2, 3]):
+            with run_stats.phase('remove'):
+                with run_stats.phase('measure'):
+                    pass
+        document = run_stats.as_dict()
+        self.assertEqual(document['phases']['remove']['wall_time'], 3)
+        self.assertEqual(document['phases']['measure']['wall_time'], 1)
+        self.assertEqual(document['wall_time'], 3)
+
+    def test_that_nothing_is_recorded_by_default(self):
+        with mock.patch.object(stats.Stats, 'phase') as phase:
+            run_setup('clean', '--environment',
+                      '--virtualenv-dir={0}'.format(self.env_dir))
+        self.assertFalse(phase.called)
+        self.assert_path_does_not_exist(self.env_dir)
+
+
+class ArtifactJournalTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(ArtifactJournalTests, self).setUp()
+        self.test_root = self.create_directory('test-root')
+        self.journal_file = os.path.join(self.test_root, 'journal')
+        self.build_dir, self.dist_dir = self.mkdirs(
+            os.path.join(self.test_root, 'build', 'lib'),
+            os.path.join(self.test_root, 'dist'))
+
+    def test_that_select_returns_journaled_targets(self):
+        artifacts = journal.Journal(self.journal_file)
+        artifacts.record('build', 'build', [self.build_dir])
+        artifacts.record('dist', 'sdist', [self.dist_dir, 'missing'])
+        targets, trusted = artifacts.select(['build'])
+        self.assertEqual(targets, {self.build_dir: 'build'})
+        self.assertEqual(trusted, set(['build']))
+
+    def test_that_modified_artifacts_are_not_trusted(self):
+        artifacts = journal.Journal(self.journal_file)
+        artifacts.record('build', 'build', [self.build_dir])
+        info = os.stat(self.build_dir)
+        os.utime(self.build_dir, (info.st_atime, info.st_mtime + 10))
+        targets, trusted = artifacts.select(['build'])
+        self.assertEqual(targets, {self.build_dir: 'build'})
+        self.assertEqual(trusted, set())
+
+    def test_that_discard_rewrites_the_journal(self):
+        artifacts = journal.Journal(self.journal_file)
+        artifacts.record('build', 'build', [self.build_dir])
+        artifacts.record('dist', 'sdist', [self.dist_dir])
+        artifacts.discard(['build'])
+        self.assertEqual(list(artifacts.read()), [self.dist_dir])
+        artifacts.discard(['dist'])
+        self.assert_path_does_not_exist(self.journal_file)
+
+    def test_that_commands_are_journaled_when_enabled(self):
+        class CustomDistCommand(core.Command):
+            user_options = []
+
+            def initialize_options(self):
+                self.dist_dir = None
+
+            def finalize_options(self):
+                self.dist_dir = dist_dir
+
+            def run(self):
+                os.mkdir(self.dist_dir)
+
+        dist_dir = os.path.join(self.test_root, 'my-dist')
+        distribution = dist.Distribution({
+            'script_name': 'setup.py',
+            'cmdclass': {'mydist': CustomDistCommand}})
+        distribution.get_option_dict('clean')['journal'] = (
+            'setup.cfg', self.journal_file)
+        journal.install(distribution)
+        distribution.run_command('mydist')
+        self.assertEqual(
+            journal.Journal(self.journal_file).select(['dist']),
+            ({dist_dir: 'dist'}, set(['dist'])))
+
+    def test_that_clean_uses_the_journal(self):
+        journal.Journal(self.journal_file).record(
+            'build', 'build', [self.build_dir])
+        with mock.patch.object(janitor, '_gather_attributes') as gather:
+            run_setup('clean', '--build',
+                      '--journal={0}'.format(self.journal_file))
+        self.assertFalse(gather.called)
+        self.assert_path_does_not_exist(self.build_dir)
+        self.assert_path_does_not_exist(self.journal_file)
+
+    def test_that_clean_falls_back_when_journal_has_drifted(self):
+        journal.Journal(self.journal_file).record(
+            'build', 'build', [self.build_dir])
+        os.rmdir(self.build_dir)
+        os.mkdir(self.build_dir)
+        info = os.stat(self.build_dir)
+        os.utime(self.build_dir, (info.st_atime, info.st_mtime + 10))
+        with mock.patch.object(janitor, '_gather_attributes',
+                               return_value=set()) as gather:
+            run_setup('clean', '--build', '--cache-dir=',
+                      '--journal={0}'.format(self.journal_file))
+        self.assertTrue(gather.called)
+        self.assert_path_does_not_exist(self.build_dir)
+
+
+class AttributeCacheTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(AttributeCacheTests, self).setUp()
+        self.cache_dir = self.create_directory('cache-dir')
+        self.dist_dir = self.create_directory('dist-dir')
+
+    def run_clean(self, *args):
+        self.mkdirs(os.path.join(self.dist_dir, 'sub'))
+        run_setup(
+            'sdist', '--dist-dir={0}'.format(self.dist_dir),
+            'clean', '--dist', '--cache-dir={0}'.format(self.cache_dir),
+            *args)
+        self.assert_path_does_not_exist(self.dist_dir)
+
+    def test_that_cached_directories_skip_finalization(self):
+        self.run_clean()
+        with mock.patch.object(janitor, '_gather_attributes') as gather:
+            self.run_clean()
+        self.assertFalse(gather.called)
+
+    def test_that_cache_is_invalidated_by_command_options(self):
+        self.run_clean()
+        self.dist_dir = self.create_directory('other-dist-dir')
+        with mock.patch.object(janitor, '_gather_attributes',
+                               wraps=janitor._gather_attributes) as gather:
+            self.run_clean()
+        self.assertTrue(gather.called)
+
+    def test_that_cache_is_not_written_in_dry_run_mode(self):
+        run_setup('clean', '--dist', '--dry-run',
+                  '--cache-dir={0}'.format(self.cache_dir))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_that_fingerprint_ignores_loaded_commands(self):
+        distribution = dist.Distribution({'script_name': 'setup.py'})
+        key = cache.fingerprint(distribution)
+        distribution.get_command_obj('sdist')
+        self.assertEqual(cache.fingerprint(distribution), key)
+
+    def test_that_corrupt_cache_files_are_ignored(self):
+        with open(cache.cache_path(self.cache_dir), 'w') as f:
+            f.write('not json')
+        self.run_clean()
+
+
+class JanitorProgramTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(JanitorProgramTests, self).setUp()
+        self.test_root = self.create_directory('program')
+        starting_dir = os.path.abspath(os.curdir)
+        self.addCleanup(os.chdir, starting_dir)
+        os.chdir(self.test_root)
+
+    @staticmethod
+    def write_file(name, *lines):
+        with open(name, 'w') as f:
+            f.write('\n'.join(lines + ('',)))
+
+    def test_that_settings_are_read_from_setup_cfg(self):
+        self.write_file('setup.cfg',
+                        '[clean]', 'pycache = 1',
+                        '[build]', 'build-base = out')
+        self.mkdirs(os.path.join('out', 'lib'), 'build',
+                    os.path.join('src', '__pycache__'))
+        self.assertEqual(cli.main(['-q', '--build']), 0)
+        self.assert_path_does_not_exist('out')
+        self.assert_path_does_not_exist('src', '__pycache__')
+        self.assert_path_exists('build')
+
+    def test_that_egg_base_is_read_from_egg_info(self):
+        self.write_file('setup.cfg', '[egg_info]', 'egg_base = src')
+        self.mkdirs(os.path.join('src', 'pkg.egg-info'))
+        cli.main(['-q', '--eggs'])
+        self.assert_path_does_not_exist('src', 'pkg.egg-info')
+
+    def test_that_setup_cfg_overrides_pyproject_toml(self):
+        try:
+            import tomllib  # noqa: F401
+        except ImportError:
+            try:
+                import tomli  # noqa: F401
+            except ImportError:
+                raise unittest.SkipTest('TOML parser is not available')
+        self.write_file('pyproject.toml',
+                        '[tool.distutils.clean]', 'dist = true',
+                        '[tool.distutils.sdist]', 'dist-dir = "toml-dist"',
+                        '[tool.distutils.bdist]', 'dist-dir = "toml-dist"')
+        self.write_file('setup.cfg', '[bdist]', 'dist_dir = cfg-dist')
+        self.mkdirs('toml-dist', 'cfg-dist', 'dist')
+        cli.main(['-q'])
+        self.assert_path_does_not_exist('toml-dist')
+        self.assert_path_does_not_exist('cfg-dist')
+        self.assert_path_exists('dist')
+
+    def test_that_dry_run_does_not_remove_anything(self):
+        self.write_file('setup.cfg', '[clean]', 'all = true')
+        self.mkdirs(os.path.join('src', '__pycache__'), 'dist')
+        cli.main(['-q', '--dry-run'])
+        self.assert_path_exists('src', '__pycache__')
+        self.assert_path_exists('dist')
+
+    def test_that_invalid_options_are_rejected(self):
+        self.write_file('setup.cfg', '[clean]', 'pycache = maybe')
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                cli.main([])
+            with self.assertRaises(SystemExit):
+                cli.main(['--jobs=0'])
+
+    def test_that_missing_directories_are_rejected(self):
+        with mock.patch('sys.stderr') as stderr:
+            with self.assertRaises(SystemExit) as context:
+                cli.main(['-C', os.path.join(self.test_root, 'missing')])
+        self.assertEqual(context.exception.code, 2)
+        output = ''.join(c[0][0] for c in stderr.write.call_args_list)
+        self.assertIn('cannot change to directory', output)
+
+    def test_that_distutils_is_not_imported(self):
+        os.makedirs(os.path.join('src', '__pycache__'))
+        package_root = os.path.dirname(os.path.abspath(janitor.__file__))
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.path.dirname(package_root)
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys\n'
+             'from setupext_janitor import cli\n'
+             'cli.main(["-q", "--pycache"])\n'
+             'print(sorted(m for m in sys.modules if m.split(".")[0]\n'
+             '             in ("distutils", "setuptools")))'],
+            env=env)
+        self.assertEqual(output.decode().strip(), '[]')
+        self.assert_path_does_not_exist('src', '__pycache__')
+
+
+class EmbeddingApiTests(DirectoryCleanupMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(EmbeddingApiTests, self).setUp()
+        self.root = self.create_directory('project')
+        with open(os.path.join(self.root, 'setup.cfg'), 'w') as f:
+            f.write('[clean]\npycache = 1\n[build]\nbuild_base = out\n')
+        self.build_dir, self.cache_dir = self.mkdirs(
+            os.path.join(self.root, 'out', 'lib'),
+            os.path.join(self.root, 'pkg', '__pycache__'))
+
+    def test_that_api_is_exported(self):
+        self.assertIs(setupext_janitor.plan, api.plan)
+        self.assertIs(setupext_janitor.execute, api.execute)
+        self.assertIs(setupext_janitor.Cleaner, engine.Cleaner)
+
+    def test_that_plan_is_lazy(self):
+        with mock.patch.object(discovery, 'list_directory',
+                               wraps=discovery.list_directory) as listing:
+            planned = setupext_janitor.plan(self.root, build=True)
+            self.assertFalse(listing.called)
+            targets = list(planned)
+        self.assertTrue(listing.called)
+        self.assertEqual(
+            sorted((kind, os.path.normpath(path)) for kind, path in targets),
+            [('build', os.path.join(self.root, 'out')),
+             ('pycache', self.cache_dir)])
+        self.assert_path_exists(self.build_dir)
+        self.assert_path_exists(self.cache_dir)
+
+    def test_that_options_override_settings(self):
+        targets = list(setupext_janitor.plan(self.root, pycache=False,
+                                             dist=True))
+        self.assertEqual(targets, [])
+
+    def test_that_execute_reports_progress(self):
+        progress = mock.Mock(spec=engine.ProgressHook)
+        result = setupext_janitor.execute(self.root, progress=progress,
+                                          dist=True)
+        self.assert_path_does_not_exist(self.cache_dir)
+        self.assert_path_exists(self.build_dir)
+        found = [c[0][0] for c in progress.target_found.call_args_list]
+        removed = [c[0][0] for c in progress.target_removed.call_args_list]
+        self.assertEqual(found, removed)
+        self.assertEqual([t.path for t in found], [self.cache_dir])
+        self.assertEqual(
+            result['phases']['remove']['directories_removed'], 1)
+
+    def test_that_dry_run_reports_without_removing(self):
+        progress = mock.Mock(spec=engine.ProgressHook)
+        setupext_janitor.execute(self.root, progress=progress, dry_run=True)
+        self.assertTrue(progress.target_removed.called)
+        self.assert_path_exists(self.cache_dir)
+
+    def test_that_journaled_paths_are_relative_to_root(self):
+        out_dir = os.path.join(self.root, 'out')
+        with open(os.path.join(self.root, 'journal.jsonl'), 'w') as f:
+            f.write(json.dumps({'kind': 'build', 'path': 'out',
+                                'command': 'build',
+                                'mtime': os.lstat(out_dir).st_mtime}))
+        caller = self.create_directory('caller')
+        decoy = self.mkdirs(os.path.join(caller, 'out', 'lib'))[0]
+        cwd = os.getcwd()
+        os.chdir(caller)
+        try:
+            setupext_janitor.execute(self.root, build=True, pycache=False,
+                                     journal='journal.jsonl')
+        finally:
+            os.chdir(cwd)
+        self.assert_path_does_not_exist(out_dir)
+        self.assert_path_exists(decoy)
+
+    def test_that_invalid_options_are_rejected(self):
+        with self.assertRaises(setupext_janitor.OptionError):
+            setupext_janitor.plan(self.root, jobs=0)
+        with self.assertRaises(TypeError):
+            setupext_janitor.plan(self.root, bogus=True)
+
+
+class MemoryFilesystemTests(unittest.TestCase):
+
+    def setUp(self):
+        super(MemoryFilesystemTests, self).setUp()
+        self.fs = filesystem.MemoryFilesystem()
+        for n in range(3):
+            package = os.path.join(os.sep, 'project', 'pkg{0}'.format(n))
+            self.fs.add_file(os.path.join(package, 'mod.py'), size=100)
+            self.fs.add_file(os.path.join(package, '__pycache__',
+                                          'mod.cpython-38.pyc'), size=200)
+        self.fs.add_file(os.path.join(os.sep, 'project', 'build', 'lib',
+                                      'mod.py'))
+        self.fs.add_directory(os.path.join(os.sep, 'project', 'dist'))
+
+    def cleaner(self, **options):
+        cleaner = engine.Cleaner(fs=self.fs, root=os.sep + 'project',
+                                 jobs=2, **options)
+        cleaner.finalize()
+        return cleaner
+
+    def test_that_entries_behave_like_the_os(self):
+        root = os.path.join(os.sep, 'project', 'pkg0')
+        self.assertEqual(sorted(self.fs.list_directory(root)),
+                         [('__pycache__', True), ('mod.py', False)])
+        self.assertEqual(self.fs.lstat(os.path.join(root, 'mod.py')).st_size,
+                         100)
+        self.assertTrue(self.fs.exists('project/pkg0'))
+        with self.assertRaises(OSError):
+            self.fs.rmdir(root)
+        with self.assertRaises(OSError):
+            self.fs.remove(os.path.join(root, '__pycache__'))
+        with self.assertRaises(OSError):
+            self.fs.listdir(os.path.join(root, 'missing'))
+
+    def test_that_clean_runs_in_memory(self):
+        planned = list(self.cleaner(build=True, pycache=True).plan(
+            lambda kind: ['build']))
+        self.assertEqual(
+            sorted((kind, os.path.basename(os.path.dirname(path)))
+                   for kind, path in planned),
+            [('build', 'project'), ('pycache', 'pkg0'),
+             ('pycache', 'pkg1'), ('pycache', 'pkg2')])
+
+        self.cleaner(build=True, pycache=True).execute(
+            lambda kind: ['build'])
+        self.assertFalse(self.fs.exists('project/build'))
+        self.assertFalse(self.fs.exists('project/pkg1/__pycache__'))
+        self.assertTrue(self.fs.exists('project/pkg1/mod.py'))
+        self.assertEqual(self.fs.count(), 8)
+
+    def test_that_disk_usage_is_measured_in_memory(self):
+        used = usage.measure(['project/pkg0', 'project/pkg1'], fs=self.fs)
+        self.assertEqual(used['project/pkg0'], usage.Usage(300, 4))
+
+    def test_that_injected_failures_are_reported(self):
+        cache_dir = os.path.join(os.sep, 'project', 'pkg0', '__pycache__')
+        self.fs.fail(os.path.join(cache_dir, 'mod.cpython-38.pyc'),
+                     'remove')
+        counters = stats.Counters()
+        removal.TreeRemover(fs=self.fs, counters=counters).purge(cache_dir)
+        self.assertEqual(counters.values['errors'], 2)
+        self.assertTrue(self.fs.exists(cache_dir))
+        self.assertEqual(self.fs.operations['remove'], 1)
+
+    def test_that_latency_can_be_added(self):
+        fs = filesystem.LatencyFilesystem(0, fs=self.fs)
+        removal.LatencyHidingRemover(jobs=4, fs=fs).purge('project')
+        self.assertFalse(self.fs.exists('project'))
+        self.assertEqual(self.fs.count(), 0)
+
+    def test_that_symlinked_roots_are_followed_in_the_backend(self):
+        root = os.path.join(os.sep, 'project')
+        real_lstat = self.fs.lstat
+        link = os.stat_result((0o120777, 0, 0, 1, 0, 0, 0, 0, 0, 0))
+        with mock.patch.object(
+                self.fs, 'lstat',
+                lambda path: link if path == root else real_lstat(path)):
+            targets = list(discovery.discover(
+                root, [discovery.Rule('pycache',
+                                      lambda name: name == '__pycache__')],
+                fs=self.fs))
+        self.assertEqual(len(targets), 3)
+        self.assertEqual(self.fs.operations['stat'], 1)
+
+    def test_that_os_only_options_are_rejected(self):
+        for name in engine.OS_ONLY_OPTIONS:
+            cleaner = engine.Cleaner(fs=self.fs, **{name: '1'})
+            with self.assertRaises(engine.OptionError):
+                cleaner.finalize()
+
+
 class DistutilFinalizationErrorTests(unittest.TestCase):
     @staticmethod
     def test_for_issue_12_regression():
@@ -384,7 +2191,7 @@ class DistutilFinalizationErrorTests(unittest.TestCase):
         # commands.
         from distutils.command.bdist_rpm import os as target_module
         with mock.patch.object(target_module, 'name', new='nt', create=True):
-            run_setup('clean', '--dist')
+            run_setup('clean', '--dist', '--cache-dir=')
 
     @staticmethod
     def test_that_platform_errors_are_ignored_during_finalization():
@@ -413,6 +2220,6 @@ class DistutilFinalizationErrorTests(unittest.TestCase):
         core.setup(
             distclass=CustomDistribution,
             script_name='testsetup.py',
-            script_args=['clean', '--dist'],
+            script_args=['clean', '--dist', '--cache-dir='],
             cmdclass={'clean': janitor.CleanCommand},
         )